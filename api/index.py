@@ -1,14 +1,73 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.websockets import WebSocketState
 from fastapi.middleware.cors import CORSMiddleware
 import httpx
 import asyncio
 import os
 import json
-from collections import Counter
+import re
+import gzip
+import hashlib
+import hmac
+import bisect
+import heapq
+from collections import Counter, OrderedDict, defaultdict, namedtuple
 import tempfile
 import time
+import sqlite3
+import threading
+import sys
+import atexit
+import queue
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from contextlib import asynccontextmanager, AsyncExitStack
 
-app = FastAPI()
+try:
+    import msgpack
+except ImportError:
+    msgpack = None  # Sin msgpack las partidas compactas se guardan como JSON
+
+try:
+    from sortedcontainers import SortedList
+except ImportError:
+    SortedList = None  # Sin sortedcontainers el board es una lista con bisect (insertar pasa a O(n))
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # Sin orjson se usa el json estándar (más lento)
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # Sin brotli las respuestas se comprimen solo con gzip
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # Sin numpy no se calcula la analítica (/api/analitica responde 503)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Un solo pool de conexiones por proceso: el ranking reutiliza conexiones calientes
+    # en vez de pagar un handshake TLS nuevo por cada request
+    get_http_client()
+    tarea_lag = asyncio.create_task(medir_lag_event_loop())
+    # Refresco del ranking por tandas en segundo plano
+    tarea_refresco = asyncio.create_task(ciclo_refresco()) if REFRESCO_CICLO else None
+    yield
+    if tarea_refresco:
+        tarea_refresco.cancel()
+    for tarea in tareas_fondo.values():
+        tarea.cancel()
+    tarea_lag.cancel()
+    await cerrar_http_client()
+    if redis_client:
+        await redis_client.aclose()
+
+app = FastAPI(lifespan=lifespan)
 
 # Habilitar CORS para que el frontend (puerto 3000) pueda llamar al backend (puerto 8000)
 app.add_middleware(
@@ -22,83 +81,505 @@ app.add_middleware(
 # --- CONFIGURACIÓN ---
 # Lo ideal es usar variables de entorno, pero para probar rápido pon tu Key aquí:
 RIOT_API_KEY = os.environ.get("RIOT_API_KEY", "RGAPI-bec81743-609c-4b83-8ff1-8e71ee44e89d")
-REGION_ACCOUNT = "americas"
-REGION_LEAGUE = "la2" # LAS
+# Plataforma (servidor) de cada jugador -> cluster de routing regional de match-v5.
+# account-v1 no atiende en "sea", así que esas cuentas se buscan en "asia".
+PLATAFORMAS = {
+    "na1": "americas", "br1": "americas", "la1": "americas", "la2": "americas",
+    "euw1": "europe", "eun1": "europe", "tr1": "europe", "ru": "europe", "me1": "europe",
+    "kr": "asia", "jp1": "asia",
+    "oc1": "sea", "ph2": "sea", "sg2": "sea", "th2": "sea", "tw2": "sea", "vn2": "sea",
+}
+PLATAFORMA_DEFECTO = os.environ.get("RIOT_PLATAFORMA", "la2")  # LAS
+# Base de las URLs de Riot; se puede apuntar a un mock local (ver bench/mock_riot.py),
+# ej: RIOT_API_BASE="http://127.0.0.1:9000/{region}"
+RIOT_API_BASE = os.environ.get("RIOT_API_BASE", "https://{region}.api.riotgames.com")
+
+def riot_url(region, path):
+    return RIOT_API_BASE.format(region=region) + path
+
+def region_partidas(plataforma):
+    return PLATAFORMAS.get(plataforma, PLATAFORMAS[PLATAFORMA_DEFECTO])
+
+def region_cuentas(plataforma):
+    region = region_partidas(plataforma)
+    return "asia" if region == "sea" else region
+
+def region_de_partida(mid):
+    """Los IDs de partida empiezan con su plataforma (ej: LA2_1234)"""
+    return region_partidas(mid.split("_", 1)[0].lower())
+
+# Plataforma de cada PUUID conocido (la de su roster, o la del request que lo buscó).
+# La de un request (?plataforma=) es solo una sugerencia hasta que account-v1 la confirma
+PLATAFORMAS_CONSULTADAS_MAX = int(os.environ.get("PLATAFORMAS_CONSULTADAS_MAX", "10000"))
+
+class Plataformas:
+    """
+    Las de los miembros de un roster quedan fijas (confirmadas); las de jugadores buscados
+    por /api/jugador van en un LRU acotado, así una avalancha de Riot IDs no hace crecer
+    el proceso sin límite (perder una solo cuesta volver a leer region:{puuid} del caché)
+    """
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self.fijas = {}                   # puuid -> plataforma
+        self.consultadas = OrderedDict()  # puuid -> (plataforma, verificada)
+
+    def get(self, puuid):
+        if puuid in self.fijas:
+            return self.fijas[puuid]
+        entrada = self.consultadas.get(puuid)
+        return entrada[0] if entrada else PLATAFORMA_DEFECTO
+
+    def verificada(self, puuid):
+        if puuid in self.fijas:
+            return True
+        entrada = self.consultadas.get(puuid)
+        return bool(entrada and entrada[1])
+
+    def _consultada(self, puuid, plataforma, verificada):
+        self.consultadas[puuid] = (plataforma, verificada)
+        self.consultadas.move_to_end(puuid)
+        while len(self.consultadas) > self.max_items:
+            self.consultadas.popitem(last=False)
+
+    def confirmar(self, puuid, plataforma):
+        """account-v1 dijo dónde juega"""
+        if puuid in self.fijas:
+            self.fijas[puuid] = plataforma
+        else:
+            self._consultada(puuid, plataforma, True)
+
+    def sugerir(self, puuid, plataforma):
+        """La del request, mientras no haya una mejor"""
+        if puuid not in self.fijas and puuid not in self.consultadas:
+            self._consultada(puuid, plataforma, False)
+
+    def fijar(self, puuid, plataforma):
+        """Miembro de un roster: se queda mientras esté en alguno"""
+        self.consultadas.pop(puuid, None)
+        self.fijas[puuid] = plataforma
+
+    def soltar(self, puuid):
+        """Ya no está en ningún roster: pasa al LRU"""
+        plataforma = self.fijas.pop(puuid, None)
+        if plataforma is not None:
+            self._consultada(puuid, plataforma, True)
+
+plataformas = Plataformas(PLATAFORMAS_CONSULTADAS_MAX)
+
+def plataforma_de(puuid):
+    return plataformas.get(puuid)
+
+# --- LOGS Y MÉTRICAS ---
+# Los logs se escriben desde un thread aparte (QueueListener) para no bloquear el event
+# loop con stdout. LOG_FORMAT=json emite una línea JSON por evento; los logs por key
+# (hits/misses del caché) solo salen con LOG_VERBOSE=1.
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "texto")
+LOG_VERBOSE = os.environ.get("LOG_VERBOSE", "0") == "1"
+
+class FormatoLog(logging.Formatter):
+    """Los mensajes son plantillas str.format con los campos del evento (se formatean solo si se emiten)"""
+
+    def format(self, record):
+        campos = getattr(record, "campos", {})
+        mensaje = record.msg.format(**campos) if campos else record.msg
+        if LOG_FORMAT == "json":
+            datos = {"ts": round(record.created, 3), "nivel": record.levelname.lower(), "msg": mensaje, **campos}
+            if record.exc_info:
+                datos["exc"] = self.formatException(record.exc_info)
+            return json.dumps(datos, ensure_ascii=False, default=str)
+        if record.exc_info:
+            mensaje += "\n" + self.formatException(record.exc_info)
+        return mensaje
+
+logger = logging.getLogger("soloq")
+logger.setLevel(logging.DEBUG if LOG_VERBOSE else logging.INFO)
+logger.propagate = False
+_cola_logs = queue.SimpleQueue()
+_handler_cola = QueueHandler(_cola_logs)
+_handler_cola.setFormatter(FormatoLog())
+logger.addHandler(_handler_cola)
+_log_listener = QueueListener(_cola_logs, logging.StreamHandler(sys.stdout))
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+def log(mensaje, nivel=logging.INFO, exc_info=False, **campos):
+    logger.log(nivel, mensaje, exc_info=exc_info, extra={"campos": campos})
 
-# --- CACHÉ (Vercel KV / Redis) ---
+def log_debug(mensaje, **campos):
+    if LOG_VERBOSE:
+        logger.debug(mensaje, extra={"campos": campos})
+
+def _etiquetas(nombres, valores):
+    if not nombres:
+        return ""
+    pares = []
+    for nombre, valor in zip(nombres, valores):
+        valor = str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pares.append(f'{nombre}="{valor}"')
+    return "{" + ",".join(pares) + "}"
+
+class Contador:
+    """Métrica acumulativa (counter o gauge de Prometheus) con etiquetas"""
+
+    def __init__(self, nombre, ayuda, etiquetas=(), tipo="counter"):
+        self.nombre, self.ayuda, self.etiquetas, self.tipo = nombre, ayuda, etiquetas, tipo
+        self.valores = defaultdict(float)
+
+    def inc(self, *etiquetas, n=1):
+        self.valores[etiquetas] += n
+
+    def set(self, valor, *etiquetas):
+        self.valores[etiquetas] = valor
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} {self.tipo}"]
+        for etiquetas, valor in self.valores.items():
+            lineas.append(f"{self.nombre}{_etiquetas(self.etiquetas, etiquetas)} {valor}")
+        return lineas
+
+class Histograma:
+    """Histograma de Prometheus (buckets acumulativos + _sum + _count) con etiquetas"""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS):
+        self.nombre, self.ayuda, self.etiquetas, self.buckets = nombre, ayuda, etiquetas, buckets
+        self.series = {}  # etiquetas -> [conteos por bucket, suma, total]
+
+    def observar(self, valor, *etiquetas):
+        serie = self.series.get(etiquetas)
+        if serie is None:
+            serie = self.series[etiquetas] = [[0] * len(self.buckets), 0.0, 0]
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                serie[0][i] += 1
+                break
+        serie[1] += valor
+        serie[2] += 1
+
+    def exponer(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        nombres = self.etiquetas + ("le",)
+        for etiquetas, (conteos, suma, total) in self.series.items():
+            acumulado = 0
+            for limite, conteo in zip(self.buckets, conteos):
+                acumulado += conteo
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(nombres, etiquetas + (limite,))} {acumulado}")
+            lineas.append(f"{self.nombre}_bucket{_etiquetas(nombres, etiquetas + ('+Inf',))} {total}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, etiquetas)} {suma}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, etiquetas)} {total}")
+        return lineas
+
+class Metricas:
+    riot_latencia = Histograma("soloq_riot_request_seconds", "Latencia de las llamadas a Riot", ("familia",))
+    riot_respuestas = Contador("soloq_riot_responses_total", "Respuestas de Riot por status", ("familia", "status"))
+    riot_429 = Contador("soloq_riot_429_total", "Respuestas 429 de Riot", ("familia", "tipo"))
+    riot_reintentos = Contador("soloq_riot_retries_total", "Reintentos tras un 429", ("familia",))
+    riot_timeouts = Contador("soloq_riot_timeouts_total", "Timeouts llamando a Riot", ("familia",))
+    riot_errores = Contador("soloq_riot_errors_total", "Errores de red llamando a Riot", ("familia",))
+    riot_pool_agotado = Contador("soloq_riot_pool_timeouts_total",
+                                 "Llamadas a Riot que no consiguieron conexión del pool local", ("familia",))
+    ranking_fases = Histograma("soloq_ranking_build_seconds", "Duración de la generación del ranking por fase", ("fase",),
+                               buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 30.0))
+    cache_coalescidas = Contador("soloq_cache_coalesced_total",
+                                 "Misses que esperaron una búsqueda en vuelo de la misma key", ("tipo",))
+    cache_negativos = Contador("soloq_cache_negative_hits_total", "Hits de resultados 404 guardados en caché", ("tipo",))
+    ranking_revisiones = Contador("soloq_ranking_checks_total", "Jugadores revisados en las tandas por resultado",
+                                  ("resultado",))
+    lag_loop = Histograma("soloq_event_loop_lag_seconds", "Retraso del event loop respecto a lo esperado",
+                          buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+    @classmethod
+    def todas(cls):
+        return [v for v in vars(cls).values() if isinstance(v, (Contador, Histograma))]
+
+async def medir_lag_event_loop(intervalo=0.5):
+    """Mide cuánto se atrasa un sleep: si el loop está bloqueado, el lag sube"""
+    while True:
+        inicio = time.perf_counter()
+        await asyncio.sleep(intervalo)
+        Metricas.lag_loop.observar(max(0.0, time.perf_counter() - inicio - intervalo))
+
+# --- CACHÉ (memoria LRU -> disco /tmp -> Vercel KV / Redis) ---
+# Las lecturas van de la capa más rápida a la más lenta y un hit en una capa lenta
+# se copia a las rápidas con el TTL que le queda. Todas las capas respetan el TTL de cada key.
 # Si configuras Vercel KV, estas variables se inyectan automáticamente.
-KV_URL = os.environ.get("KV_URL")
 KV_URL = os.environ.get("KV_URL") or os.environ.get("REDIS_URL")
+CACHE_MAX_ITEMS = int(os.environ.get("CACHE_MAX_ITEMS", "5000"))  # Tope de keys en memoria
+# Caché en disco: "1" siempre, "0" nunca, "auto" solo cuando no hay Redis
+CACHE_DISK = os.environ.get("CACHE_DISK", "auto")
+CACHE_DIR = tempfile.gettempdir()
 redis_client = None
+RedisWatchError = ()  # Con redis instalado: el conflicto de un WATCH/MULTI (no es un error)
 
 if KV_URL:
     try:
-        from redis import Redis
-        redis_client = Redis.from_url(KV_URL)
-        print("✅ Conectado a Vercel KV (Redis)")
+        from redis import asyncio as redis_asyncio
+        from redis.exceptions import WatchError as RedisWatchError
+        redis_client = redis_asyncio.from_url(KV_URL)
+        log("✅ Conectado a Vercel KV (Redis)")
     except ImportError:
-        print("⚠️ KV_URL detectada pero falta librería 'redis'.")
+        log("⚠️ KV_URL detectada pero falta librería 'redis'.", logging.WARNING)
 
-# Caché local en memoria (fallback si no hay Redis, se borra al reiniciar)
-LOCAL_CACHE = {}
+# Contadores por capa para /api/cache/stats
+CACHE_STATS = {
+    capa: {"hits": 0, "misses": 0, "evictions": 0, "expired": 0, "errors": 0}
+    for capa in ("memoria", "disco", "redis")
+}
+
+class CacheMemoria:
+    """LRU acotado en memoria con expiración por entrada (se borra al reiniciar)"""
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self.datos = OrderedDict()  # key -> (expira, valor)
+
+    def __len__(self):
+        return len(self.datos)
+
+    def get(self, key, ahora):
+        entrada = self.datos.get(key)
+        if entrada is None:
+            return None
+        if entrada[0] <= ahora:
+            del self.datos[key]
+            CACHE_STATS["memoria"]["expired"] += 1
+            return None
+        self.datos.move_to_end(key)
+        return entrada
+
+    def set(self, key, valor, expira):
+        self.datos[key] = (expira, valor)
+        self.datos.move_to_end(key)
+        while len(self.datos) > self.max_items:
+            self.datos.popitem(last=False)
+            CACHE_STATS["memoria"]["evictions"] += 1
+
+def json_bytes(valor):
+    """JSON compacto en UTF-8 (con orjson si está instalado)"""
+    if orjson:
+        return orjson.dumps(valor, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(valor, ensure_ascii=False, separators=(",", ":")).encode()
+
+def json_cargar(data):
+    return orjson.loads(data) if orjson else json.loads(data)
+
+# Valores binarios (ej: partidas compactas) se guardan tal cual con un prefijo "B";
+# el resto va como JSON, que nunca empieza con "B"
+def serializar_cache(valor):
+    if isinstance(valor, bytes):
+        return b"B" + valor
+    return json_bytes(valor)
+
+def deserializar_cache(data):
+    if data[:1] == b"B":
+        return bytes(data[1:])
+    return json_cargar(data)
+
+class CacheDisco:
+    """Un archivo por key en /tmp (en Vercel sobrevive entre requests de la misma instancia)"""
+
+    def __init__(self, directorio):
+        self.directorio = directorio
+
+    def ruta(self, key):
+        return os.path.join(self.directorio, f"lol_cache_{key.replace(':', '_').replace('/', '_')}.bin")
+
+    def get(self, key, ahora):
+        ruta = self.ruta(key)
+        try:
+            with open(ruta, 'rb') as f:
+                # Primera línea: timestamp de expiración; resto: el valor serializado
+                cabecera = f.readline()
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            expira = float(cabecera)
+        except ValueError:
+            expira = 0  # Archivo corrupto o de un formato viejo
+        if expira <= ahora:
+            CACHE_STATS["disco"]["expired"] += 1
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+            return None
+        return expira, deserializar_cache(data)
+
+    def set(self, key, valor, expira):
+        ruta = self.ruta(key)
+        tmp = f"{ruta}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(f"{expira}\n".encode())
+            f.write(serializar_cache(valor))
+        os.replace(tmp, ruta)  # Atómico: nadie lee un archivo a medio escribir
+
+cache_memoria = CacheMemoria(CACHE_MAX_ITEMS)
+cache_disco = None
+if CACHE_DISK == "1" or (CACHE_DISK == "auto" and not redis_client):
+    cache_disco = CacheDisco(CACHE_DIR)
 
 async def get_cache(key: str):
+    ahora = time.time()
+
+    # 1. Memoria
+    entrada = cache_memoria.get(key, ahora)
+    if entrada is not None:
+        CACHE_STATS["memoria"]["hits"] += 1
+        log_debug("📦 CACHÉ HIT (Memoria): {key}", key=key)
+        return entrada[1]
+    CACHE_STATS["memoria"]["misses"] += 1
+
+    # 2. Disco
+    if cache_disco:
+        try:
+            entrada = cache_disco.get(key, ahora)
+        except Exception as e:
+            CACHE_STATS["disco"]["errors"] += 1
+            log("Error leyendo caché de archivo: {error}", logging.WARNING, error=str(e))
+            entrada = None
+        if entrada is not None:
+            CACHE_STATS["disco"]["hits"] += 1
+            log_debug("📦 CACHÉ HIT (Archivo): {key}", key=key)
+            cache_memoria.set(key, entrada[1], entrada[0])
+            return entrada[1]
+        CACHE_STATS["disco"]["misses"] += 1
+
+    # 3. Redis (el TTL restante viene en la misma ida y vuelta)
     if redis_client:
         try:
-            data = redis_client.get(key)
-            if data:
-                print(f"📦 CACHÉ HIT (Redis): {key}")
-                return json.loads(data)
-            else:
-                print(f"❌ CACHÉ MISS (Redis): {key}")
-                return None
+            async with redis_client.pipeline(transaction=False) as pipe:
+                data, pttl = await pipe.get(key).pttl(key).execute()
         except Exception as e:
-            print(f"⚠️ Error Redis: {e}")
-            return None
-    
-    # Fallback: usar /tmp en Vercel (persiste ~5 min entre requests)
-    try:
-        cache_file = os.path.join(tempfile.gettempdir(), f"lol_cache_{key.replace(':', '_').replace('/', '_')}.json")
-        if os.path.exists(cache_file):
-            # Verificar que no haya expirado (5 minutos)
-            if time.time() - os.path.getmtime(cache_file) < 300:
-                with open(cache_file, 'r') as f:
-                    print(f"📦 CACHÉ HIT (Archivo): {key}")
-                    return json.load(f)
-            else:
-                print(f"⏰ CACHÉ EXPIRADO (Archivo): {key}")
-    except Exception as e:
-        print(f"Error leyendo caché de archivo: {e}")
-    
-    # Memoria local
-    if key in LOCAL_CACHE:
-        print(f"📦 CACHÉ HIT (Memoria): {key}")
-        return LOCAL_CACHE[key]
-    
-    print(f"❌ CACHÉ MISS (Todos): {key}")
+            CACHE_STATS["redis"]["errors"] += 1
+            log("⚠️ Error Redis: {error}", logging.WARNING, error=str(e))
+            data = None
+        if data:
+            CACHE_STATS["redis"]["hits"] += 1
+            log_debug("📦 CACHÉ HIT (Redis): {key}", key=key)
+            valor = deserializar_cache(data)
+            if pttl and pttl > 0:
+                expira = ahora + pttl / 1000
+                cache_memoria.set(key, valor, expira)
+                if cache_disco:
+                    try:
+                        cache_disco.set(key, valor, expira)
+                    except Exception as e:
+                        CACHE_STATS["disco"]["errors"] += 1
+                        log("Error escribiendo caché en archivo: {error}", logging.WARNING, error=str(e))
+            return valor
+        CACHE_STATS["redis"]["misses"] += 1
+
+    log_debug("❌ CACHÉ MISS (Todos): {key}", key=key)
     return None
 
 async def set_cache(key: str, value: any, ttl: int = 300):
-    """ttl en segundos (default 5 min)"""
+    """ttl en segundos (default 5 min). Se escribe en todas las capas activas"""
+    expira = time.time() + ttl
+    cache_memoria.set(key, value, expira)
+    if cache_disco:
+        try:
+            cache_disco.set(key, value, expira)
+        except Exception as e:
+            CACHE_STATS["disco"]["errors"] += 1
+            log("Error escribiendo caché en archivo: {error}", logging.WARNING, error=str(e))
     if redis_client:
         try:
-            redis_client.setex(key, ttl, json.dumps(value))
-            print(f"💾 GUARDADO EN CACHÉ (Redis): {key} (TTL: {ttl}s)")
+            await redis_client.set(key, serializar_cache(value), ex=ttl)
         except Exception as e:
-            print(f"⚠️ Error guardando en Redis: {e}")
-    else:
-        # Guardar en /tmp para persistir entre requests en Vercel
+            CACHE_STATS["redis"]["errors"] += 1
+            log("⚠️ Error guardando en Redis: {error}", logging.WARNING, error=str(e))
+    log_debug("💾 GUARDADO EN CACHÉ: {key} (TTL: {ttl}s)", key=key, ttl=ttl)
+
+class CacheNoDisponible(Exception):
+    """La capa compartida falló: mejor no seguir con una copia local que puede ser vieja"""
+
+async def get_cache_compartido(key: str):
+    """
+    Lee `key` de la capa compartida entre procesos (Redis o, sin Redis, el disco) sin pasar
+    por la memoria, que puede guardar por meses una copia que otra instancia ya cambió.
+    Para datos que se editan desde varios procesos (rosters, agregados).
+    """
+    if redis_client:
+        try:
+            data = await redis_client.get(key)
+        except Exception as e:
+            CACHE_STATS["redis"]["errors"] += 1
+            raise CacheNoDisponible(str(e)) from e
+        CACHE_STATS["redis"]["hits" if data else "misses"] += 1
+        return deserializar_cache(data) if data else None
+    if cache_disco:
         try:
-            cache_file = os.path.join(tempfile.gettempdir(), f"lol_cache_{key.replace(':', '_').replace('/', '_')}.json")
-            with open(cache_file, 'w') as f:
-                json.dump(value, f)
-            print(f"💾 GUARDADO EN CACHÉ (Archivo): {key} (TTL: {ttl}s)")
+            entrada = cache_disco.get(key, time.time())
         except Exception as e:
-            print(f"Error escribiendo caché en archivo: {e}")
-        LOCAL_CACHE[key] = value
-        print(f"💾 GUARDADO EN CACHÉ (Memoria): {key}")
+            CACHE_STATS["disco"]["errors"] += 1
+            raise CacheNoDisponible(str(e)) from e
+        CACHE_STATS["disco"]["hits" if entrada else "misses"] += 1
+        return entrada[1] if entrada else None
+    # Sin capa compartida hay un solo proceso: la memoria es la fuente
+    entrada = cache_memoria.get(key, time.time())
+    return entrada[1] if entrada else None
 
-# Lista de amigos para trackear (Ejemplo)
+# --- SINGLE-FLIGHT Y CACHÉ NEGATIVO ---
+# Varios misses concurrentes de la misma key (dos /api/jugador que comparten partidas, una
+# tanda del ranking junto a un detalle) esperan la misma llamada a Riot en vez de hacer una
+# cada uno. Los 404 también se guardan, con un TTL más corto, para no volver a preguntar
+# en cada request por un Riot ID que no existe.
+NO_ENCONTRADO = "__404__"  # Valor guardado en caché para un recurso que Riot no tiene
+NEGATIVO_TTL = int(os.environ.get("NEGATIVO_TTL", "600"))
+en_vuelo = {}  # key -> Future con el resultado de la búsqueda en curso
+
+async def cache_o_buscar(key, buscar, ttl, ttl_negativo=NEGATIVO_TTL, valido=None, faltante=None):
+    """
+    Valor de `key` en caché o, si no está, el de `buscar()` (una sola vez por key aunque lo
+    pidan varios a la vez). `buscar` devuelve el valor a guardar, NO_ENCONTRADO para un 404
+    o None si falló (429, timeout): eso no se guarda. Un 404 se devuelve como `faltante`
+    (None por defecto; otro valor si el que llama tiene que distinguirlo de un fallo).
+    Un valor en caché que no pasa `valido` (otro formato) cuenta como miss.
+    """
+    tipo = key.split(":", 1)[0]
+    valor = await get_cache(key)
+    if valor is None:
+        # La búsqueda que estábamos por esperar pudo terminar mientras leíamos Redis
+        entrada = cache_memoria.get(key, time.time())
+        valor = entrada[1] if entrada else None
+    if valor is not None and valor != NO_ENCONTRADO and valido and not valido(valor):
+        valor = None
+    if valor is not None:
+        if valor == NO_ENCONTRADO:
+            Metricas.cache_negativos.inc(tipo)
+            return faltante
+        return valor
+
+    futuro = en_vuelo.get(key)
+    if futuro is not None:
+        Metricas.cache_coalescidas.inc(tipo)
+        return await asyncio.shield(futuro)
+
+    futuro = en_vuelo[key] = asyncio.get_running_loop().create_future()
+    try:
+        valor = await buscar()
+        if valor is not None:
+            await set_cache(key, valor, ttl=ttl_negativo if valor == NO_ENCONTRADO else ttl)
+        if valor == NO_ENCONTRADO:
+            valor = faltante
+        futuro.set_result(valor)
+        return valor
+    except asyncio.CancelledError:
+        # Se canceló quien buscaba: los que esperan lo ven como una búsqueda fallida
+        futuro.set_result(None)
+        raise
+    except Exception as e:
+        futuro.set_exception(e)
+        futuro.exception()  # Si nadie esperaba no queremos el aviso de excepción sin leer
+        raise
+    finally:
+        del en_vuelo[key]
+
+# Jugadores con los que se siembra el roster por defecto la primera vez (después los
+# rosters se editan por /api/rosters)
 AMIGOS = [
     {"nombre": "Tobio", "tag": "CHL"},
     {"nombre": "AintaxLsj", "tag": "2025"},
@@ -114,48 +595,275 @@ AMIGOS = [
     {"nombre": "teas al dm", "tag": "shifu"},
 ]
 
-# Semáforo para limitar concurrencia y no saturar la API key de desarrollo
-# (Las keys de dev suelen permitir ~20 requests/segundo)
-sem = asyncio.Semaphore(5)  # Reducido a 5 para mayor estabilidad
+# --- RATE LIMIT (Riot) ---
+# Riot limita por ventanas de tiempo, ej: "20:1,100:120" = 20 req/s y 100 req cada 2 min.
+# Los límites de aplicación son por host de routing (americas, la2...) y los de método
+# por host + endpoint, así que llevamos un bucket por cada uno y los ajustamos con los
+# headers X-App-Rate-Limit / X-Method-Rate-Limit que devuelve cada respuesta.
+RIOT_APP_RATE_LIMIT = os.environ.get("RIOT_APP_RATE_LIMIT", "20:1,100:120")  # Límites de una key de desarrollo
+
+# Familias de endpoints (cada una tiene su propio límite de método)
+RIOT_FAMILIAS = (
+    ("/riot/account/", "account"),
+    ("/lol/league/", "league"),
+    ("/lol/spectator/", "spectator"),
+    ("/lol/match/", "match"),
+)
+
+def parse_rate_limit(header):
+    """'20:1,100:120' -> [(20, 1), (100, 120)]. También sirve para los headers *-Count"""
+    ventanas = []
+    for parte in (header or "").split(","):
+        try:
+            cantidad, segundos = parte.strip().split(":")
+            ventanas.append((int(cantidad), int(segundos)))
+        except ValueError:
+            continue
+    return ventanas
+
+def clasificar_endpoint(url: str):
+    """Devuelve (host, familia) de una URL de Riot para elegir sus buckets"""
+    u = httpx.URL(url)
+    for prefijo, familia in RIOT_FAMILIAS:
+        i = u.path.find(prefijo)
+        if i >= 0:
+            # Con RIOT_API_BASE apuntando a un mock la región va en el path (ej: /la2/lol/...)
+            return u.host + u.path[:i], familia
+    return u.host, "otros"
+
+class RateLimitBucket:
+    """
+    Token bucket con varias ventanas a la vez. Cada ventana tiene `limite` tokens
+    que se rellenan completos cuando pasa su periodo (igual que cuenta Riot).
+    Riot empieza a contar la ventana cuando le llega la primera request, no cuando la
+    mandamos: la ventana se vuelve a anclar con la primera respuesta que recibe, para
+    no rellenarla antes que Riot.
+    """
+
+    def __init__(self, ventanas=None):
+        self.ventanas = {}  # segundos -> [limite, usados, inicio_ventana, anclada]
+        self.bloqueado_hasta = 0.0
+        if ventanas:
+            self.actualizar_limites(ventanas)
+
+    def actualizar_limites(self, ventanas):
+        nuevas = {}
+        for limite, segundos in ventanas:
+            previa = self.ventanas.get(segundos)
+            nuevas[segundos] = [limite, previa[1], previa[2], previa[3]] if previa else [limite, 0, 0.0, True]
+        self.ventanas = nuevas
+
+    def sincronizar_conteos(self, conteos, ahora):
+        """Ajusta lo consumido con lo que reporta Riot (la key puede estar compartida)"""
+        for usados, segundos in conteos:
+            v = self.ventanas.get(segundos)
+            if v is None:
+                continue
+            if ahora - v[2] >= segundos:
+                v[1], v[2], v[3] = usados, ahora, True
+            elif usados > v[1]:
+                v[1] = usados
+
+    def anclar(self, ahora):
+        """Con la primera respuesta de una ventana nueva, su inicio pasa a ser el de Riot"""
+        for v in self.ventanas.values():
+            if not v[3]:
+                # La request llegó a Riot antes de que volviera la respuesta: anclar acá
+                # solo puede atrasar el relleno, nunca adelantarlo
+                v[2], v[3] = ahora, True
+
+    def espera(self, ahora, fraccion=1.0):
+        """Segundos que faltan para poder consumir un token (0 si hay disponible)"""
+        espera = max(0.0, self.bloqueado_hasta - ahora)
+        for segundos, (limite, usados, inicio, _) in self.ventanas.items():
+            if ahora - inicio < segundos and usados >= max(1, int(limite * fraccion)):
+                espera = max(espera, inicio + segundos - ahora)
+        return espera
+
+    def consumir(self, ahora):
+        for segundos, v in self.ventanas.items():
+            if ahora - v[2] >= segundos:
+                v[1], v[2], v[3] = 0, ahora, False  # Ventana vencida: se rellena y espera su ancla
+            v[1] += 1
+
+    def bloquear(self, segundos, ahora):
+        self.bloqueado_hasta = max(self.bloqueado_hasta, ahora + segundos)
+
+class RiotRateLimiter:
+    """Reparte las peticiones entre buckets de aplicación (por host) y de método (por host + familia)"""
+
+    def __init__(self, limites_app, fraccion=1.0):
+        self.limites_app = limites_app
+        # Parte de cada ventana que puede usar este proceso (ej: el backfill deja
+        # margen para que la API en vivo no se quede sin cupo)
+        self.fraccion = fraccion
+        self.app = {}     # host -> RateLimitBucket
+        self.metodo = {}  # (host, familia) -> RateLimitBucket
+        self.conexiones = {}  # host -> Semaphore con el tamaño del pool de ese host
+
+    def buckets(self, host, familia):
+        app = self.app.get(host)
+        if app is None:
+            app = self.app[host] = RateLimitBucket(self.limites_app)
+        metodo = self.metodo.get((host, familia))
+        if metodo is None:
+            # Los límites de método los conocemos con la primera respuesta
+            metodo = self.metodo[(host, familia)] = RateLimitBucket()
+        return app, metodo
+
+    async def adquirir(self, host, familia):
+        """Espera hasta que ambos buckets tengan token y lo consume"""
+        app, metodo = self.buckets(host, familia)
+        while True:
+            ahora = time.monotonic()
+            espera = max(app.espera(ahora, self.fraccion), metodo.espera(ahora, self.fraccion))
+            if espera <= 0:
+                # Sin await entre revisar y consumir: nadie más puede colarse
+                app.consumir(ahora)
+                metodo.consumir(ahora)
+                return
+            await asyncio.sleep(espera)
+
+    def conexion(self, host):
+        """
+        Cupo de requests en vuelo a `host`. Los tokens salen al ritmo de la ventana entera
+        y el pool tiene HTTP_LIMITS.max_connections conexiones: sin este tope una tanda
+        grande espera conexión dentro de httpx hasta que vence su timeout
+        """
+        semaforo = self.conexiones.get(host)
+        if semaforo is None:
+            semaforo = self.conexiones[host] = asyncio.Semaphore(HTTP_LIMITS.max_connections)
+        return semaforo
+
+    def registrar_respuesta(self, host, familia, resp, espera_defecto=1.0):
+        """Actualiza los buckets con los headers de Riot. Si es 429 devuelve cuánto bloquear"""
+        app, metodo = self.buckets(host, familia)
+        ahora = time.monotonic()
+        for bucket, header in ((app, "X-App-Rate-Limit"), (metodo, "X-Method-Rate-Limit")):
+            bucket.anclar(ahora)
+            limites = parse_rate_limit(resp.headers.get(header))
+            if limites:
+                bucket.actualizar_limites(limites)
+            conteos = parse_rate_limit(resp.headers.get(f"{header}-Count"))
+            if conteos:
+                bucket.sincronizar_conteos(conteos, ahora)
 
-# Lock para evitar múltiples generaciones simultáneas del ranking
-ranking_lock = asyncio.Lock()
-ranking_in_progress = False
+        if resp.status_code != 429:
+            return 0
+
+        try:
+            espera = float(resp.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            espera = espera_defecto  # Los 429 de "service" a veces no traen Retry-After
+        # Solo bloqueamos el bucket que Riot dice que se pasó
+        tipo = resp.headers.get("X-Rate-Limit-Type", "").lower()
+        (app if tipo == "application" else metodo).bloquear(espera, ahora)
+        return espera
+
+riot_limiter = RiotRateLimiter(parse_rate_limit(RIOT_APP_RATE_LIMIT))
 
 # Timeout global para todas las peticiones HTTP (10 segundos)
 HTTP_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+# El rate limiter decide el ritmo; el pool solo pone un techo de conexiones (por host)
+# y mantiene vivas las conexiones a cada host (americas, la2...) entre requests
+HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=20, keepalive_expiry=60)
+# HTTP/2 multiplexa todas las peticiones a un host en una sola conexión (requiere 'h2')
+RIOT_HTTP2 = os.environ.get("RIOT_HTTP2", "0") == "1"
+
+class ClientesRiot:
+    """
+    Un AsyncClient por host de Riot (americas, la2, euw1...), cada uno con su pool de
+    conexiones: un host lento o limitado no ocupa las conexiones de los demás. Junto con
+    los buckets por host del rate limiter, un roster de varias regiones se pide en paralelo.
+    """
+
+    def __init__(self, http2=False):
+        self.http2 = http2
+        self.clientes = {}
+        self.is_closed = False
+
+    def para(self, host):
+        cliente = self.clientes.get(host)
+        if cliente is None:
+            cliente = self.clientes[host] = httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS, http2=self.http2)
+        return cliente
 
-async def fetch_riot(client: httpx.AsyncClient, url: str, retry_count: int = 0, max_retries: int = 3):
-    async with sem:
+    async def get(self, url, **kwargs):
+        return await self.para(clasificar_endpoint(url)[0]).get(url, **kwargs)
+
+    async def aclose(self):
+        self.is_closed = True
+        await asyncio.gather(*[c.aclose() for c in self.clientes.values()])
+        self.clientes.clear()
+
+# Clientes HTTP compartidos por todo el proceso (se crean en el lifespan de FastAPI)
+http_client = None
+
+def get_http_client():
+    """Devuelve el cliente compartido. Si el runtime no ejecutó el lifespan, lo crea al vuelo"""
+    global http_client
+    if http_client is None or http_client.is_closed:
+        http2 = RIOT_HTTP2
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                log("⚠️ RIOT_HTTP2 activo pero falta librería 'h2', usando HTTP/1.1", logging.WARNING)
+                http2 = False
+        http_client = ClientesRiot(http2)
+    return http_client
+
+async def cerrar_http_client():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+class RespuestaVacia:
+    """Respuesta mock para cuando no hubo respuesta útil de Riot (429 agotado, timeout, error)"""
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+    def json(self): return {}
+
+async def fetch_riot(client: ClientesRiot, url: str, max_retries: int = 3):
+    host, familia = clasificar_endpoint(url)
+    for intento in range(max_retries + 1):
+        # Esperamos token fuera de cualquier lock: un 429 solo frena a su bucket
+        await riot_limiter.adquirir(host, familia)
         try:
-            resp = await client.get(url, headers={"X-Riot-Token": RIOT_API_KEY}, timeout=HTTP_TIMEOUT)
-            if resp.status_code == 429:
-                if retry_count >= max_retries:
-                    print(f"⚠️ Rate Limit máximo alcanzado después de {max_retries} intentos")
-                    class RateLimitResponse:
-                        status_code = 429
-                        def json(self): return {}
-                    return RateLimitResponse()
-                
-                # Backoff exponencial: 1s, 2s, 4s
-                wait_time = 2 ** retry_count
-                print(f"⚠️ Rate Limit. Esperando {wait_time}s... (intento {retry_count + 1}/{max_retries})")
-                await asyncio.sleep(wait_time)
-                return await fetch_riot(client, url, retry_count + 1, max_retries)
-            return resp
+            async with riot_limiter.conexion(host):
+                inicio = time.perf_counter()
+                resp = await client.get(url, headers={"X-Riot-Token": RIOT_API_KEY}, timeout=HTTP_TIMEOUT)
+        except httpx.PoolTimeout:
+            # No llegó a salir: es el pool local, no Riot
+            Metricas.riot_pool_agotado.inc(familia)
+            log("⏱️ Sin conexión libre para: {url}...", logging.WARNING, url=url[:100], familia=familia)
+            return RespuestaVacia(503)
         except httpx.TimeoutException:
-            print(f"⏱️ Timeout en: {url[:100]}...")
+            Metricas.riot_timeouts.inc(familia)
+            log("⏱️ Timeout en: {url}...", logging.WARNING, url=url[:100], familia=familia)
             # Retornar una respuesta mock con status 504 para manejar timeout
-            class TimeoutResponse:
-                status_code = 504
-                def json(self): return {}
-            return TimeoutResponse()
+            return RespuestaVacia(504)
         except Exception as e:
-            print(f"❌ Error en fetch: {e}")
-            class ErrorResponse:
-                status_code = 500
-                def json(self): return {}
-            return ErrorResponse()
+            Metricas.riot_errores.inc(familia)
+            log("❌ Error en fetch: {error}", logging.ERROR, error=str(e), familia=familia)
+            return RespuestaVacia(500)
+        Metricas.riot_latencia.observar(time.perf_counter() - inicio, familia)
+        Metricas.riot_respuestas.inc(familia, resp.status_code)
+
+        # Sin Retry-After usamos backoff exponencial: 1s, 2s, 4s
+        espera = riot_limiter.registrar_respuesta(host, familia, resp, espera_defecto=2 ** intento)
+        if resp.status_code != 429:
+            return resp
+        Metricas.riot_429.inc(familia, resp.headers.get("X-Rate-Limit-Type", "service").lower())
+        if intento >= max_retries:
+            log("⚠️ Rate Limit máximo alcanzado después de {intentos} intentos", logging.WARNING,
+                intentos=max_retries, familia=familia)
+            return RespuestaVacia(429)
+        Metricas.riot_reintentos.inc(familia)
+        log("⚠️ Rate Limit ({familia} en {host}). Esperando {espera}s... (intento {intento}/{max_retries})",
+            logging.WARNING, familia=familia, host=host, espera=espera, intento=intento + 1, max_retries=max_retries)
 
 def calcular_puntos_totales(tier, rank, lp):
     """
@@ -189,6 +897,54 @@ def calcular_puntos_totales(tier, rank, lp):
     
     return puntos_base + puntos_division + lp
 
+# --- RESPUESTAS (ETag y compresión) ---
+# Los endpoints calientes serializan su respuesta una vez, con su hash como ETag, y la
+# comprimen (brotli o gzip) la primera vez que un cliente la acepta. Un If-None-Match que
+# coincide se contesta con 304 sin cuerpo.
+COMPRESION_MIN = 1024  # Bytes: por debajo comprimir no ahorra nada
+
+def etag_coincide(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Comparación débil: W/"x" y "x" son el mismo ETag
+    return etag.removeprefix("W/") in (e.strip().removeprefix("W/") for e in if_none_match.split(","))
+
+class RespuestaSerializada:
+    """Cuerpo JSON ya serializado con su ETag y sus versiones comprimidas"""
+    __slots__ = ("cuerpo", "etag", "comprimidos")
+
+    def __init__(self, datos):
+        self.cuerpo = json_bytes(datos)
+        self.etag = 'W/"' + hashlib.blake2b(self.cuerpo, digest_size=12).hexdigest() + '"'
+        self.comprimidos = {}
+
+    def codificar(self, accept_encoding):
+        """(Content-Encoding o None, bytes) según lo que acepta el cliente"""
+        if len(self.cuerpo) < COMPRESION_MIN:
+            return None, self.cuerpo
+        aceptadas = {e.split(";")[0].strip() for e in accept_encoding.lower().split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding not in aceptadas or (encoding == "br" and not brotli):
+                continue
+            if encoding not in self.comprimidos:
+                self.comprimidos[encoding] = (
+                    brotli.compress(self.cuerpo, quality=5) if encoding == "br"
+                    else gzip.compress(self.cuerpo, compresslevel=6)
+                )
+            return encoding, self.comprimidos[encoding]
+        return None, self.cuerpo
+
+    def responder(self, request, headers=None):
+        headers = {"ETag": self.etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache", **(headers or {})}
+        if etag_coincide(request.headers.get("if-none-match"), self.etag):
+            return Response(status_code=304, headers=headers)
+        encoding, cuerpo = self.codificar(request.headers.get("accept-encoding", ""))
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(cuerpo, media_type="application/json", headers=headers)
+
 @app.get("/")
 def read_root():
     return {"status": "online", "message": "La API está funcionando. Ve a /api/ranking para ver los datos."}
@@ -196,323 +952,2233 @@ def read_root():
 @app.get("/api/cache/stats")
 async def cache_stats():
     """Endpoint de diagnóstico para verificar el estado del caché"""
+    capas = ["Memoria"] + (["Archivo"] if cache_disco else []) + (["Redis"] if redis_client else [])
     stats = {
-        "cache_type": "Redis" if redis_client else "Archivo/Memoria",
+        "cache_type": "/".join(capas),
         "redis_connected": redis_client is not None,
-        "local_cache_keys": len(LOCAL_CACHE),
-        "temp_dir": tempfile.gettempdir(),
+        "local_cache_keys": len(cache_memoria),
+        "local_cache_max": cache_memoria.max_items,
+        "en_vuelo": len(en_vuelo),
+        "temp_dir": CACHE_DIR,
+        "tiers": {},
     }
-    
+    for capa, contadores in CACHE_STATS.items():
+        total = contadores["hits"] + contadores["misses"]
+        stats["tiers"][capa] = {**contadores, "hit_ratio": round(contadores["hits"] / total, 3) if total else None}
+
     # Contar archivos de caché en /tmp
-    try:
-        cache_files = [f for f in os.listdir(tempfile.gettempdir()) if f.startswith("lol_cache_")]
-        stats["cache_files_count"] = len(cache_files)
-        stats["cache_files"] = cache_files[:10]  # Mostrar solo los primeros 10
-    except Exception as e:
-        stats["cache_files_error"] = str(e)
-    
-    # Verificar si existe el caché del ranking
-    ranking_cached = await get_cache("ranking:full")
-    stats["ranking_cached"] = ranking_cached is not None
-    if ranking_cached:
-        stats["ranking_players"] = len(ranking_cached)
+    if cache_disco:
+        try:
+            cache_files = [f for f in os.listdir(CACHE_DIR) if f.startswith("lol_cache_")]
+            stats["cache_files_count"] = len(cache_files)
+            stats["cache_files"] = cache_files[:10]  # Mostrar solo los primeros 10
+        except Exception as e:
+            stats["cache_files_error"] = str(e)
+
+    if store:
+        try:
+            stats["store"] = {"path": store.ruta, **(await store.estadisticas())}
+        except sqlite3.Error as e:
+            stats["store_error"] = str(e)
+
+    # Rosters cargados en este proceso y antigüedad de las filas del ranking
+    stats["rosters"] = {r.nombre: {"jugadores": len(r.miembros), "en_ranking": len(r.board)} for r in rosters.values()}
+    stats["ranking_players"] = len(estados)
+    stats["en_partida"] = sum(1 for e in tracker_vivo.jugadores.values() if e["en_partida"])
+    if estados:
+        stats["ranking_age"] = round(time.time() - min(f["actualizado"] for f in estados.values()), 1)
     
     return stats
 
-async def get_puuid(client, nombre, tag):
-    cache_key = f"puuid:{nombre}:{tag}"
-    cached = await get_cache(cache_key)
-    if cached:
-        return cached
+@app.get("/api/metrics")
+async def metrics():
+    """Métricas en formato texto de Prometheus"""
+    lineas = []
+    for metrica in Metricas.todas():
+        lineas += metrica.exponer()
 
-    url = f"https://{REGION_ACCOUNT}.api.riotgames.com/riot/account/v1/accounts/by-riot-id/{nombre}/{tag}"
-    res = await fetch_riot(client, url)
-    
-    if res.status_code == 200:
-        puuid = res.json().get("puuid")
-        # El PUUID no cambia, lo guardamos por 30 días
-        await set_cache(cache_key, puuid, ttl=2592000)
-        return puuid
-    return None
+    # Contadores del caché por capa (se leen de CACHE_STATS al momento del scrape)
+    for contador in ("hits", "misses", "evictions", "expired", "errors"):
+        lineas += [f"# HELP soloq_cache_{contador}_total Caché: {contador} por capa",
+                   f"# TYPE soloq_cache_{contador}_total counter"]
+        lineas += [f'soloq_cache_{contador}_total{{tier="{capa}"}} {c[contador]}' for capa, c in CACHE_STATS.items()]
+    lineas += ["# HELP soloq_cache_hit_ratio Proporción de hits por capa", "# TYPE soloq_cache_hit_ratio gauge"]
+    for capa, c in CACHE_STATS.items():
+        total = c["hits"] + c["misses"]
+        if total:
+            lineas.append(f'soloq_cache_hit_ratio{{tier="{capa}"}} {c["hits"] / total}')
+    lineas += ["# HELP soloq_cache_memory_items Keys en el caché en memoria", "# TYPE soloq_cache_memory_items gauge",
+               f"soloq_cache_memory_items {len(cache_memoria)}"]
+    return PlainTextResponse("\n".join(lineas) + "\n", media_type="text/plain; version=0.0.4")
 
-@app.get("/api/ranking")
-async def get_ranking():
-    global ranking_in_progress
-    
+async def get_puuid(client, nombre, tag, plataforma=PLATAFORMA_DEFECTO, verificar=True):
+    # El Riot ID y el PUUID son globales: la plataforma solo elige el cluster más cercano.
+    # verificar=False cuando la plataforma ya la eligió un admin (la de un miembro de un roster)
+    async def buscar():
+        url = riot_url(region_cuentas(plataforma), f"/riot/account/v1/accounts/by-riot-id/{nombre}/{tag}")
+        res = await fetch_riot(client, url)
+        if res.status_code == 200:
+            return res.json().get("puuid")
+        return NO_ENCONTRADO if res.status_code == 404 else None
+
+    # El PUUID no cambia, lo guardamos por 30 días
+    puuid = await cache_o_buscar(f"puuid:{nombre}:{tag}", buscar, ttl=2592000)
+    if puuid and verificar and not plataformas.verificada(puuid):
+        await verificar_plataforma(client, puuid, plataforma)
+    return puuid
+
+VERIFICACION_REINTENTO = 300  # Segundos sin volver a preguntar la región si Riot falló
+
+async def verificar_plataforma(client, puuid, sugerida):
+    """
+    Confirma con account-v1 (region/by-game/lol) en qué plataforma juega el PUUID. Una
+    sugerida equivocada manda las búsquedas de partidas a otro cluster, que responde una
+    lista vacía. Si Riot no contesta queda la sugerida, sin verificar, y no se vuelve a
+    preguntar por VERIFICACION_REINTENTO segundos.
+    """
+    key = f"region:{puuid}"
+
+    async def buscar():
+        url = riot_url(region_cuentas(sugerida), f"/riot/account/v1/region/by-game/lol/by-puuid/{puuid}")
+        res = await fetch_riot(client, url)
+        if res.status_code == 200:
+            return (res.json().get("region") or "").lower() or NO_ENCONTRADO
+        if res.status_code == 404:
+            return NO_ENCONTRADO
+        # 429 agotado, 5xx, timeout: se guarda como no encontrado por poco tiempo para que
+        # cada /api/jugador de este PUUID no repita la llamada que falla
+        await set_cache(key, NO_ENCONTRADO, ttl=VERIFICACION_REINTENTO)
+        return None
+
+    # Un cambio de servidor es raro: 7 días
+    region = await cache_o_buscar(key, buscar, ttl=604800)
+    if region in PLATAFORMAS:
+        plataformas.confirmar(puuid, region)
+    else:
+        plataformas.sugerir(puuid, sugerida)
+
+# --- ROSTERS (leaderboards con nombre) ---
+# Los rosters son datos: se agregan y quitan jugadores por la API y se guardan en el
+# caché. AMIGOS solo siembra el roster por defecto mientras no exista ninguno guardado.
+# Cada proceso tiene su copia y la vuelve a leer de la capa compartida (no de la memoria)
+# cada ROSTERS_RECARGA segundos para ver los cambios hechos desde otra instancia.
+ROSTER_DEFECTO = "amigos"
+ROSTERS_KEY = "rosters"
+ROSTER_TTL = 31536000      # 1 año, se renueva con cada cambio
+ROSTERS_RECARGA = 30
+ROSTER_NOMBRE = re.compile(r"^[\w-]{1,32}$")
+# Agregar/quitar jugadores exige el header X-Admin-Token con este valor; sin definirlo
+# los rosters son de solo lectura (cada alta gasta llamadas de la key de Riot)
+ROSTER_ADMIN_TOKEN = os.environ.get("ROSTER_ADMIN_TOKEN")
+ROSTER_JUGADORES_MAX = 25  # Riot IDs por llamada a POST/DELETE
+
+def clave_riot_id(nombre, tag):
+    """Los Riot ID no distinguen mayúsculas"""
+    return f"{nombre}#{tag}".lower()
+
+class Leaderboard:
+    """
+    Jugadores ordenados por puntos (mayor primero). Actualizar un jugador y buscar su
+    posición es O(log n); leer una página es O(log n + página), no O(roster).
+    """
+
+    def __init__(self):
+        self.orden = SortedList() if SortedList else []   # [(-puntos, puuid)]
+        self.puntos = {}  # puuid -> puntos
+        self.movidos = None  # [inicio, fin) de posiciones que cambiaron desde tomar_movidos()
+
+    def __len__(self):
+        return len(self.orden)
+
+    def _indice(self, clave):
+        return self.orden.bisect_left(clave) if SortedList else bisect.bisect_left(self.orden, clave)
+
+    def _sacar(self, puuid):
+        """Saca al jugador y devuelve la posición que tenía (None si no estaba)"""
+        anterior = self.puntos.pop(puuid, None)
+        if anterior is None:
+            return None
+        indice = self._indice((-anterior, puuid))
+        del self.orden[indice]
+        return indice
+
+    def _marcar(self, inicio, fin):
+        if self.movidos is None:
+            self.movidos = (inicio, fin)
+        else:
+            self.movidos = (min(self.movidos[0], inicio), max(self.movidos[1], fin))
+
+    def quitar(self, puuid):
+        desde = self._sacar(puuid)
+        if desde is not None:
+            self._marcar(desde, len(self.orden))  # Todos los de abajo suben uno
+
+    def actualizar(self, puuid, puntos):
+        """Devuelve True si el jugador es nuevo o cambió de puntos"""
+        if self.puntos.get(puuid) == puntos:
+            return False
+        desde = self._sacar(puuid)
+        if SortedList:
+            self.orden.add((-puntos, puuid))
+        else:
+            bisect.insort(self.orden, (-puntos, puuid))
+        self.puntos[puuid] = puntos
+        hasta = self._indice((-puntos, puuid))
+        if desde is None:
+            self._marcar(hasta, len(self.orden))  # Nuevo: todos los de abajo bajan uno
+        else:
+            # Al pasar a otros, los que quedaron entre las dos posiciones se corren uno
+            self._marcar(min(desde, hasta), max(desde, hasta) + 1)
+        return True
+
+    def tomar_movidos(self):
+        """Jugadores en el rango de posiciones que cambió desde la llamada anterior"""
+        if self.movidos is None:
+            return []
+        inicio, fin = self.movidos
+        self.movidos = None
+        return self.pagina(inicio, fin - inicio)
+
+    def posicion(self, puuid):
+        """Posición (desde 0) del jugador, o None si no está"""
+        puntos = self.puntos.get(puuid)
+        return None if puntos is None else self._indice((-puntos, puuid))
+
+    def pagina(self, offset=0, limit=None):
+        fin = None if limit is None else offset + limit
+        return [puuid for _, puuid in self.orden[offset:fin]]
+
+class Roster:
+    def __init__(self, nombre):
+        self.nombre = nombre
+        self.miembros = {}   # clave Riot ID -> {"nombre", "tag", "plataforma", "puuid"}
+        self.puuids = set()
+        self.board = Leaderboard()
+        self.version = 0  # Sube con cada cambio visible en el board (invalida las respuestas serializadas)
+
+    def agregar(self, miembro):
+        clave = clave_riot_id(miembro["nombre"], miembro["tag"])
+        if clave in self.miembros:
+            return False
+        self.miembros[clave] = {
+            "nombre": miembro["nombre"], "tag": miembro["tag"],
+            "plataforma": miembro.get("plataforma") or PLATAFORMA_DEFECTO, "puuid": None,
+        }
+        if miembro.get("puuid"):
+            self.asignar_puuid(clave, miembro["puuid"])
+        return True
+
+    def asignar_puuid(self, clave, puuid):
+        miembro = self.miembros[clave]
+        miembro["puuid"] = puuid
+        self.puuids.add(puuid)
+        if plataformas.verificada(puuid):
+            # account-v1 (o otro roster) ya dijo dónde juega: gana a la ?plataforma= del alta
+            miembro["plataforma"] = plataformas.get(puuid)
+        # Si no, la plataforma del roster la eligió un admin: se toma como confirmada
+        plataformas.fijar(puuid, miembro["plataforma"])
+        tracker_vivo.seguir(puuid)
+        self.version += 1
+        estado = estados.get(puuid)
+        if estado:
+            self.board.actualizar(puuid, estado["puntos_totales"])
+
+    def quitar(self, clave):
+        miembro = self.miembros.pop(clave, None)
+        if miembro and miembro["puuid"]:
+            self.puuids.discard(miembro["puuid"])
+            self.board.quitar(miembro["puuid"])
+            self.version += 1
+        if miembro:
+            olvidar_miembro(clave, miembro["puuid"])
+        return miembro
+
+    def sincronizar(self, miembros):
+        """Deja los miembros iguales a la lista guardada sin rehacer el board"""
+        guardados = {clave_riot_id(m["nombre"], m["tag"]): m for m in miembros}
+        for clave in [c for c in self.miembros if c not in guardados]:
+            self.quitar(clave)
+        for clave, miembro in guardados.items():
+            actual = self.miembros.get(clave)
+            if actual is None:
+                self.agregar(miembro)
+            elif miembro.get("puuid") and not actual["puuid"]:
+                self.asignar_puuid(clave, miembro["puuid"])
+
+    def serializar(self):
+        return list(self.miembros.values())
+
+rosters = {}   # nombre -> Roster
+estados = {}   # puuid -> última fila del ranking de ese jugador (compartida entre rosters)
+rosters_lock = asyncio.Lock()
+rosters_cargados_en = None
+
+def aplicar_estado(puuid, fila):
+    """
+    Guarda la fila del jugador y lo reubica en cada board donde está: O(log n) por roster.
+    Devuelve los rosters donde cambió de puntos.
+    """
+    estados[puuid] = fila
+    movidos = []
+    for roster in rosters_de(puuid):
+        roster.version += 1
+        if roster.board.actualizar(puuid, fila["puntos_totales"]):
+            movidos.append(roster.nombre)
+    return movidos
+
+def rosters_de(puuid):
+    return [roster for roster in rosters.values() if puuid in roster.puuids]
+
+def olvidar_miembro(clave, puuid):
+    """Suelta lo que se guarda por miembro si ya no está en ningún roster"""
+    if any(clave in roster.miembros for roster in rosters.values()):
+        return
+    ultimo_intento.pop(clave, None)
+    if puuid and not rosters_de(puuid):
+        plataformas.soltar(puuid)
+
+def olvidar_roster(tabla):
+    """Después de sacar `tabla` de rosters"""
+    for clave, miembro in tabla.miembros.items():
+        olvidar_miembro(clave, miembro["puuid"])
+
+# Con Redis cada board también se guarda como sorted set (board:{roster}, score = puntos),
+# compartido entre instancias: al recargar los rosters cada instancia compara su board con
+# el sorted set y trae solo las filas de los jugadores que otra instancia movió.
+def key_board(roster):
+    return f"board:{roster}"
+
+async def publicar_board(nombre, puuids):
+    """Copia al sorted set la posición de esos jugadores (ZADD si están en el board, ZREM si no)"""
+    roster = rosters.get(nombre)
+    if not redis_client or roster is None or not puuids:
+        return
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for puuid in puuids:
+                if puuid in roster.board.puntos:
+                    pipe.zadd(key_board(nombre), {puuid: roster.board.puntos[puuid]})
+                else:
+                    pipe.zrem(key_board(nombre), puuid)
+            await pipe.execute()
+    except Exception as e:
+        CACHE_STATS["redis"]["errors"] += 1
+        log("⚠️ Error actualizando board en Redis: {error}", logging.WARNING, error=str(e))
+
+async def leer_estados_redis(puuids):
+    """Filas estado:{puuid} directo de Redis (las capas locales pueden tener una versión vieja)"""
+    if not puuids:
+        return []
     try:
-        # CACHÉ DEL RANKING COMPLETO (30 segundos)
-        # Esto evita que múltiples usuarios saturen la API al mismo tiempo
-        cache_key = "ranking:full"
-        cached_ranking = await get_cache(cache_key)
-        if cached_ranking:
-            print("✅ Devolviendo ranking desde caché")
-            return cached_ranking
-        
-        # Si la clave sigue siendo el placeholder, devolvemos datos falsos para probar el front
-        if RIOT_API_KEY == "TU_CLAVE_DE_RIOT_AQUI":
-            return [
-                {"nombre": "DemoUser", "tag": "TEST", "rank": "Gold IV", "lp": 50, "winrate": 51.5, "en_partida": True, "puntos_totales": 1250},
-                {"nombre": "SinApi", "tag": "KEY", "rank": "Challenger", "lp": 999, "winrate": 60.0, "en_partida": False, "puntos_totales": 4899},
-            ]
-
-        # SISTEMA DE LOCK: Solo permitir una generación a la vez
-        # Si alguien más está generando, esperamos hasta 15 segundos
+        datos = await redis_client.mget([f"estado:{p}" for p in puuids])
+    except Exception as e:
+        CACHE_STATS["redis"]["errors"] += 1
+        log("⚠️ Error Redis: {error}", logging.WARNING, error=str(e))
+        return [None] * len(puuids)
+    return [deserializar_cache(d) if d else None for d in datos]
+
+async def puuids_movidos_redis():
+    """PUUIDs cuyos puntos en el sorted set no coinciden con el board local"""
+    movidos = set()
+    for roster in list(rosters.values()):
+        try:
+            remoto = await redis_client.zrange(key_board(roster.nombre), 0, -1, withscores=True)
+        except Exception as e:
+            CACHE_STATS["redis"]["errors"] += 1
+            log("⚠️ Error Redis: {error}", logging.WARNING, error=str(e))
+            continue
+        for puuid, puntos in remoto:
+            puuid = puuid.decode() if isinstance(puuid, bytes) else puuid
+            if puuid in roster.puuids and roster.board.puntos.get(puuid) != int(puntos):
+                movidos.add(puuid)
+    return movidos
+
+async def guardar_nombres_rosters(agregar=None, quitar=None):
+    """
+    Actualiza la lista de rosters sobre la guardada (no sobre la copia local) para no
+    borrar un roster que otra instancia creó desde la última recarga
+    """
+    nombres = set(await get_cache_compartido(ROSTERS_KEY) or rosters)
+    if agregar:
+        nombres.add(agregar)
+    nombres.discard(quitar)
+    await set_cache(ROSTERS_KEY, sorted(nombres), ttl=ROSTER_TTL)
+
+async def guardar_roster(roster):
+    await set_cache(f"roster:{roster.nombre}", roster.serializar(), ttl=ROSTER_TTL)
+    await guardar_nombres_rosters(agregar=roster.nombre)
+
+async def _cargar_rosters():
+    """Relee los rosters de la capa compartida. Lanza CacheNoDisponible si Redis falla"""
+    global rosters_cargados_en
+    nombres = await get_cache_compartido(ROSTERS_KEY)
+    sembrar = nombres is None
+    if sembrar:
+        nombres = [ROSTER_DEFECTO]
+    for nombre in [n for n in rosters if n not in nombres]:
+        olvidar_roster(rosters.pop(nombre))
+    for nombre in nombres:
+        miembros = await get_cache_compartido(f"roster:{nombre}")
+        if miembros is None and sembrar:
+            miembros = AMIGOS
+        rosters.setdefault(nombre, Roster(nombre)).sincronizar(miembros or [])
+    if sembrar:
+        await guardar_roster(rosters[ROSTER_DEFECTO])
+
+    # Estado guardado de los jugadores que este proceso aún no conoce (cold start o
+    # jugadores agregados desde otra instancia) o que otra instancia movió en el board
+    faltan = {p for r in rosters.values() for p in r.puuids if p not in estados}
+    if redis_client:
+        faltan = list(faltan | await puuids_movidos_redis())
+        guardados = await leer_estados_redis(faltan)
+    else:
+        faltan = list(faltan)
+        guardados = await asyncio.gather(*[get_cache(f"estado:{p}") for p in faltan])
+    for puuid, fila in zip(faltan, guardados):
+        if fila:
+            aplicar_estado(puuid, fila)
+            difusor.marcar(puuid)
+    rosters_cargados_en = time.monotonic()
+
+async def cargar_rosters():
+    """Carga (o recarga si pasaron ROSTERS_RECARGA segundos) los rosters desde el caché"""
+    global rosters_cargados_en
+    if rosters_cargados_en is not None and time.monotonic() - rosters_cargados_en < ROSTERS_RECARGA:
+        return
+    async with rosters_lock:
+        if rosters_cargados_en is None or time.monotonic() - rosters_cargados_en >= ROSTERS_RECARGA:
+            try:
+                await _cargar_rosters()
+            except CacheNoDisponible as e:
+                # Seguimos con la copia que tenemos y reintentamos en ROSTERS_RECARGA
+                log("⚠️ No se pudieron recargar los rosters: {error}", logging.WARNING, error=str(e))
+                rosters_cargados_en = time.monotonic()
+
+def miembros_unicos(nombre=None):
+    """Miembros de un roster, o de todos sin repetir si no se indica"""
+    if nombre is not None:
+        return list(rosters[nombre].miembros.values()) if nombre in rosters else []
+    miembros = {}
+    for roster in rosters.values():
+        for clave, miembro in roster.miembros.items():
+            miembros.setdefault(clave, miembro)
+    return list(miembros.values())
+
+# --- RANKING (refresco por tandas) ---
+# Cada jugador tiene su propia fila en `estados` (y en el caché como estado:{puuid}).
+# En vez de regenerar todo el ranking, cada REFRESCO_TICK segundos se refresca una tanda
+# con los REFRESCO_TANDA jugadores más desactualizados; el board se sigue sirviendo entero
+# mientras tanto. Un jugador vuelve a entrar a una tanda pasado REFRESCO_PERIODO.
+REFRESCO_TICK = float(os.environ.get("REFRESCO_TICK", "5"))
+REFRESCO_PERIODO = float(os.environ.get("REFRESCO_PERIODO", "60"))
+REFRESCO_TANDA = int(os.environ.get("REFRESCO_TANDA", "50"))
+# Dentro de una tanda: jugadores por grupo y grupos a la vez (cada grupo pide sus cuentas,
+# últimas partidas y ligas juntas)
+REFRESCO_GRUPO = int(os.environ.get("REFRESCO_GRUPO", "50"))
+REFRESCO_GRUPOS_EN_VUELO = int(os.environ.get("REFRESCO_GRUPOS_EN_VUELO", "4"))
+# "0": sin ciclo de fondo, las tandas solo las disparan los requests (el bench lo usa
+# para que el escenario frío mida de verdad el primer armado del board)
+REFRESCO_CICLO = os.environ.get("REFRESCO_CICLO", "1") == "1"
+# La liga solo se vuelve a pedir si cambió la última partida de SoloQ del jugador o si la
+# fila tiene más de LIGA_EDAD_MAX segundos (ej: decay de LP sin jugar)
+LIGA_EDAD_MAX = float(os.environ.get("LIGA_EDAD_MAX", "3600"))
+# La última partida (count=1) solo se pide si el tracker en vivo vio terminar una partida del
+# jugador desde la última revisión, o si no se revisó en REVISION_INACTIVO segundos (partidas
+# que el spectator no alcanzó a ver)
+REVISION_INACTIVO = float(os.environ.get("REVISION_INACTIVO", "900"))
+# match-v5 tarda unos minutos en listar una partida recién terminada: durante ese margen se
+# sigue revisando al jugador en cada tanda aunque ya se haya revisado después del fin
+REVISION_TRAS_PARTIDA = 300
+ESTADO_TTL = 2592000       # 30 días
+RANKING_TIMEOUT = 15       # Máximo que espera un request cuando el board está vacío
+RANKING_LIMITE_MAX = 500   # Máximo de filas por página
+# Cada cuánto se toma la foto del board contra la que se calculan los deltas de LP y posición
+SNAPSHOT_INTERVALO = float(os.environ.get("SNAPSHOT_INTERVALO", "86400"))
+
+# Última vez que cada Riot ID entró a una tanda (aunque Riot haya fallado), para que un
+# jugador con errores no acapare todas las tandas
+ultimo_intento = {}
+refresco_task = None
+ultimo_tick = 0.0
+
+def medir_fase(nombre, desde):
+    """Registra la duración de una fase del ranking y devuelve el inicio de la siguiente"""
+    ahora = time.perf_counter()
+    Metricas.ranking_fases.observar(ahora - desde, nombre)
+    return ahora
+
+def jugadores_pendientes(limite, ahora):
+    """Los `limite` jugadores más desactualizados (primero los que nunca se refrescaron)"""
+    def refrescado(miembro):
+        clave = clave_riot_id(miembro["nombre"], miembro["tag"])
+        if clave in ultimo_intento:
+            return ultimo_intento[clave]
+        estado = estados.get(miembro["puuid"])
+        return estado["actualizado"] if estado else 0
+
+    vencidos = (m for m in miembros_unicos() if ahora - refrescado(m) >= REFRESCO_PERIODO)
+    return heapq.nsmallest(limite, vencidos, key=refrescado)
+
+def fila_ranking(miembro, res_rank):
+    """Fila del ranking con la respuesta de league (None si falló)"""
+    if res_rank.status_code != 200:
+        return None
+
+    datos_jugador = {
+        "nombre": miembro['nombre'],
+        "tag": miembro['tag'],
+        "plataforma": miembro['plataforma'],
+        "rank": "Unranked",
+        "lp": 0,
+        "winrate": 0,
+        "partidas": 0,
+        "wins": 0,
+        "losses": 0,
+        "en_partida": False
+    }
+
+    # Procesar Rango
+    for cola in res_rank.json():
+        if cola["queueType"] == "RANKED_SOLO_5x5":
+            wins = cola['wins']
+            losses = cola['losses']
+            total = wins + losses
+            wr = round((wins / total) * 100, 1) if total > 0 else 0
+
+            tier = cola['tier']
+            rank = cola['rank']
+            lp = cola['leaguePoints']
+
+            datos_jugador["rank"] = f"{tier} {rank}"
+            datos_jugador["lp"] = lp
+            datos_jugador["winrate"] = wr
+            datos_jugador["tier"] = tier
+            datos_jugador["division"] = rank
+            datos_jugador["partidas"] = total
+            datos_jugador["wins"] = wins
+            datos_jugador["losses"] = losses
+
+    # El estado en vivo lo lleva el tracker; aquí solo queda para SQLite
+    datos_jugador["en_partida"] = tracker_vivo.en_partida(miembro["puuid"])
+
+    datos_jugador["puntos_totales"] = calcular_puntos_totales(
+        datos_jugador.get("tier", "IRON"), datos_jugador.get("division", "IV"), datos_jugador["lp"])
+    datos_jugador["actualizado"] = datos_jugador["comprobado"] = time.time()
+    return datos_jugador
+
+async def refrescar_tanda(miembros):
+    """
+    Refresca una tanda de jugadores de a grupos de REFRESCO_GRUPO, con hasta
+    REFRESCO_GRUPOS_EN_VUELO a la vez: cada grupo entra al board apenas termina, y una
+    tanda de miles no pone miles de llamadas en vuelo
+    """
+    inicio = time.perf_counter()
+    client = get_http_client()
+    ahora = time.time()
+    for m in miembros:
+        ultimo_intento[clave_riot_id(m["nombre"], m["tag"])] = ahora
+
+    grupos = iter([miembros[i:i + REFRESCO_GRUPO] for i in range(0, len(miembros), REFRESCO_GRUPO)])
+    filas = []
+
+    async def trabajador():
+        for grupo in grupos:
+            filas.extend(await refrescar_grupo(client, grupo, ahora))
+
+    await asyncio.gather(*[trabajador() for _ in range(REFRESCO_GRUPOS_EN_VUELO)])
+    medir_fase("total", inicio)
+    # Las tandas sin cambios son lo normal: solo se loguean con LOG_VERBOSE
+    (log if filas else log_debug)("✅ Tanda del ranking: {refrescados}/{total} jugadores con cambios ({segundos}s)",
+                                  refrescados=len(filas), total=len(miembros),
+                                  segundos=round(time.perf_counter() - inicio, 2))
+    return filas
+
+async def refrescar_grupo(client, miembros, ahora):
+    """
+    PUUID si falta, una llamada barata con la última partida de SoloQ de cada uno y la
+    liga solo de los que jugaron (o tienen la fila vieja). Devuelve las filas que cambiaron
+    """
+    fase = time.perf_counter()
+
+    # 1. PUUIDs que faltan (de caché o Riot); se guardan en todos los rosters del jugador
+    sin_puuid = [m for m in miembros if not m["puuid"]]
+    if sin_puuid:
+        puuids = await asyncio.gather(*[
+            get_puuid(client, m['nombre'], m['tag'], m['plataforma'], verificar=False) for m in sin_puuid
+        ])
+        modificados = set()
+        for m, puuid in zip(sin_puuid, puuids):
+            if not puuid:
+                continue
+            clave = clave_riot_id(m["nombre"], m["tag"])
+            for roster in rosters.values():
+                if clave in roster.miembros and not roster.miembros[clave]["puuid"]:
+                    roster.asignar_puuid(clave, puuid)
+                    modificados.add(roster.nombre)
+            m["puuid"] = puuid
+        for nombre in modificados:
+            if nombre in rosters:
+                await guardar_roster(rosters[nombre])
+    fase = medir_fase("puuid", fase)
+
+    # 2. Última partida de los que tienen fila reciente: si no cambió, su liga tampoco.
+    # A los que están en partida no se les pide nada (su liga cambia cuando termine), y a
+    # los demás solo si el tracker los vio terminar una o pasó REVISION_INACTIVO
+    revisar, validos = [], []
+    for m in miembros:
+        if not m["puuid"]:
+            continue
+        anterior = estados.get(m["puuid"])
+        if anterior is None or "ultima_partida" not in anterior or ahora - anterior["actualizado"] >= LIGA_EDAD_MAX:
+            validos.append(m)
+        elif tracker_vivo.en_partida(m["puuid"]):
+            Metricas.ranking_revisiones.inc("en_partida")
+        else:
+            comprobado = anterior.get("comprobado", anterior["actualizado"])
+            if (tracker_vivo.termino_desde(m["puuid"], min(comprobado, ahora - REVISION_TRAS_PARTIDA))
+                    or ahora - comprobado >= REVISION_INACTIVO):
+                revisar.append(m)
+            else:
+                Metricas.ranking_revisiones.inc("inactivo")
+
+    ultimas = {}  # puuid -> ID de su última partida de SoloQ (None si no tiene)
+    respuestas_ids = await asyncio.gather(*[fetch_riot(client, url_ids_partidas(m["puuid"], 0, 1)) for m in revisar])
+    for m, res in zip(revisar, respuestas_ids):
+        if res.status_code != 200:
+            validos.append(m)  # Sin el dato se pide la liga
+            continue
+        ids = res.json()
+        ultimas[m["puuid"]] = ids[0] if ids else None
+        if ultimas[m["puuid"]] != estados[m["puuid"]]["ultima_partida"]:
+            validos.append(m)
+        else:
+            estados[m["puuid"]]["comprobado"] = ahora
+            Metricas.ranking_revisiones.inc("sin_cambios")
+    fase = medir_fase("ultima_partida", fase)
+
+    # 3. Rangos en paralelo (el estado en vivo lo consulta el tracker por su cuenta); a los
+    # que no pasaron por el paso 2 se les pide también la última partida para la próxima vez
+    sin_ultima = [m for m in validos if m["puuid"] not in ultimas]
+    responses_rank, respuestas_ids = await asyncio.gather(
+        asyncio.gather(*[
+            fetch_riot(client, riot_url(m["plataforma"], f"/lol/league/v4/entries/by-puuid/{m['puuid']}"))
+            for m in validos
+        ]),
+        asyncio.gather(*[fetch_riot(client, url_ids_partidas(m["puuid"], 0, 1)) for m in sin_ultima]),
+    )
+    for m, res in zip(sin_ultima, respuestas_ids):
+        if res.status_code == 200:
+            ids = res.json()
+            ultimas[m["puuid"]] = ids[0] if ids else None
+    fase = medir_fase("league", fase)
+
+    # 4. Parchear el estado (y la posición en los boards) solo de los que cambiaron
+    filas = []
+    movidos = defaultdict(list)  # roster -> puuids que cambiaron de puntos
+    for miembro, res_rank in zip(validos, responses_rank):
+        try:
+            fila = fila_ranking(miembro, res_rank)
+        except Exception as e:
+            log("Error con {nombre}: {error}", logging.WARNING, nombre=miembro['nombre'], error=str(e))
+            continue
+        if fila is None:
+            continue  # Se mantiene la fila anterior y se reintenta en otra tanda
+        Metricas.ranking_revisiones.inc("liga")
+        if miembro["puuid"] in ultimas:
+            fila["ultima_partida"] = ultimas[miembro["puuid"]]
+        anterior = estados.get(miembro["puuid"])
+        if anterior and anterior["partidas"] != fila["partidas"]:
+            # Terminó una partida: puede estar entrando a otra
+            tracker_vivo.actividad(miembro["puuid"], ahora)
+        if anterior is None or any(anterior.get(k) != fila[k] for k in ("rank", "lp", "wins", "losses")):
+            difusor.marcar(miembro["puuid"])
+        for nombre in aplicar_estado(miembro["puuid"], fila):
+            movidos[nombre].append(miembro["puuid"])
+        filas.append((miembro["puuid"], fila))
+    medir_fase("indice", fase)
+
+    await asyncio.gather(*[set_cache(f"estado:{puuid}", fila, ttl=ESTADO_TTL) for puuid, fila in filas])
+    for nombre, puuids in movidos.items():
+        await publicar_board(nombre, puuids)
+    return filas
+
+# --- EN PARTIDA (tracker adaptativo) ---
+# spectator-v5 casi siempre responde 404, así que cada jugador tiene su propio intervalo
+# de consulta: recién visto en partida o recién terminada se consulta cada
+# VIVO_INTERVALO_MIN; cada 404 seguido lo duplica hasta VIVO_INTERVALO_MAX. De una partida
+# en curso se guarda el inicio y no se vuelve a consultar hasta que pudo haber terminado.
+VIVO_INTERVALO_MIN = 60
+VIVO_INTERVALO_MAX = 3600
+VIVO_DURACION_MIN = 900    # Casi ninguna partida termina antes de los 15 minutos
+VIVO_TANDA = int(os.environ.get("VIVO_TANDA", "50"))
+
+class TrackerEnVivo:
+    def __init__(self):
+        self.jugadores = {}  # puuid -> {"en_partida", "inicio", "intervalo", "proxima", "terminada"}
+        self.agenda = []     # heap [(proxima, puuid)]; las entradas reemplazadas se descartan al sacarlas
+
+    def seguir(self, puuid):
+        if puuid not in self.jugadores:
+            self.jugadores[puuid] = {"en_partida": False, "inicio": None, "intervalo": VIVO_INTERVALO_MIN,
+                                     "proxima": 0, "terminada": 0.0}
+            heapq.heappush(self.agenda, (0, puuid))
+
+    def en_partida(self, puuid):
+        estado = self.jugadores.get(puuid)
+        return bool(estado and estado["en_partida"])
+
+    def termino_desde(self, puuid, desde):
+        """True si se lo vio salir de una partida después de `desde`"""
+        estado = self.jugadores.get(puuid)
+        return bool(estado and estado["terminada"] > desde)
+
+    def _agendar(self, puuid, proxima):
+        self.jugadores[puuid]["proxima"] = proxima
+        heapq.heappush(self.agenda, (proxima, puuid))
+
+    def actividad(self, puuid, ahora):
+        """El jugador jugó hace poco: vuelve al intervalo mínimo"""
+        estado = self.jugadores.get(puuid)
+        if estado and not estado["en_partida"]:
+            estado["intervalo"] = VIVO_INTERVALO_MIN
+            if estado["proxima"] > ahora + VIVO_INTERVALO_MIN:
+                self._agendar(puuid, ahora + VIVO_INTERVALO_MIN)
+
+    def vencidos(self, limite, ahora, sigue):
+        """Hasta `limite` jugadores que toca consultar. Olvida a los que `sigue` ya no incluye"""
+        tanda = []
+        while self.agenda and self.agenda[0][0] <= ahora and len(tanda) < limite:
+            proxima, puuid = heapq.heappop(self.agenda)
+            estado = self.jugadores.get(puuid)
+            if estado is None or estado["proxima"] != proxima:
+                continue
+            if not sigue(puuid):
+                del self.jugadores[puuid]
+                continue
+            tanda.append(puuid)
+        return tanda
+
+    def registrar(self, puuid, res, ahora):
+        """Actualiza el estado con la respuesta de spectator. Devuelve True si entró o salió de partida"""
+        estado = self.jugadores.get(puuid)
+        if estado is None:
+            return False
+        estaba = estado["en_partida"]
+        if res.status_code == 200:
+            datos = res.json()
+            # gameStartTime viene en 0 mientras la partida carga
+            inicio = datos.get("gameStartTime", 0) / 1000 or ahora - datos.get("gameLength", 0)
+            estado.update(en_partida=True, inicio=inicio, intervalo=VIVO_INTERVALO_MIN)
+            proxima = max(ahora + VIVO_INTERVALO_MIN, inicio + VIVO_DURACION_MIN)
+        elif res.status_code == 404:
+            if estado["en_partida"]:
+                estado["intervalo"] = VIVO_INTERVALO_MIN  # Recién terminó: puede volver a la cola
+                estado["terminada"] = ahora
+            else:
+                estado["intervalo"] = min(estado["intervalo"] * 2, VIVO_INTERVALO_MAX)
+            estado.update(en_partida=False, inicio=None)
+            proxima = ahora + estado["intervalo"]
+        else:
+            proxima = ahora + VIVO_INTERVALO_MIN  # Riot falló: se reintenta sin cambiar el estado
+        self._agendar(puuid, proxima)
+        return estado["en_partida"] != estaba
+
+tracker_vivo = TrackerEnVivo()
+
+async def consultar_en_vivo(limite=VIVO_TANDA):
+    """Consulta spectator solo para los jugadores a los que les toca según su intervalo"""
+    puuids = tracker_vivo.vencidos(limite, time.time(), lambda p: bool(rosters_de(p)))
+    if not puuids:
+        return
+    inicio = time.perf_counter()
+    client = get_http_client()
+    # Spectator V5 usa PUUID
+    respuestas = await asyncio.gather(*[
+        fetch_riot(client, riot_url(plataforma_de(puuid), f"/lol/spectator/v5/active-games/by-summoner/{puuid}"))
+        for puuid in puuids
+    ])
+    medir_fase("spectator", inicio)
+    ahora = time.time()
+    for puuid, res in zip(puuids, respuestas):
+        try:
+            if tracker_vivo.registrar(puuid, res, ahora):
+                for roster in rosters_de(puuid):
+                    roster.version += 1
+                difusor.marcar(puuid)
+        except Exception as e:
+            log("Error leyendo partida en vivo de {puuid}…: {error}", logging.WARNING, puuid=puuid[:8], error=str(e))
+            tracker_vivo.registrar(puuid, RespuestaVacia(500), ahora)
+
+# Tareas de fondo que lanza cada tick pero que no hacen falta para responder el ranking:
+# el cold start de /api/ranking espera solo la tanda, no el spectator, los snapshots ni la analítica.
+tareas_fondo = {}  # nombre -> Task (una por nombre a la vez)
+
+def lanzar_en_fondo(nombre, fn):
+    tarea = tareas_fondo.get(nombre)
+    if tarea is not None and not tarea.done():
+        return tarea
+    async def correr():
         try:
-            async with asyncio.timeout(15):
-                async with ranking_lock:
-                    # Verificar de nuevo el caché por si otro proceso lo generó mientras esperábamos
-                    cached_ranking = await get_cache(cache_key)
-                    if cached_ranking:
-                        print("✅ Otro proceso generó el ranking mientras esperábamos")
-                        return cached_ranking
-                    
-                    ranking_in_progress = True
-                    print("🔄 Generando ranking nuevo...")
-                    # Lógica REAL de Riot
-                    ranking = []
-                    
-                    async with httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=httpx.Limits(max_connections=5)) as client:
-                        # 1. Obtener todos los PUUIDs en paralelo (o de caché)
-                        tasks_puuid = [get_puuid(client, a['nombre'], a['tag']) for a in AMIGOS]
-                        puuids = await asyncio.gather(*tasks_puuid)
-
-                        # 2. Preparar tareas para obtener Rangos y Estado en Vivo
-                        tasks_rank = []
-                        tasks_live = []
-                        amigos_validos = [] # Para mantener la relación índice-amigo
-
-                        for i, puuid in enumerate(puuids):
-                            if puuid:
-                                # Tarea Rango
-                                url_rank = f"https://{REGION_LEAGUE}.api.riotgames.com/lol/league/v4/entries/by-puuid/{puuid}"
-                                tasks_rank.append(fetch_riot(client, url_rank))
-                                
-                                # Tarea En Partida (Spectator V5 usa PUUID)
-                                url_live = f"https://{REGION_LEAGUE}.api.riotgames.com/lol/spectator/v5/active-games/by-summoner/{puuid}"
-                                tasks_live.append(fetch_riot(client, url_live))
-                                
-                                amigos_validos.append(AMIGOS[i])
-                        
-                        # Ejecutar todas las peticiones en paralelo
-                        responses_rank = await asyncio.gather(*tasks_rank)
-                        responses_live = await asyncio.gather(*tasks_live)
-
-                        for i, res_rank in enumerate(responses_rank):
-                            amigo = amigos_validos[i]
-                            res_live = responses_live[i]
-                            try:
-                                
-                                datos_jugador = {
-                                    "nombre": amigo['nombre'], 
-                                    "tag": amigo['tag'], 
-                                    "rank": "Unranked", 
-                                    "lp": 0, 
-                                    "winrate": 0,
-                                    "partidas": 0,
-                                    "wins": 0,
-                                    "losses": 0,
-                                    "en_partida": False
-                                }
-
-                                # Procesar Rango
-                                if res_rank.status_code == 200:
-                                    colas_data = res_rank.json()
-                                    for cola in colas_data:
-                                        if cola["queueType"] == "RANKED_SOLO_5x5":
-                                            wins = cola['wins']
-                                            losses = cola['losses']
-                                            total = wins + losses
-                                            wr = round((wins / total) * 100, 1) if total > 0 else 0
-                                            
-                                            tier = cola['tier']
-                                            rank = cola['rank']
-                                            lp = cola['leaguePoints']
-                                            
-                                            datos_jugador["rank"] = f"{tier} {rank}"
-                                            datos_jugador["lp"] = lp
-                                            datos_jugador["winrate"] = wr
-                                            datos_jugador["tier"] = tier
-                                            datos_jugador["division"] = rank
-                                            datos_jugador["partidas"] = total
-                                            datos_jugador["wins"] = wins
-                                            datos_jugador["losses"] = losses
-                                
-                                # Procesar Partida en Vivo (200 = En juego, 404 = No en juego)
-                                if res_live.status_code == 200:
-                                    datos_jugador["en_partida"] = True
-                                
-                                ranking.append(datos_jugador)
-                                
-                            except Exception as e:
-                                print(f"Error con {amigo['nombre']}: {e}")
-
-                    # Ordenar correctamente por tier, división y LP
-                    for jugador in ranking:
-                        tier = jugador.get('tier', 'IRON')
-                        division = jugador.get('division', 'IV')
-                        lp = jugador.get('lp', 0)
-                        jugador['puntos_totales'] = calcular_puntos_totales(tier, division, lp)
-                    
-                    resultado_final = sorted(ranking, key=lambda x: x.get('puntos_totales', 0), reverse=True)
-                    
-                    # Guardar en caché por 60 segundos (aumentado de 30)
-                    await set_cache("ranking:full", resultado_final, ttl=60)
-                    ranking_in_progress = False
-                    print("✅ Ranking generado y guardado en caché")
-                    
-                    return resultado_final
-                    
-        except asyncio.TimeoutError:
-            # Si esperamos más de 15 segundos, devolver caché viejo si existe
-            print("⚠️ Timeout esperando el lock, devolviendo caché viejo si existe")
-            old_cache = await get_cache(cache_key)
-            if old_cache:
-                return old_cache
-            return {"error": "El servidor está ocupado, intenta de nuevo en unos segundos"}
-            
+            await fn()
+        except Exception as e:
+            log("❌ Error en la tarea {tarea}: {error}", logging.ERROR, exc_info=True, tarea=nombre, error=str(e))
+    tareas_fondo[nombre] = tarea = asyncio.create_task(correr())
+    return tarea
+
+async def _tarea_en_vivo():
+    await consultar_en_vivo()
+    difusor.publicar()
+
+async def _tarea_refresco():
+    try:
+        await cargar_rosters()
+        miembros = jugadores_pendientes(REFRESCO_TANDA, time.time())
+        if miembros:
+            await refrescar_tanda(miembros)
+        difusor.publicar()
+    except Exception as e:
+        log("❌ ERROR REFRESCANDO RANKING: {error}", logging.ERROR, exc_info=True, error=str(e))
+    lanzar_en_fondo("en_vivo", _tarea_en_vivo)
+    lanzar_en_fondo("snapshots", rotar_snapshots)
+    # La pasada de NumPy crece con las partidas guardadas: nunca en el camino del ranking
+    lanzar_en_fondo("analitica", refrescar_analitica)
+
+def lanzar_refresco(forzar=False):
+    """
+    Lanza una tanda si no hay una en curso y pasó REFRESCO_TICK desde la anterior.
+    Devuelve la tarea en curso (o None). Los requests también la disparan, así el
+    refresco sigue aunque no corra ciclo_refresco (ej: serverless sin lifespan).
+    """
+    global refresco_task, ultimo_tick
+    if refresco_task is not None and not refresco_task.done():
+        return refresco_task
+    if not forzar and time.monotonic() - ultimo_tick < REFRESCO_TICK:
+        return None
+    ultimo_tick = time.monotonic()
+    refresco_task = asyncio.create_task(_tarea_refresco())
+    return refresco_task
+
+async def ciclo_refresco():
+    """Refresca una tanda cada REFRESCO_TICK segundos mientras viva el proceso"""
+    while True:
+        tarea = lanzar_refresco()
+        if tarea is not None:
+            await tarea
+        await asyncio.sleep(REFRESCO_TICK)
+
+# --- SNAPSHOTS (deltas de LP y posición) ---
+# Una vez por SNAPSHOT_INTERVALO se guarda la posición y los puntos de cada jugador del
+# board (O(n) por intervalo). Las lecturas solo buscan en la foto a los jugadores de la
+# página. El delta de LP se calcula con puntos_totales, así un ascenso de división no
+# aparece como LP perdidos.
+snapshots = {}  # roster -> {"tomado": ts, "jugadores": {puuid: [posición, puntos]}}
+
+def board_cargado(roster):
+    """True cuando todos los miembros ya pasaron por al menos una tanda"""
+    return all(
+        m["puuid"] in roster.board.puntos or clave in ultimo_intento
+        for clave, m in roster.miembros.items()
+    )
+
+async def rotar_snapshots():
+    ahora = time.time()
+    for roster in list(rosters.values()):
+        snap = snapshots.get(roster.nombre)
+        if snap is None:
+            # Puede haberla tomado otra instancia
+            snap = await get_cache(f"snapshot:{roster.nombre}")
+            if snap:
+                snapshots[roster.nombre] = snap
+                roster.version += 1
+        if snap and ahora - snap["tomado"] < SNAPSHOT_INTERVALO:
+            continue
+        # La primera foto espera al board completo para no dejar jugadores sin delta
+        if not len(roster.board) or (snap is None and not board_cargado(roster)):
+            continue
+        snap = {
+            "tomado": ahora,
+            "jugadores": {puuid: [i, -puntos] for i, (puntos, puuid) in enumerate(roster.board.orden)},
+        }
+        snapshots[roster.nombre] = snap
+        roster.version += 1
+        await set_cache(f"snapshot:{roster.nombre}", snap, ttl=int(SNAPSHOT_INTERVALO * 2))
+
+# Campos de `estados` que solo usa el refresco
+CAMPOS_INTERNOS = ("comprobado", "ultima_partida")
+
+def fila_con_deltas(roster, puuid, posicion):
+    """Copia de la fila del jugador con su posición y los deltas contra la última foto"""
+    fila = {k: v for k, v in estados[puuid].items() if k not in CAMPOS_INTERNOS}
+    fila.update(en_partida=tracker_vivo.en_partida(puuid), posicion=posicion + 1, delta_lp=None, delta_posicion=None)
+    snap = snapshots.get(roster)
+    anterior = snap["jugadores"].get(puuid) if snap else None
+    if anterior:
+        fila["delta_posicion"] = anterior[0] - posicion  # Positivo = subió
+        fila["delta_lp"] = fila["puntos_totales"] - anterior[1]
+    return fila
+
+# Páginas del ranking ya serializadas: (roster, offset, limit) -> (versión del roster, RespuestaSerializada, puuids)
+RESPUESTAS_MAX = 256
+respuestas_ranking = OrderedDict()
+
+def pagina_serializada(tabla, offset, limit):
+    """La página del cache si el roster no cambió desde que se serializó; si no, la arma de nuevo"""
+    clave = (tabla.nombre, offset, limit)
+    entrada = respuestas_ranking.get(clave)
+    if entrada is not None and entrada[0] == tabla.version:
+        respuestas_ranking.move_to_end(clave)
+        return entrada
+    puuids = tabla.board.pagina(offset, limit)
+    filas = [fila_con_deltas(tabla.nombre, puuid, offset + i) for i, puuid in enumerate(puuids)]
+    entrada = respuestas_ranking[clave] = (tabla.version, RespuestaSerializada(filas), puuids)
+    respuestas_ranking.move_to_end(clave)
+    if len(respuestas_ranking) > RESPUESTAS_MAX:
+        respuestas_ranking.popitem(last=False)
+    return entrada
+
+@app.get("/api/ranking")
+async def get_ranking(request: Request, response: Response, roster: str = ROSTER_DEFECTO,
+                      offset: int = Query(0, ge=0), limit: int | None = Query(None, ge=1, le=RANKING_LIMITE_MAX)):
+    """Board de un roster ordenado por puntos. Sin `limit` devuelve el roster completo"""
+    try:
+        await cargar_rosters()
+        tabla = rosters.get(roster)
+        if tabla is None:
+            response.status_code = 404
+            return {"error": "Roster no encontrado"}
+
+        if not len(tabla.board) and tabla.miembros:
+            # Si la clave sigue siendo el placeholder, devolvemos datos falsos para probar el front
+            if RIOT_API_KEY == "TU_CLAVE_DE_RIOT_AQUI":
+                return [
+                    {"nombre": "DemoUser", "tag": "TEST", "rank": "Gold IV", "lp": 50, "winrate": 51.5, "en_partida": True, "puntos_totales": 1250},
+                    {"nombre": "SinApi", "tag": "KEY", "rank": "Challenger", "lp": 999, "winrate": 60.0, "en_partida": False, "puntos_totales": 4899},
+                ]
+
+            # No hay nada que servir: todos esperan la misma tanda, pero solo hasta que su
+            # primer grupo entra al board (el resto llega por SSE o en el próximo request).
+            # asyncio.wait no cancela la tarea si vence el timeout de este request
+            try:
+                async with asyncio.timeout(RANKING_TIMEOUT):
+                    tarea = lanzar_refresco(forzar=True)
+                    while not len(tabla.board) and not tarea.done():
+                        await asyncio.wait({tarea}, timeout=0.05)
+            except asyncio.TimeoutError:
+                log("⚠️ Timeout esperando la primera tanda del ranking", logging.WARNING, roster=roster)
+                return {"error": "El servidor está ocupado, intenta de nuevo en unos segundos"}
+        else:
+            lanzar_refresco()
+
+        _, serializada, puuids = pagina_serializada(tabla, offset, limit)
+        # HIT: todos los miembros tienen fila; PARTIAL: algunos todavía no se refrescaron
+        headers = {
+            "X-Cache": "HIT" if len(tabla.board) == len(tabla.miembros) else "PARTIAL",
+            "X-Total-Count": str(len(tabla.board)),
+        }
+        filas = [estados[p] for p in puuids if p in estados]
+        if filas:
+            headers["Age"] = str(int(time.time() - min(f.get("comprobado", f["actualizado"]) for f in filas)))
+        if roster in snapshots:
+            headers["X-Snapshot-Age"] = str(int(time.time() - snapshots[roster]["tomado"]))
+        return serializada.responder(request, headers)
+
     except Exception as e:
-        ranking_in_progress = False
-        print(f"❌ ERROR GENERAL EN /api/ranking: {e}")
-        import traceback
-        traceback.print_exc()
+        log("❌ ERROR GENERAL EN /api/ranking: {error}", logging.ERROR, exc_info=True, error=str(e))
         return {"error": str(e)}
 
-@app.get("/api/jugador/{nombre}/{tag}")
-async def get_jugador_detalle(nombre: str, tag: str):
-    """Obtiene detalles de un jugador: campeón más jugado y duo más frecuente"""
+@app.get("/api/ranking/{nombre}/{tag}")
+async def get_posicion_jugador(nombre: str, tag: str, request: Request, response: Response,
+                               roster: str = ROSTER_DEFECTO):
+    """Posición de un jugador en el board (O(log n)) con sus deltas"""
+    try:
+        await cargar_rosters()
+        tabla = rosters.get(roster)
+        if tabla is None:
+            response.status_code = 404
+            return {"error": "Roster no encontrado"}
+        miembro = tabla.miembros.get(clave_riot_id(nombre, tag))
+        posicion = tabla.board.posicion(miembro["puuid"]) if miembro else None
+        if posicion is None:
+            response.status_code = 404
+            return {"error": "Jugador no está en el ranking"}
+        datos = {**fila_con_deltas(roster, miembro["puuid"], posicion), "total": len(tabla.board)}
+        return RespuestaSerializada(datos).responder(request)
+
+    except Exception as e:
+        log("❌ ERROR GENERAL EN /api/ranking: {error}", logging.ERROR, exc_info=True, error=str(e))
+        return {"error": str(e)}
+
+async def recargar_para_escribir(response):
+    """Relee los rosters antes de modificarlos. Si la capa compartida falla no se escribe nada (503)"""
     try:
-        async with httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=httpx.Limits(max_connections=5)) as client:
-            # 1. Obtener PUUID (con caché)
-            puuid = await get_puuid(client, nombre, tag)
+        await _cargar_rosters()
+        return True
+    except CacheNoDisponible as e:
+        log("⚠️ No se pudieron releer los rosters: {error}", logging.WARNING, error=str(e))
+        response.status_code = 503
+        return False
+
+def error_admin(token, response):
+    """None si el token de administrador es válido; si no, el error (403) a devolver"""
+    if not ROSTER_ADMIN_TOKEN:
+        response.status_code = 403
+        return {"error": "Rosters de solo lectura: falta configurar ROSTER_ADMIN_TOKEN"}
+    if not hmac.compare_digest((token or "").encode(), ROSTER_ADMIN_TOKEN.encode()):
+        response.status_code = 403
+        return {"error": "Token de administrador inválido"}
+    return None
+
+def error_jugadores(jugador, response):
+    if len(jugador) > ROSTER_JUGADORES_MAX:
+        response.status_code = 400
+        return {"error": f"Máximo {ROSTER_JUGADORES_MAX} jugadores por llamada"}
+    return None
+
+def parse_riot_ids(jugador):
+    """["Nombre#TAG", ...] -> [{"nombre", "tag"}] (ignora los que no tienen #)"""
+    return [dict(zip(("nombre", "tag"), j.rsplit("#", 1))) for j in jugador or [] if "#" in j]
+
+@app.get("/api/rosters")
+async def listar_rosters():
+    await cargar_rosters()
+    return [
+        {"nombre": r.nombre, "jugadores": len(r.miembros), "en_ranking": len(r.board)}
+        for r in rosters.values()
+    ]
+
+@app.get("/api/rosters/{roster}")
+async def ver_roster(roster: str, response: Response):
+    await cargar_rosters()
+    if roster not in rosters:
+        response.status_code = 404
+        return {"error": "Roster no encontrado"}
+    return [
+        {"nombre": m["nombre"], "tag": m["tag"], "plataforma": m["plataforma"]}
+        for m in rosters[roster].miembros.values()
+    ]
+
+@app.post("/api/rosters/{roster}/jugadores")
+async def agregar_jugadores(roster: str, response: Response, jugador: list[str] = Query(...),
+                            plataforma: str = PLATAFORMA_DEFECTO, x_admin_token: str | None = Header(None)):
+    """
+    Agrega jugadores (?jugador=Nombre%23TAG, repetible) de una plataforma (la2, euw1, kr...)
+    al roster, creándolo si no existe. Solo se agregan los Riot ID que existen, y se
+    refrescan al momento para que ya aparezcan en el ranking.
+    """
+    if error := error_admin(x_admin_token, response) or error_jugadores(jugador, response):
+        return error
+    if not ROSTER_NOMBRE.match(roster):
+        response.status_code = 400
+        return {"error": "Nombre de roster inválido"}
+    if plataforma not in PLATAFORMAS:
+        response.status_code = 400
+        return {"error": "Plataforma inválida"}
+
+    pedidos = [{**j, "plataforma": plataforma} for j in parse_riot_ids(jugador)]
+    client = get_http_client()
+    puuids = await asyncio.gather(*[get_puuid(client, j['nombre'], j['tag'], plataforma) for j in pedidos])
+
+    async with rosters_lock:
+        # Releer antes de modificar para no pisar cambios hechos desde otra instancia
+        if not await recargar_para_escribir(response):
+            return {"error": "Caché compartido no disponible"}
+        tabla = rosters.setdefault(roster, Roster(roster))
+        agregados, no_encontrados = [], []
+        for pedido, puuid in zip(pedidos, puuids):
             if not puuid:
-                return {"error": "Jugador no encontrado"}
-            
-            # 2. Obtener últimas 20 partidas (reducido de 50 para optimizar en Vercel)
-            # queue=420 es RANKED_SOLO_5x5
-            url_matches = f"https://{REGION_ACCOUNT}.api.riotgames.com/lol/match/v5/matches/by-puuid/{puuid}/ids?queue=420&start=0&count=20"
-            res_matches = await fetch_riot(client, url_matches)
-            
-            if res_matches.status_code != 200:
-                return {"error": "No se pudo obtener historial"}
-            
-            match_ids = res_matches.json()
-            
-            # 3. Analizar las partidas (Concurrente y con caché)
-            campeones = {}
-            duos = {}
-            total_kills = 0
-            total_deaths = 0
-            total_assists = 0
-            partidas_analizadas = 0
-            temporada_2026_start = 1735689600000
-
-            # Función auxiliar para obtener detalle de una partida
-            async def get_match_data(mid):
-                # Intentar sacar de caché (las partidas terminadas no cambian)
-                cache_key = f"match:{mid}"
-                cached_match = await get_cache(cache_key)
-                if cached_match:
-                    return cached_match
-                
-                # Si no está, pedir a Riot
-                url = f"https://{REGION_ACCOUNT}.api.riotgames.com/lol/match/v5/matches/{mid}"
-                r = await fetch_riot(client, url)
-                if r.status_code == 200:
-                    data = r.json()
-                    # Guardar en caché por mucho tiempo (30 días)
-                    await set_cache(cache_key, data, ttl=2592000)
-                    return data
-                return None
-
-            # Lanzar todas las peticiones de partidas a la vez
-            match_tasks = [get_match_data(mid) for mid in match_ids]
-            matches_data = await asyncio.gather(*match_tasks)
-
-            for match_data in matches_data:
-                if not match_data: continue
-
-                info = match_data.get("info", {})
-                
-                # Verificar temporada y cola
-                if info.get("gameCreation", 0) < temporada_2026_start: continue
-                if info.get("queueId", 0) != 420: continue
-                
-                participants = info.get("participants", [])
-                
-                # Buscar al jugador
-                jugador_data = next((p for p in participants if p.get("puuid") == puuid), None)
-                if not jugador_data: continue
-                
-                partidas_analizadas += 1
-                
-                # Estadísticas
-                total_kills += jugador_data.get("kills", 0)
-                total_deaths += jugador_data.get("deaths", 0)
-                total_assists += jugador_data.get("assists", 0)
-                
-                # Campeón
-                champ_name = jugador_data.get("championName")
-                win = jugador_data.get("win", False)
-                
-                if champ_name not in campeones:
-                    campeones[champ_name] = {"wins": 0, "games": 0, "kills": 0, "deaths": 0, "assists": 0}
-                c = campeones[champ_name]
-                c["games"] += 1
-                c["kills"] += jugador_data.get("kills", 0)
-                c["deaths"] += jugador_data.get("deaths", 0)
-                c["assists"] += jugador_data.get("assists", 0)
-                if win: c["wins"] += 1
-                
-                # Duo
-                team_id = jugador_data.get("teamId")
-                for p in participants:
-                    if p.get("teamId") == team_id and p.get("puuid") != puuid:
-                        duo_puuid = p.get("puuid")
-                        if duo_puuid not in duos:
-                            duos[duo_puuid] = {"nombre": f"{p.get('riotIdGameName')}#{p.get('riotIdTagline')}", "wins": 0, "games": 0}
-                        duos[duo_puuid]["games"] += 1
-                        if win: duos[duo_puuid]["wins"] += 1
-            
-            # Calcular KDA general
-            kda_general = round((total_kills + total_assists) / total_deaths, 2) if total_deaths > 0 else round(total_kills + total_assists, 2)
-            
-            # Top Campeón
-            top_champ = None
-            if campeones:
-                top_champ_name = max(campeones, key=lambda x: campeones[x]["games"])
-                stats = campeones[top_champ_name]
-                wr = round((stats["wins"] / stats["games"]) * 100, 1)
-                kda_champ = round((stats["kills"] + stats["assists"]) / stats["deaths"], 2) if stats["deaths"] > 0 else round(stats["kills"] + stats["assists"], 2)
-                top_champ = {
-                    "nombre": top_champ_name,
-                    "partidas": stats["games"],
-                    "winrate": wr,
-                    "kda": kda_champ
-                }
-            
-            # Top Duo
-            top_duo = None
-            if duos:
-                top_duo_puuid = max(duos, key=lambda x: duos[x]["games"])
-                stats = duos[top_duo_puuid]
-                # Solo mostrar si han jugado más de 1 partida juntos para filtrar randoms
-                if stats["games"] > 1:
-                    wr = round((stats["wins"] / stats["games"]) * 100, 1)
-                    top_duo = {
-                        "nombre": stats["nombre"],
-                        "partidas": stats["games"],
-                        "winrate": wr
-                    }
-            
+                no_encontrados.append(pedido)
+            elif tabla.agregar({**pedido, "puuid": puuid}):
+                agregados.append(tabla.miembros[clave_riot_id(pedido["nombre"], pedido["tag"])])
+        await guardar_roster(tabla)
+
+    nuevos = [m for m in agregados if m["puuid"] not in estados]
+    if nuevos:
+        await refrescar_tanda(nuevos)
+    await publicar_board(roster, [m["puuid"] for m in agregados])
+    for m in agregados:
+        difusor.marcar(m["puuid"])
+    difusor.publicar()
+    return {
+        "roster": roster,
+        "agregados": [{"nombre": m["nombre"], "tag": m["tag"]} for m in agregados],
+        "no_encontrados": no_encontrados,
+        "jugadores": len(tabla.miembros),
+    }
+
+@app.delete("/api/rosters/{roster}/jugadores")
+async def quitar_jugadores(roster: str, response: Response, jugador: list[str] = Query(...),
+                           x_admin_token: str | None = Header(None)):
+    """Quita jugadores (?jugador=Nombre%23TAG, repetible) del roster"""
+    if error := error_admin(x_admin_token, response) or error_jugadores(jugador, response):
+        return error
+
+    async with rosters_lock:
+        if not await recargar_para_escribir(response):
+            return {"error": "Caché compartido no disponible"}
+        tabla = rosters.get(roster)
+        if tabla is None:
+            response.status_code = 404
+            return {"error": "Roster no encontrado"}
+        quitados = [m for j in parse_riot_ids(jugador) if (m := tabla.quitar(clave_riot_id(j["nombre"], j["tag"])))]
+        await guardar_roster(tabla)
+    await publicar_board(roster, [m["puuid"] for m in quitados if m["puuid"]])
+    for m in quitados:
+        difusor.marcar_quitado(roster, m)
+    difusor.publicar()
+
+    # El estado de quien ya no está en ningún roster no se necesita en memoria
+    for m in quitados:
+        if m["puuid"] and not any(m["puuid"] in r.puuids for r in rosters.values()):
+            estados.pop(m["puuid"], None)
+    return {
+        "roster": roster,
+        "quitados": [{"nombre": m["nombre"], "tag": m["tag"]} for m in quitados],
+        "jugadores": len(tabla.miembros),
+    }
+
+@app.delete("/api/rosters/{roster}")
+async def borrar_roster(roster: str, response: Response, x_admin_token: str | None = Header(None)):
+    if error := error_admin(x_admin_token, response):
+        return error
+
+    async with rosters_lock:
+        if not await recargar_para_escribir(response):
+            return {"error": "Caché compartido no disponible"}
+        tabla = rosters.pop(roster, None)
+        if tabla is None:
+            response.status_code = 404
+            return {"error": "Roster no encontrado"}
+        olvidar_roster(tabla)
+        await guardar_nombres_rosters(quitar=roster)
+    snapshots.pop(roster, None)
+    if redis_client:
+        try:
+            await redis_client.delete(key_board(roster), f"snapshot:{roster}")
+        except Exception as e:
+            CACHE_STATS["redis"]["errors"] += 1
+            log("⚠️ Error Redis: {error}", logging.WARNING, error=str(e))
+    return {"roster": roster, "borrado": True}
+
+# --- STREAMING (SSE / WebSocket) ---
+# Los clientes no sondean /api/ranking: se suscriben y reciben el board completo al
+# conectarse y después solo las filas que cambiaron (LP, partida nueva, entrar/salir de
+# partida, altas y bajas del roster). El único productor son las tandas y el tracker en
+# vivo, así que el trabajo contra Riot es el mismo con 1 o con 1000 clientes; cada evento
+# se serializa una vez y se reparte a todas las colas.
+STREAM_HEARTBEAT = 15     # Segundos entre pings (también empuja el refresco si no hay lifespan)
+STREAM_COLA_MAX = 100     # Eventos pendientes por cliente antes de mandarle el board de nuevo
+
+class Suscriptor:
+    def __init__(self, roster):
+        self.roster = roster
+        self.cola = asyncio.Queue(maxsize=STREAM_COLA_MAX)
+        self.desfasado = False  # Se perdió eventos por lento: le toca el board completo
+
+class Difusor:
+    def __init__(self):
+        self.suscriptores = set()
+        self.pendientes = defaultdict(dict)  # roster -> {puuid: None (cambió) | {"nombre", "tag"} (se fue)}
+
+    def suscribir(self, roster):
+        sub = Suscriptor(roster)
+        self.suscriptores.add(sub)
+        return sub
+
+    def desuscribir(self, sub):
+        self.suscriptores.discard(sub)
+
+    def marcar(self, puuid):
+        """La fila del jugador cambió: va en el próximo evento de cada roster donde está"""
+        if self.suscriptores:
+            for roster in rosters_de(puuid):
+                self.pendientes[roster.nombre][puuid] = None
+
+    def marcar_quitado(self, roster, miembro):
+        if self.suscriptores:
+            clave = miembro["puuid"] or clave_riot_id(miembro["nombre"], miembro["tag"])
+            self.pendientes[roster][clave] = {"nombre": miembro["nombre"], "tag": miembro["tag"]}
+
+    def publicar(self):
+        """Arma un evento por roster con lo marcado y lo encola a sus clientes"""
+        pendientes, self.pendientes = self.pendientes, defaultdict(dict)
+        for nombre, tabla in list(rosters.items()):
+            # Cuando uno pasa a otros también cambian la posición y el delta de los que pasó
+            movidos = tabla.board.tomar_movidos()
+            cambios = pendientes.get(nombre, {})
+            if not (cambios or movidos) or not any(sub.roster == nombre for sub in self.suscriptores):
+                continue
+            quitados = [quitado for quitado in cambios.values() if quitado]
+            puuids = dict.fromkeys([puuid for puuid, quitado in cambios.items() if not quitado] + movidos)
+            filas = []
+            for puuid in puuids:
+                if (posicion := tabla.board.posicion(puuid)) is not None:
+                    filas.append(fila_con_deltas(nombre, puuid, posicion))
+            datos = json_bytes({"filas": filas, "quitados": quitados, "total": len(tabla.board)}).decode()
+            for sub in self.suscriptores:
+                if sub.roster != nombre or sub.desfasado:
+                    continue
+                try:
+                    sub.cola.put_nowait(datos)
+                except asyncio.QueueFull:
+                    sub.desfasado = True
+
+difusor = Difusor()
+
+def board_completo(roster):
+    tabla = rosters[roster]
+    return json_bytes([fila_con_deltas(roster, puuid, i) for i, puuid in enumerate(tabla.board.pagina())]).decode()
+
+async def eventos_ranking(roster, desconectado):
+    """(evento, JSON) para un cliente: "ranking" con el board completo y después "cambios\""""
+    sub = difusor.suscribir(roster)
+    try:
+        yield "ranking", board_completo(roster)
+        while not await desconectado():
+            if sub.desfasado:
+                while not sub.cola.empty():
+                    sub.cola.get_nowait()
+                sub.desfasado = False
+                yield "ranking", board_completo(roster)
+                continue
+            try:
+                async with asyncio.timeout(STREAM_HEARTBEAT):
+                    datos = await sub.cola.get()
+            except asyncio.TimeoutError:
+                lanzar_refresco()
+                yield "ping", None
+                continue
+            yield "cambios", datos
+    finally:
+        difusor.desuscribir(sub)
+
+@app.get("/api/ranking/stream")
+async def stream_ranking(request: Request, roster: str = ROSTER_DEFECTO):
+    """Server-Sent Events con los cambios del ranking de un roster"""
+    await cargar_rosters()
+    if roster not in rosters:
+        return JSONResponse({"error": "Roster no encontrado"}, status_code=404)
+    if not len(rosters[roster].board):
+        lanzar_refresco(forzar=True)
+
+    async def sse():
+        async for evento, datos in eventos_ranking(roster, request.is_disconnected):
+            yield ": ping\n\n" if datos is None else f"event: {evento}\ndata: {datos}\n\n"
+
+    return StreamingResponse(sse(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.websocket("/api/ranking/ws")
+async def ws_ranking(websocket: WebSocket, roster: str = ROSTER_DEFECTO):
+    """Lo mismo que /api/ranking/stream por WebSocket: mensajes {"evento", "datos"}"""
+    await cargar_rosters()
+    if roster not in rosters:
+        await websocket.close(code=4404)
+        return
+    await websocket.accept()
+    if not len(rosters[roster].board):
+        lanzar_refresco(forzar=True)
+
+    async def desconectado():
+        return websocket.client_state != WebSocketState.CONNECTED
+
+    try:
+        async for evento, datos in eventos_ranking(roster, desconectado):
+            await websocket.send_text(f'{{"evento": "{evento}", "datos": {datos or "null"}}}')
+    except WebSocketDisconnect:
+        pass
+
+# --- PARTIDAS (formato compacto) ---
+# De cada partida de match-v5 (decenas de KB) solo guardamos lo que usamos:
+# cola, fecha y por participante puuid, equipo, campeón, K/D/A, victoria, Riot ID y rol.
+# El payload empieza con [versión de esquema, formato] para poder cambiarlo más adelante;
+# una versión distinta cuenta como miss y la partida se vuelve a pedir.
+MATCH_SCHEMA = 1  # Primer byte del payload: si cambia Participante, se sube y no se leen los viejos
+MATCH_TTL = 2592000  # Las partidas terminadas no cambian: 30 días
+FORMATO_JSON = 0
+FORMATO_MSGPACK = 1
+
+PartidaCompacta = namedtuple("PartidaCompacta", "queue_id creacion participantes")
+Participante = namedtuple("Participante", "puuid team_id campeon kills deaths assists win nombre tag rol")
+
+def compactar_partida(data):
+    """match-v5 completo -> PartidaCompacta"""
+    info = data.get("info", {})
+    participantes = [
+        Participante(
+            p.get("puuid"), p.get("teamId"), p.get("championName"),
+            p.get("kills", 0), p.get("deaths", 0), p.get("assists", 0), bool(p.get("win", False)),
+            p.get("riotIdGameName"), p.get("riotIdTagline"), p.get("teamPosition") or "",
+        )
+        for p in info.get("participants", [])
+    ]
+    return PartidaCompacta(info.get("queueId", 0), info.get("gameCreation", 0), participantes)
+
+def empaquetar_partida(partida):
+    cuerpo = [partida.queue_id, partida.creacion, [list(p) for p in partida.participantes]]
+    if msgpack:
+        return bytes([MATCH_SCHEMA, FORMATO_MSGPACK]) + msgpack.packb(cuerpo)
+    return bytes([MATCH_SCHEMA, FORMATO_JSON]) + json.dumps(cuerpo, separators=(",", ":")).encode()
+
+def partida_legible(payload):
+    """Si el payload es de este esquema y en un formato que podemos leer"""
+    return (isinstance(payload, bytes) and len(payload) >= 2 and payload[0] == MATCH_SCHEMA
+            and (payload[1] != FORMATO_MSGPACK or msgpack is not None))
+
+def desempaquetar_partida(payload):
+    """Devuelve la PartidaCompacta o None si el payload es de otro esquema/formato"""
+    if not partida_legible(payload):
+        return None
+    if payload[1] == FORMATO_MSGPACK:
+        queue_id, creacion, participantes = msgpack.unpackb(payload[2:])
+    else:
+        queue_id, creacion, participantes = json.loads(payload[2:])
+    return PartidaCompacta(queue_id, creacion, [Participante(*p) for p in participantes])
+
+# Partida que Riot no tiene (404): a diferencia de None (429, timeout) no se reintenta,
+# se saltea al sumar el historial
+PARTIDA_FALTANTE = "faltante"
+
+async def get_partida(client, mid):
+    """PartidaCompacta de caché o de Riot (se compacta al recibirla), PARTIDA_FALTANTE o None"""
+    async def buscar():
+        r = await fetch_riot(client, riot_url(region_de_partida(mid), f"/lol/match/v5/matches/{mid}"))
+        if r.status_code == 200:
+            return empaquetar_partida(compactar_partida(r.json()))
+        return NO_ENCONTRADO if r.status_code == 404 else None
+
+    payload = await cache_o_buscar(f"match:v{MATCH_SCHEMA}:{mid}", buscar, ttl=MATCH_TTL,
+                                   valido=partida_legible, faltante=PARTIDA_FALTANTE)
+    if payload is PARTIDA_FALTANTE:
+        return PARTIDA_FALTANTE
+    return desempaquetar_partida(payload)
+
+# --- STORE LOCAL (SQLite) ---
+# Partidas y participantes en tablas con índices, para que las estadísticas
+# sean consultas SQL en vez de recorrer blobs JSON del caché. En WAL las lecturas no
+# esperan a las escrituras. SQLITE_PATH="" lo desactiva.
+SQLITE_PATH = os.environ.get("SQLITE_PATH", os.path.join(tempfile.gettempdir(), "soloq.db"))
+
+STORE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS matches (
+    match_id TEXT PRIMARY KEY,
+    queue_id INTEGER NOT NULL,
+    game_creation INTEGER NOT NULL
+);
+-- queue_id y game_creation se repiten aquí para filtrar por jugador y fecha con un solo índice
+CREATE TABLE IF NOT EXISTS participants (
+    match_id TEXT NOT NULL,
+    puuid TEXT NOT NULL,
+    queue_id INTEGER NOT NULL,
+    game_creation INTEGER NOT NULL,
+    team_id INTEGER NOT NULL,
+    champion_name TEXT NOT NULL,
+    kills INTEGER NOT NULL,
+    deaths INTEGER NOT NULL,
+    assists INTEGER NOT NULL,
+    win INTEGER NOT NULL,
+    riot_name TEXT,
+    riot_tag TEXT,
+    role TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (match_id, puuid)
+);
+CREATE INDEX IF NOT EXISTS idx_participants_puuid_creation ON participants (puuid, game_creation);
+CREATE INDEX IF NOT EXISTS idx_participants_match ON participants (match_id);
+CREATE INDEX IF NOT EXISTS idx_participants_champion ON participants (champion_name);
+"""
+
+class MatchStore:
+    """SQLite compartido por el proceso. Las consultas corren en un thread para no frenar el event loop"""
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.conn = sqlite3.connect(ruta, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(STORE_SCHEMA)
+
+    def _ejecutar(self, fn, *args):
+        with self.lock:
+            with self.conn:  # Transacción: commit al salir, rollback si falla
+                return fn(self.conn, *args)
+
+    async def ejecutar(self, fn, *args):
+        return await asyncio.to_thread(self._ejecutar, fn, *args)
+
+    async def guardar_partidas(self, partidas):
+        """Inserta en lote {mid: PartidaCompacta}; las que ya estaban se ignoran"""
+        def guardar(conn, filas_matches, filas_participants):
+            conn.executemany("INSERT OR IGNORE INTO matches VALUES (?, ?, ?)", filas_matches)
+            conn.executemany("INSERT OR IGNORE INTO participants VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", filas_participants)
+
+        filas_matches = []
+        filas_participants = []
+        for mid, partida in partidas.items():
+            if partida is None or partida is PARTIDA_FALTANTE:
+                continue
+            filas_matches.append((mid, partida.queue_id, partida.creacion))
+            for p in partida.participantes:
+                filas_participants.append((
+                    mid, p.puuid, partida.queue_id, partida.creacion, p.team_id, p.campeon,
+                    p.kills, p.deaths, p.assists, int(p.win), p.nombre, p.tag, p.rol,
+                ))
+        if filas_matches:
+            await self.ejecutar(guardar, filas_matches, filas_participants)
+
+    async def resumen_jugador(self, puuid, desde):
+        """Totales, top campeón y top duo de SoloQ desde `desde` (ms) con el índice (puuid, game_creation)"""
+        def consultar(conn):
+            filtro = "p.puuid = ? AND p.game_creation >= ? AND p.queue_id = ?"
+            args = (puuid, desde, COLA_SOLOQ)
+            totales = conn.execute(
+                f"SELECT COUNT(*) AS games, SUM(kills) AS kills, SUM(deaths) AS deaths, SUM(assists) AS assists "
+                f"FROM participants p WHERE {filtro}", args).fetchone()
+            campeon = conn.execute(
+                f"""SELECT champion_name, COUNT(*) AS games, SUM(win) AS wins,
+                           SUM(kills) AS kills, SUM(deaths) AS deaths, SUM(assists) AS assists
+                    FROM participants p WHERE {filtro}
+                    GROUP BY champion_name ORDER BY games DESC LIMIT 1""", args).fetchone()
+            duo = conn.execute(
+                f"""SELECT o.riot_name, o.riot_tag, COUNT(*) AS games, SUM(p.win) AS wins
+                    FROM participants p
+                    JOIN participants o ON o.match_id = p.match_id AND o.team_id = p.team_id AND o.puuid != p.puuid
+                    WHERE {filtro}
+                    GROUP BY o.puuid ORDER BY games DESC LIMIT 1""", args).fetchone()
+            return totales, campeon, duo
+
+        return await self.ejecutar(consultar)
+
+    async def ultima_participacion(self):
+        """rowid de la última fila de participants: cambia solo cuando entran partidas nuevas"""
+        def consultar(conn):
+            return conn.execute("SELECT MAX(rowid) FROM participants").fetchone()[0]
+        return await self.ejecutar(consultar)
+
+    async def participaciones(self, desde):
+        """Participaciones de SoloQ desde `desde` (ms) como tuplas, para cargarlas en columnas"""
+        def consultar(conn):
+            cursor = conn.execute(
+                "SELECT match_id, puuid, team_id, champion_name, role, kills, deaths, assists, win, game_creation "
+                "FROM participants WHERE queue_id = ? AND game_creation >= ?", (COLA_SOLOQ, desde))
+            cursor.row_factory = None  # Tuplas simples: son muchas filas
+            return cursor.fetchall()
+        return await self.ejecutar(consultar)
+
+    async def estadisticas(self):
+        def consultar(conn):
             return {
-                "campeon": top_champ,
-                "duo": top_duo,
-                "kda_general": kda_general,
-                "partidas_temporada": partidas_analizadas
+                tabla: conn.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0]
+                for tabla in ("matches", "participants")
+            }
+        return await self.ejecutar(consultar)
+
+store = None
+if SQLITE_PATH:
+    try:
+        store = MatchStore(SQLITE_PATH)
+    except sqlite3.Error as e:
+        log("⚠️ No se pudo abrir SQLite en {ruta}: {error}", logging.WARNING, ruta=SQLITE_PATH, error=str(e))
+
+# --- AGREGADOS POR JUGADOR (temporada completa, incrementales) ---
+# Por cada PUUID guardamos los totales de la temporada (K/D/A, campeones, duos) y la
+# última partida ya sumada. Cada request solo pide los IDs más nuevos que esa marca
+# y suma esas partidas, en vez de volver a analizar todo el historial.
+# El historial más viejo lo completa el backfill (scripts/backfill.py) página a página,
+# guardando su avance dentro del mismo agregado para poder retomarlo.
+# La API y el backfill son procesos distintos: el agregado se lee de la capa compartida y
+# se escribe con compare-and-set sobre "rev", así ninguno pisa lo que sumó el otro.
+TEMPORADA_INICIO = 1735689600000  # ms, inicio de la temporada actual
+COLA_SOLOQ = 420                  # RANKED_SOLO_5x5
+AGREGADO_VERSION = 2
+AGREGADO_TTL = 7776000            # 90 días (se renueva cada vez que se actualiza)
+IDS_POR_PAGINA = 100              # Máximo que permite match-v5
+DUOS_MAX = 300                    # Compañeros que se siguen por jugador (top-k con Space-Saving)
+PRIMERA_PAGINA = 20               # Partidas que suma un request para un jugador nuevo (el resto, el backfill)
+BACKFILL_CONFLICTOS_MAX = 5       # Páginas seguidas que otro proceso puede pisar antes de dejarlo para otra corrida
+
+# Un lock por jugador: dos requests simultáneos no deben sumar la misma partida dos veces.
+# Se borra cuando nadie lo tiene ni lo espera (si no, queda uno por cada PUUID consultado)
+agregado_locks = {}  # puuid -> [Lock, usuarios]
+
+@asynccontextmanager
+async def lock_agregado(puuid):
+    entrada = agregado_locks.setdefault(puuid, [asyncio.Lock(), 0])
+    entrada[1] += 1
+    try:
+        async with entrada[0]:
+            yield
+    finally:
+        entrada[1] -= 1
+        if not entrada[1]:
+            del agregado_locks[puuid]
+
+def numero_partida(mid):
+    """'LA2_1234567' -> 1234567 (los IDs de una plataforma son crecientes)"""
+    return int(mid.rsplit("_", 1)[-1])
+
+def agregado_vacio(plataforma=None, rev=0):
+    return {
+        "v": AGREGADO_VERSION,
+        "temporada": TEMPORADA_INICIO,
+        "plataforma": plataforma,  # Dónde se buscaron las partidas
+        "rev": rev,  # Sube con cada escritura (compare-and-set entre procesos)
+        "ultima_partida": None,
+        "partidas": 0,
+        "kills": 0,
+        "deaths": 0,
+        "assists": 0,
+        "campeones": {},
+        "duos": {},
+        # Avance del backfill: recorre los IDs anteriores a "hasta" (epoch s) con start/count;
+        # "ultima" es la última partida sumada por el backfill (para no repetir entre páginas)
+        "backfill": {"hasta": int(time.time()), "start": 0, "ultima": None, "completo": False},
+    }
+
+def acumular_partida(agg, puuid, partida):
+    """Suma una PartidaCompacta a los totales del jugador"""
+    if partida.creacion < TEMPORADA_INICIO or partida.queue_id != COLA_SOLOQ:
+        return
+    jugador = next((p for p in partida.participantes if p.puuid == puuid), None)
+    if not jugador:
+        return
+
+    agg["partidas"] += 1
+    agg["kills"] += jugador.kills
+    agg["deaths"] += jugador.deaths
+    agg["assists"] += jugador.assists
+
+    # Campeón
+    if jugador.campeon not in agg["campeones"]:
+        agg["campeones"][jugador.campeon] = {"wins": 0, "games": 0, "kills": 0, "deaths": 0, "assists": 0}
+    c = agg["campeones"][jugador.campeon]
+    c["games"] += 1
+    c["kills"] += jugador.kills
+    c["deaths"] += jugador.deaths
+    c["assists"] += jugador.assists
+    if jugador.win: c["wins"] += 1
+
+    # Duo. En una temporada aparecen miles de randoms: se siguen DUOS_MAX con Space-Saving.
+    # Lleno, un compañero nuevo reemplaza al de menos partidas y hereda su cuenta como
+    # "error" (cota de lo que puede sobrar); uno frecuente nunca se pierde ni vuelve a 1
+    duos = agg["duos"]
+    for p in partida.participantes:
+        if p.team_id == jugador.team_id and p.puuid != puuid:
+            duo = duos.get(p.puuid)
+            if duo is None:
+                error = 0
+                if len(duos) >= DUOS_MAX:
+                    error = duos.pop(min(duos, key=lambda k: duos[k]["games"]))["games"]
+                duo = duos[p.puuid] = {"nombre": f"{p.nombre}#{p.tag}", "wins": 0, "games": error, "error": error}
+            duo["games"] += 1
+            if jugador.win: duo["wins"] += 1
+
+def partidas_duo(duo):
+    """Partidas juntos seguras: las contadas desde que entró al top-k (sin el error heredado)"""
+    return duo["games"] - duo.get("error", 0)
+
+def url_ids_partidas(puuid, start, count, start_time=None, end_time=None):
+    url = riot_url(region_partidas(plataforma_de(puuid)), f"/lol/match/v5/matches/by-puuid/{puuid}/ids"
+                   f"?queue={COLA_SOLOQ}&startTime={start_time or TEMPORADA_INICIO // 1000}&start={start}&count={count}")
+    if end_time:
+        url += f"&endTime={end_time}"
+    return url
+
+async def ids_nuevas(client, puuid, ultima_partida, start_time=None):
+    """IDs de SoloQ de la temporada más nuevos que `ultima_partida` (None si falla Riot)"""
+    ids = []
+    start = 0
+    while True:
+        res = await fetch_riot(client, url_ids_partidas(puuid, start, IDS_POR_PAGINA, start_time))
+        if res.status_code != 200:
+            return None
+        pagina = res.json()
+        for mid in pagina:
+            # Vienen de la más nueva a la más vieja: al llegar a la marca ya terminamos
+            if ultima_partida and numero_partida(mid) <= numero_partida(ultima_partida):
+                return ids
+            ids.append(mid)
+        if len(pagina) < IDS_POR_PAGINA:
+            return ids
+        start += IDS_POR_PAGINA
+
+async def traer_partidas(client, ids):
+    """{mid: PartidaCompacta, PARTIDA_FALTANTE o None}, pidiendo cada partida una sola vez"""
+    unicas = list(dict.fromkeys(ids))
+    partidas = dict(zip(unicas, await asyncio.gather(*[get_partida(client, mid) for mid in unicas])))
+    if store:
+        try:
+            await store.guardar_partidas(partidas)
+        except sqlite3.Error as e:
+            log("⚠️ Error guardando partidas en SQLite: {error}", logging.WARNING, error=str(e))
+    return partidas
+
+def sumar_partidas(agg, puuid, ids, partidas):
+    """
+    Suma las partidas `ids` en ese orden. Devuelve cuántas avanzó antes de la primera que
+    falló (429, timeout); las que Riot no tiene (404) se saltean y cuentan como avanzadas
+    para que la marca no quede trabada en ellas.
+    """
+    for i, mid in enumerate(ids):
+        partida = partidas.get(mid)
+        if partida is None:
+            return i
+        if partida is not PARTIDA_FALTANTE:
+            acumular_partida(agg, puuid, partida)
+    return len(ids)
+
+async def planear_backfill(client, agg, puuid, count=IDS_POR_PAGINA):
+    """
+    Pide la siguiente página del historial viejo. La lista se pide con endTime fijo para
+    que las partidas nuevas no corran los offsets. Devuelve (página, pendientes) o None si Riot falló.
+    """
+    bf = agg["backfill"]
+    res = await fetch_riot(client, url_ids_partidas(puuid, bf["start"], count, end_time=bf["hasta"]))
+    if res.status_code != 200:
+        return None
+    pagina = res.json()
+    # Si una partida terminada tarde corrió la lista, la primera de la página ya se sumó
+    pendientes = [mid for mid in pagina if bf["ultima"] is None or numero_partida(mid) < numero_partida(bf["ultima"])]
+    return pagina, pendientes
+
+def aplicar_backfill(agg, puuid, pagina, pendientes, partidas, count=IDS_POR_PAGINA):
+    """Suma una página del backfill y avanza el checkpoint. Devuelve False si faltó alguna partida"""
+    bf = agg["backfill"]
+    if agg["ultima_partida"] is None:
+        # Lo más nuevo antes de "hasta": desde ahí sigue la actualización incremental
+        agg["ultima_partida"] = pagina[0] if pagina else None
+
+    sumadas = sumar_partidas(agg, puuid, pendientes, partidas)
+    if sumadas:
+        bf["ultima"] = pendientes[sumadas - 1]
+    bf["start"] += len(pagina) - len(pendientes) + sumadas
+    if sumadas == len(pendientes) and len(pagina) < count:
+        bf["completo"] = True
+    return sumadas == len(pendientes)
+
+async def paso_backfill(client, agg, puuid, count=IDS_POR_PAGINA):
+    """Suma una página más del historial viejo. Devuelve False si Riot falló"""
+    plan = await planear_backfill(client, agg, puuid, count)
+    if plan is None:
+        return False
+    pagina, pendientes = plan
+    partidas = await traer_partidas(client, pendientes)
+    return aplicar_backfill(agg, puuid, pagina, pendientes, partidas, count)
+
+def agregado_vigente(agg):
+    return bool(agg) and agg.get("v") == AGREGADO_VERSION and agg.get("temporada") == TEMPORADA_INICIO
+
+async def get_agregado(puuid):
+    try:
+        agg = await get_cache_compartido(f"agregado:{puuid}")
+    except CacheNoDisponible:
+        # Se sirve la copia local; guardar_agregado tampoco va a poder escribir encima
+        agg = await get_cache(f"agregado:{puuid}")
+    return agg if agregado_vigente(agg) else None
+
+def rev_guardada(valor):
+    """rev del agregado guardado (0 si no hay uno de esta versión y temporada)"""
+    return valor.get("rev", 0) if agregado_vigente(valor) else 0
+
+async def guardar_agregado(puuid, agg):
+    """
+    Guarda el agregado solo si nadie lo cambió desde que se leyó (mismo "rev").
+    Devuelve False si otro proceso lo escribió antes: hay que releerlo. Si la capa
+    compartida falla lanza CacheNoDisponible (reintentar no sirve de nada).
+    """
+    key = f"agregado:{puuid}"
+    leida = agg.get("rev", 0)
+    nuevo = {**agg, "rev": leida + 1}
+    if redis_client:
+        try:
+            async with redis_client.pipeline(transaction=True) as pipe:
+                await pipe.watch(key)
+                actual = await pipe.get(key)
+                if rev_guardada(deserializar_cache(actual) if actual else None) != leida:
+                    await pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.set(key, serializar_cache(nuevo), ex=AGREGADO_TTL)
+                await pipe.execute()  # WatchError si alguien escribió entre el GET y el SET
+        except RedisWatchError:
+            return False
+        except Exception as e:
+            CACHE_STATS["redis"]["errors"] += 1
+            raise CacheNoDisponible(str(e)) from e
+    else:
+        # Sin Redis la capa compartida es el disco (entre workers de la misma máquina)
+        capa = cache_disco or cache_memoria
+        try:
+            actual = capa.get(key, time.time())
+            if rev_guardada(actual[1] if actual else None) != leida:
+                return False
+            capa.set(key, nuevo, time.time() + AGREGADO_TTL)
+        except Exception as e:
+            CACHE_STATS["disco"]["errors"] += 1
+            raise CacheNoDisponible(str(e)) from e
+    agg["rev"] = leida + 1
+    return True
+
+async def actualizar_agregados(client, puuids):
+    """
+    Trae al día los agregados de varios jugadores en una sola pasada: junta los IDs
+    nuevos de todos, pide cada partida una sola vez (los duos comparten partidas) y
+    después la suma a cada jugador. Devuelve {puuid: agregado o None si no hubo datos}.
+    """
+    puuids = list(dict.fromkeys(puuids))
+    async with AsyncExitStack() as stack:
+        # Siempre en el mismo orden para que dos requests no se bloqueen entre sí
+        for puuid in sorted(puuids):
+            await stack.enter_async_context(lock_agregado(puuid))
+
+        # 1. Qué partidas le faltan a cada jugador
+        async def planear(puuid):
+            plataforma = plataforma_de(puuid)
+            agg = await get_agregado(puuid)
+            if agg is not None and plataformas.verificada(puuid) and agg.get("plataforma") != plataforma \
+                    and (agg.get("plataforma") is not None or agg["partidas"] == 0):
+                # Se armó buscando en otra plataforma (una ?plataforma= equivocada): se rehace.
+                # El rev se conserva para que el compare-and-set pueda reemplazarlo
+                log("🔁 Agregado de {jugador}… armado en otra plataforma, se rehace", jugador=puuid[:8])
+                agg = agregado_vacio(plataforma, rev=agg.get("rev", 0))
+                return agg, await planear_backfill(client, agg, puuid, PRIMERA_PAGINA), True
+            if agg is None:
+                # Jugador nuevo: solo la primera página corta; el resto lo suma el backfill
+                agg = agregado_vacio(plataforma)
+                return agg, await planear_backfill(client, agg, puuid, PRIMERA_PAGINA), True
+            estado = estados.get(puuid)
+            if estado and "ultima_partida" in estado and estado["ultima_partida"] == agg["ultima_partida"]:
+                # El refresco del ranking ya revisó su última partida y es la que tenemos sumada
+                return agg, [], False
+            # Sin partidas previas en la temporada, lo nuevo es lo posterior al inicio del backfill
+            start_time = None if agg["ultima_partida"] else agg["backfill"]["hasta"]
+            nuevas = await ids_nuevas(client, puuid, agg["ultima_partida"], start_time)
+            if nuevas:
+                # Se suman de la más vieja a la más nueva
+                nuevas.sort(key=numero_partida)
+            return agg, nuevas, False
+
+        planes = await asyncio.gather(*[planear(p) for p in puuids])
+
+        # 2. Cada partida una sola vez
+        ids = []
+        for agg, plan, es_nuevo in planes:
+            if plan:
+                ids.extend(plan[1] if es_nuevo else plan)
+        partidas = await traer_partidas(client, ids)
+
+        async def guardar(puuid, agg):
+            try:
+                return await guardar_agregado(puuid, agg)
+            except CacheNoDisponible as e:
+                # Se sirve lo sumado sin guardarlo; el próximo request vuelve a sumar esas partidas
+                log("⚠️ No se pudo guardar el agregado de {jugador}…: {error}", logging.WARNING,
+                    jugador=puuid[:8], error=str(e))
+                return True
+
+        # 3. Sumar a cada jugador
+        resultados = {}
+        for puuid, (agg, plan, es_nuevo) in zip(puuids, planes):
+            guardado = True
+            if es_nuevo:
+                if plan is None:
+                    resultados[puuid] = None
+                    continue
+                aplicar_backfill(agg, puuid, plan[0], plan[1], partidas, PRIMERA_PAGINA)
+                if agg["partidas"] == 0 and not agg["backfill"]["completo"]:
+                    resultados[puuid] = None  # No se pudo sumar nada todavía
+                    continue
+                if not plan[0] and not plataformas.verificada(puuid):
+                    # Ninguna partida en una plataforma sin confirmar: puede ser el cluster
+                    # equivocado, así que no se guarda como temporada completa y vacía
+                    agg["backfill"]["completo"] = False
+                    resultados[puuid] = agg
+                    continue
+                guardado = await guardar(puuid, agg)
+            elif plan:
+                # Si una partida falla paramos ahí para que la marca no se salte partidas
+                sumadas = sumar_partidas(agg, puuid, plan, partidas)
+                if sumadas:
+                    agg["ultima_partida"] = plan[sumadas - 1]
+                    guardado = await guardar(puuid, agg)
+            if not guardado:
+                # El backfill (u otra instancia) lo escribió mientras sumábamos: vale el suyo,
+                # y las partidas nuevas se suman en el próximo request
+                agg = await get_agregado(puuid) or agg
+            # plan None (Riot falló) o vacío: servimos lo que ya teníamos
+            resultados[puuid] = agg
+        return resultados
+
+async def actualizar_agregado(client, puuid):
+    """Trae el agregado del jugador al día sumando solo las partidas nuevas"""
+    return (await actualizar_agregados(client, [puuid]))[puuid]
+
+async def backfill_jugador(client, puuid):
+    """Completa el historial de la temporada de un jugador, guardando el avance en cada página"""
+    conflictos = 0
+    while True:
+        async with lock_agregado(puuid):
+            # Se relee en cada página (de la capa compartida): la API pudo sumar partidas nuevas
+            agg = await get_agregado(puuid) or agregado_vacio(plataforma_de(puuid))
+            if agg["backfill"]["completo"]:
+                return agg
+            ok = await paso_backfill(client, agg, puuid)
+            try:
+                guardado = await guardar_agregado(puuid, agg)
+            except CacheNoDisponible as e:
+                # Sin dónde guardar el avance cada página se perdería: se retoma en la próxima
+                # corrida desde el último checkpoint guardado
+                log("⚠️ Backfill {jugador}… detenido, no se pudo guardar: {error}", logging.WARNING,
+                    jugador=puuid[:8], error=str(e))
+                return await get_agregado(puuid) or agregado_vacio(plataforma_de(puuid))
+            if not guardado:
+                conflictos += 1
+                if conflictos > BACKFILL_CONFLICTOS_MAX:
+                    log("⚠️ Backfill {jugador}… detenido: el agregado cambió {veces} veces seguidas",
+                        logging.WARNING, jugador=puuid[:8], veces=conflictos)
+                    return await get_agregado(puuid) or agg
+                # Otro proceso lo escribió durante la página: se rehace sobre su versión
+                # (las partidas ya están en caché, repetirla no vuelve a pedirlas a Riot)
+                log_debug("🔁 Agregado de {jugador}… cambió durante el backfill, reintentando", jugador=puuid[:8])
+                continue
+            conflictos = 0
+        log("📥 Backfill {jugador}…: {revisadas} partidas revisadas", jugador=puuid[:8], revisadas=agg['backfill']['start'])
+        if not ok:
+            # Riot falló o limitó: se retoma en la próxima corrida desde el checkpoint
+            return agg
+
+async def ejecutar_backfill(amigos=None, fraccion=None):
+    """Backfill de todos los jugadores. Pensado para correr fuera de los requests"""
+    if fraccion is not None:
+        riot_limiter.fraccion = fraccion
+    client = get_http_client()
+    try:
+        if amigos is None:
+            await cargar_rosters()
+            amigos = miembros_unicos()
+        puuids = await asyncio.gather(*[
+            get_puuid(client, a['nombre'], a['tag'], a.get('plataforma', PLATAFORMA_DEFECTO)) for a in amigos
+        ])
+        resultados = await asyncio.gather(*[backfill_jugador(client, p) for p in puuids if p])
+        completos = sum(1 for agg in resultados if agg["backfill"]["completo"])
+        log("✅ Backfill: {completos}/{total} jugadores con la temporada completa", completos=completos, total=len(resultados))
+        return resultados
+    finally:
+        await cerrar_http_client()
+
+def calcular_kda(kills, deaths, assists):
+    return round((kills + assists) / deaths, 2) if deaths > 0 else round(kills + assists, 2)
+
+async def resumen_jugador(puuid, agg):
+    """
+    Respuesta de /api/jugador. Si el store SQLite tiene todas las partidas que suma el
+    agregado se calcula con SQL (los duos no se recortan); si no (ej: /tmp recién
+    creado en un cold start), con el agregado.
+    """
+    if store:
+        try:
+            totales, campeon, duo = await store.resumen_jugador(puuid, TEMPORADA_INICIO)
+        except sqlite3.Error as e:
+            log("⚠️ Error consultando SQLite: {error}", logging.WARNING, error=str(e))
+        else:
+            if totales["games"] == agg["partidas"]:
+                return resumen_sql(agg, totales, campeon, duo)
+    return resumen_agregado(agg)
+
+def resumen_sql(agg, totales, campeon, duo):
+    top_champ = None
+    if campeon:
+        top_champ = {
+            "nombre": campeon["champion_name"],
+            "partidas": campeon["games"],
+            "winrate": round((campeon["wins"] / campeon["games"]) * 100, 1),
+            "kda": calcular_kda(campeon["kills"], campeon["deaths"], campeon["assists"])
+        }
+
+    # Solo mostrar si han jugado más de 1 partida juntos para filtrar randoms
+    top_duo = None
+    if duo and duo["games"] > 1:
+        top_duo = {
+            "nombre": f"{duo['riot_name']}#{duo['riot_tag']}",
+            "partidas": duo["games"],
+            "winrate": round((duo["wins"] / duo["games"]) * 100, 1)
+        }
+
+    return {
+        "campeon": top_champ,
+        "duo": top_duo,
+        "kda_general": calcular_kda(totales["kills"] or 0, totales["deaths"] or 0, totales["assists"] or 0),
+        "partidas_temporada": totales["games"],
+        "historial_completo": agg["backfill"]["completo"]
+    }
+
+def resumen_agregado(agg):
+    """Agregado -> respuesta de /api/jugador (top campeón, top duo, KDA)"""
+    campeones = agg["campeones"]
+    duos = agg["duos"]
+
+    # Top Campeón
+    top_champ = None
+    if campeones:
+        top_champ_name = max(campeones, key=lambda x: campeones[x]["games"])
+        stats = campeones[top_champ_name]
+        wr = round((stats["wins"] / stats["games"]) * 100, 1)
+        top_champ = {
+            "nombre": top_champ_name,
+            "partidas": stats["games"],
+            "winrate": wr,
+            "kda": calcular_kda(stats["kills"], stats["deaths"], stats["assists"])
+        }
+
+    # Top Duo
+    top_duo = None
+    if duos:
+        top_duo_puuid = max(duos, key=lambda x: partidas_duo(duos[x]))
+        stats = duos[top_duo_puuid]
+        games = partidas_duo(stats)
+        # Solo mostrar si han jugado más de 1 partida juntos para filtrar randoms
+        if games > 1:
+            wr = round((stats["wins"] / games) * 100, 1)
+            top_duo = {
+                "nombre": stats["nombre"],
+                "partidas": games,
+                "winrate": wr
             }
-        
+
+    return {
+        "campeon": top_champ,
+        "duo": top_duo,
+        "kda_general": calcular_kda(agg["kills"], agg["deaths"], agg["assists"]),
+        "partidas_temporada": agg["partidas"],
+        "historial_completo": agg["backfill"]["completo"]
+    }
+
+@app.get("/api/jugador/{nombre}/{tag}")
+async def get_jugador_detalle(nombre: str, tag: str, request: Request, plataforma: str = PLATAFORMA_DEFECTO):
+    """Obtiene detalles de un jugador: campeón más jugado y duo más frecuente"""
+    try:
+        client = get_http_client()
+        # 1. Obtener PUUID (con caché)
+        puuid = await get_puuid(client, nombre, tag, plataforma)
+        if not puuid:
+            return {"error": "Jugador no encontrado"}
+
+        # 2. Sumar al agregado de la temporada solo las partidas nuevas
+        agg = await actualizar_agregado(client, puuid)
+        if agg is None:
+            return {"error": "No se pudo obtener historial"}
+
+        return RespuestaSerializada(await resumen_jugador(puuid, agg)).responder(request)
+
+    except Exception as e:
+        log("❌ Error obteniendo detalles de {nombre}#{tag}: {error}", logging.ERROR, exc_info=True,
+            nombre=nombre, tag=tag, error=str(e))
+        return {"error": str(e)}
+
+@app.get("/api/jugadores")
+async def get_jugadores_detalle(request: Request, response: Response, jugador: list[str] | None = Query(None),
+                                roster: str = ROSTER_DEFECTO, plataforma: str = PLATAFORMA_DEFECTO,
+                                offset: int = Query(0, ge=0),
+                                limit: int = Query(ROSTER_JUGADORES_MAX, ge=1, le=ROSTER_JUGADORES_MAX)):
+    """
+    Detalle de varios jugadores en una pasada (?jugador=Nombre%23TAG, repetible, hasta
+    ROSTER_JUGADORES_MAX). Sin parámetros devuelve los del roster de a `limit` desde
+    `offset` (el total va en X-Total-Count). Las partidas compartidas se piden una vez.
+    """
+    try:
+        headers = {}
+        if jugador:
+            if error := error_jugadores(jugador, response):
+                return error
+            amigos = [{**j, "plataforma": plataforma} for j in parse_riot_ids(jugador)]
+        else:
+            await cargar_rosters()
+            amigos = miembros_unicos(roster)
+            headers["X-Total-Count"] = str(len(amigos))
+            amigos = amigos[offset:offset + limit]
+
+        client = get_http_client()
+        puuids = await asyncio.gather(*[get_puuid(client, a['nombre'], a['tag'], a['plataforma']) for a in amigos])
+        aggs = await actualizar_agregados(client, [p for p in puuids if p])
+
+        resultado = []
+        for amigo, puuid in zip(amigos, puuids):
+            datos = {"nombre": amigo['nombre'], "tag": amigo['tag']}
+            if not puuid:
+                datos["error"] = "Jugador no encontrado"
+            elif aggs.get(puuid) is None:
+                datos["error"] = "No se pudo obtener historial"
+            else:
+                datos.update(await resumen_jugador(puuid, aggs[puuid]))
+            resultado.append(datos)
+        return RespuestaSerializada(resultado).responder(request, headers)
+
     except Exception as e:
-        print(f"❌ Error obteniendo detalles de {nombre}#{tag}: {e}")
-        import traceback
-        traceback.print_exc()
-        return {"error": str(e)}
\ No newline at end of file
+        log("❌ Error obteniendo detalles de jugadores: {error}", logging.ERROR, exc_info=True, error=str(e))
+        return {"error": str(e)}
+
+# --- ANALÍTICA (columnar con NumPy) ---
+# Un proceso aparte de los requests carga las participaciones de SoloQ del store en arrays
+# (una columna por campo) y calcula todo en pasadas vectorizadas: winrate por campeón y
+# por rol, KDA por semana, sinergia de duos y cara a cara entre los jugadores de los
+# rosters. Se recalcula cada ANALITICA_PERIODO segundos si entraron partidas o cambiaron
+# los rosters, y queda materializado por roster y jugador ya serializado: los endpoints
+# solo buscan en un dict.
+ANALITICA_PERIODO = int(os.environ.get("ANALITICA_PERIODO", "600"))
+SEMANA_MS = 7 * 86400 * 1000
+ANALITICA_PARES_MIN = 2  # Partidas para que un duo o un cara a cara cuente (filtra casualidades)
+
+analitica = {"firma": None, "generada": 0.0, "rosters": {}}
+analitica_lock = asyncio.Lock()
+
+def porcentaje(parte, total):
+    return round(float(parte) / float(total) * 100, 1) if total else 0.0
+
+def sumas_por_clave(clave, n, *columnas):
+    """[cantidad, suma de cada columna] agrupando por `clave` (enteros en [0, n))"""
+    return [np.bincount(clave, minlength=n)] + [np.bincount(clave, weights=c, minlength=n) for c in columnas]
+
+def filas_de_grupos(nombres, partidas, wins, kills, deaths, assists):
+    """Una fila por grupo con partidas, de más a menos jugado"""
+    filas = [
+        {
+            "nombre": str(nombres[i]), "partidas": int(partidas[i]), "winrate": porcentaje(wins[i], partidas[i]),
+            "kda": calcular_kda(int(kills[i]), int(deaths[i]), int(assists[i])),
+        }
+        for i in np.flatnonzero(partidas)
+    ]
+    filas.sort(key=lambda f: -f["partidas"])
+    return filas
+
+def pares_en_partidas(partida, jugador, equipo, win):
+    """
+    Pares (a, b) de jugadores seguidos en una misma partida. Con las filas ordenadas por
+    partida los compañeros de una fila están a menos de 10 posiciones: se comparan
+    las columnas consigo mismas corridas 1..9 en vez de hacer un join.
+    Devuelve (a, b, mismo_equipo, gana_a) con a < b.
+    """
+    a, b, mismo, gana = [], [], [], []
+    for d in range(1, 10):
+        if d >= len(partida):
+            break
+        misma = partida[:-d] == partida[d:]
+        x, y = jugador[:-d][misma], jugador[d:][misma]
+        a.append(np.minimum(x, y))
+        b.append(np.maximum(x, y))
+        mismo.append(equipo[:-d][misma] == equipo[d:][misma])
+        # El win de la fila de `a`: si a era la fila de más adelante, es el de la otra
+        gana.append(np.where(x < y, win[:-d][misma], win[d:][misma]))
+    if not a:
+        vacio = np.zeros(0, dtype=np.int64)
+        return vacio, vacio, vacio.astype(bool), vacio.astype(bool)
+    return np.concatenate(a), np.concatenate(b), np.concatenate(mismo), np.concatenate(gana)
+
+def calcular_analitica(filas, seguidos):
+    """
+    filas: tuplas de store.participaciones; seguidos: lista de puuids de los rosters.
+    Devuelve ({puuid: stats del jugador}, [(a, b, stats del par)]).
+    """
+    if not filas or not seguidos:
+        return {}, []
+    mids, puuids, equipos, campeones, roles, kills, deaths, assists, wins, creacion = zip(*filas)
+
+    # Solo interesan las filas de jugadores seguidos (los randoms no tienen stats propias)
+    seguidos = np.array(sorted(seguidos))
+    puuids = np.array(puuids)
+    fila_seguida = np.isin(puuids, seguidos)
+    jugador = np.searchsorted(seguidos, puuids[fila_seguida])
+    partida = np.unique(np.array(mids)[fila_seguida], return_inverse=True)[1]
+    nombres_campeon, campeon = np.unique(np.array(campeones)[fila_seguida], return_inverse=True)
+    nombres_rol, rol = np.unique(np.array(roles)[fila_seguida], return_inverse=True)
+    equipo = np.array(equipos, dtype=np.int64)[fila_seguida]
+    k = np.array(kills, dtype=np.int64)[fila_seguida]
+    d = np.array(deaths, dtype=np.int64)[fila_seguida]
+    a = np.array(assists, dtype=np.int64)[fila_seguida]
+    win = np.array(wins, dtype=bool)[fila_seguida]
+    # Semanas desde el inicio de la temporada (el store solo devuelve partidas posteriores)
+    semana = (np.array(creacion, dtype=np.int64)[fila_seguida] - TEMPORADA_INICIO) // SEMANA_MS
+    n, nc, nr, ns = len(seguidos), len(nombres_campeon), len(nombres_rol), int(semana.max(initial=-1)) + 1
+
+    # Una pasada de bincount por cada agrupación (jugador, jugador×campeón, jugador×rol, jugador×semana)
+    total = sumas_por_clave(jugador, n, win, k, d, a)
+    por_campeon = [c.reshape(n, nc) for c in sumas_por_clave(jugador * nc + campeon, n * nc, win, k, d, a)]
+    por_rol = [c.reshape(n, nr) for c in sumas_por_clave(jugador * nr + rol, n * nr, win, k, d, a)]
+    por_semana = [c.reshape(n, ns) for c in sumas_por_clave(jugador * ns + semana, n * ns, win, k, d, a)]
+    semanas = [time.strftime("%Y-%m-%d", time.gmtime((TEMPORADA_INICIO + i * SEMANA_MS) / 1000)) for i in range(ns)]
+    con_rol = nombres_rol != ""  # Partidas guardadas antes de registrar el rol
+
+    jugadores = {}
+    for i in np.flatnonzero(total[0]):
+        tendencia = [
+            {"semana": semanas[s], "partidas": int(por_semana[0][i, s]),
+             "winrate": porcentaje(por_semana[1][i, s], por_semana[0][i, s]),
+             "kda": calcular_kda(int(por_semana[2][i, s]), int(por_semana[3][i, s]), int(por_semana[4][i, s]))}
+            for s in np.flatnonzero(por_semana[0][i])
+        ]
+        jugadores[str(seguidos[i])] = {
+            "partidas": int(total[0][i]),
+            "winrate": porcentaje(total[1][i], total[0][i]),
+            "kda": calcular_kda(int(total[2][i]), int(total[3][i]), int(total[4][i])),
+            "campeones": filas_de_grupos(nombres_campeon, *(c[i] for c in por_campeon)),
+            "roles": filas_de_grupos(nombres_rol[con_rol], *(c[i][con_rol] for c in por_rol)),
+            "tendencia": tendencia,
+        }
+
+    # Pares: juntos (mismo equipo) y enfrentados, agrupados por clave a*n+b
+    orden = np.argsort(partida, kind="stable")
+    pa, pb, mismo, gana = pares_en_partidas(partida[orden], jugador[orden], equipo[orden], win[orden])
+    claves, inversa = np.unique(pa * n + pb, return_inverse=True)
+    juntos = np.bincount(inversa, weights=mismo, minlength=len(claves))
+    juntos_wins = np.bincount(inversa, weights=mismo & gana, minlength=len(claves))
+    contra = np.bincount(inversa, weights=~mismo, minlength=len(claves))
+    contra_wins = np.bincount(inversa, weights=~mismo & gana, minlength=len(claves))
+
+    winrate = np.divide(total[1], total[0], out=np.zeros(n), where=total[0] > 0) * 100
+    pares = []
+    for j in np.flatnonzero((juntos >= ANALITICA_PARES_MIN) | (contra >= ANALITICA_PARES_MIN)):
+        ia, ib = divmod(int(claves[j]), n)
+        par = {}
+        if juntos[j] >= ANALITICA_PARES_MIN:
+            wr = porcentaje(juntos_wins[j], juntos[j])
+            # Sinergia: cuánto mejor les va juntos que el promedio de sus winrates
+            par["duo"] = {"partidas": int(juntos[j]), "winrate": wr,
+                          "sinergia": round(wr - float(winrate[ia] + winrate[ib]) / 2, 1)}
+        if contra[j] >= ANALITICA_PARES_MIN:
+            par["contra"] = {"partidas": int(contra[j]), "wins": int(contra_wins[j]),
+                             "losses": int(contra[j] - contra_wins[j])}
+        pares.append((str(seguidos[ia]), str(seguidos[ib]), par))
+    return jugadores, pares
+
+def materializar_analitica(jugadores, pares, miembros):
+    """
+    Vistas ya serializadas por roster: {roster: {"resumen": RespuestaSerializada,
+    "jugadores": {puuid: RespuestaSerializada}}}. miembros: {roster: {puuid: "Nombre#TAG"}}
+    """
+    generada = int(time.time())
+    vistas = {}
+    for roster, nombres in miembros.items():
+        duos, caras = [], []
+        por_jugador = {puuid: {"duos": [], "cara_a_cara": []} for puuid in nombres}
+        for a, b, par in pares:
+            if a not in nombres or b not in nombres:
+                continue
+            if "duo" in par:
+                duos.append({"jugadores": [nombres[a], nombres[b]], **par["duo"]})
+                por_jugador[a]["duos"].append({"nombre": nombres[b], **par["duo"]})
+                por_jugador[b]["duos"].append({"nombre": nombres[a], **par["duo"]})
+            if "contra" in par:
+                c = par["contra"]
+                caras.append({"jugadores": [nombres[a], nombres[b]], **c})
+                por_jugador[a]["cara_a_cara"].append({"nombre": nombres[b], **c})
+                por_jugador[b]["cara_a_cara"].append(
+                    {"nombre": nombres[a], "partidas": c["partidas"], "wins": c["losses"], "losses": c["wins"]})
+        duos.sort(key=lambda x: -x["sinergia"])
+        caras.sort(key=lambda x: -x["partidas"])
+
+        vistas[roster] = {
+            "resumen": RespuestaSerializada({
+                "generada": generada,
+                "jugadores": [
+                    {"nombre": nombre, **{k: v for k, v in jugadores[puuid].items() if k in ("partidas", "winrate", "kda")},
+                     "campeon": (jugadores[puuid]["campeones"] or [None])[0],
+                     "rol": (jugadores[puuid]["roles"] or [None])[0]}
+                    for puuid, nombre in nombres.items() if puuid in jugadores
+                ],
+                "duos": duos,
+                "cara_a_cara": caras,
+            }),
+            "jugadores": {},
+        }
+        for puuid, nombre in nombres.items():
+            if puuid not in jugadores:
+                continue
+            extra = por_jugador[puuid]
+            extra["duos"].sort(key=lambda x: -x["sinergia"])
+            extra["cara_a_cara"].sort(key=lambda x: -x["partidas"])
+            vistas[roster]["jugadores"][puuid] = RespuestaSerializada(
+                {"nombre": nombre, "generada": generada, **jugadores[puuid], **extra})
+    return vistas
+
+def construir_analitica(filas, miembros):
+    """Cálculo + materialización. Corre en un thread: no toca el estado global"""
+    seguidos = sorted({puuid for nombres in miembros.values() for puuid in nombres})
+    jugadores, pares = calcular_analitica(filas, seguidos)
+    return materializar_analitica(jugadores, pares, miembros)
+
+async def refrescar_analitica(forzar=False):
+    """Recalcula la analítica si pasó ANALITICA_PERIODO y entraron partidas o cambiaron los rosters"""
+    if np is None or store is None:
+        return False
+    if not forzar and time.time() - analitica["generada"] < ANALITICA_PERIODO:
+        return False
+    async with analitica_lock:
+        if forzar and analitica["firma"] is not None and time.time() - analitica["generada"] < REFRESCO_TICK:
+            return False  # Otro request la acaba de calcular mientras esperábamos el lock
+        miembros = {
+            roster.nombre: {m["puuid"]: f"{m['nombre']}#{m['tag']}" for m in roster.miembros.values() if m.get("puuid")}
+            for roster in rosters.values()
+        }
+        firma = (await store.ultima_participacion(),
+                 tuple(sorted((r, p, n) for r, nombres in miembros.items() for p, n in nombres.items())))
+        analitica["generada"] = time.time()
+        if firma == analitica["firma"]:
+            return False
+
+        inicio = time.perf_counter()
+        filas = await store.participaciones(TEMPORADA_INICIO)
+        analitica["rosters"] = await asyncio.to_thread(construir_analitica, filas, miembros)
+        analitica["firma"] = firma
+        log("📊 Analítica: {filas} participaciones en {duracion}s", filas=len(filas),
+            duracion=round(time.perf_counter() - inicio, 2))
+        return True
+
+async def vista_analitica(roster, response):
+    """La vista materializada del roster, o {"error"} con el status ya puesto"""
+    if np is None or store is None:
+        response.status_code = 503
+        return {"error": "Analítica no disponible (requiere numpy y el store SQLite)"}
+    await cargar_rosters()
+    if roster not in rosters:
+        response.status_code = 404
+        return {"error": "Roster no encontrado"}
+    if analitica["firma"] is None:
+        # Cold start: se calcula en el request en vez de esperar al próximo tick
+        await refrescar_analitica(forzar=True)
+    vista = analitica["rosters"].get(roster)
+    if vista is None:
+        # Roster creado después del último cálculo: aparece en el próximo
+        response.status_code = 404
+        return {"error": "Analítica del roster todavía no calculada"}
+    return vista
+
+@app.get("/api/analitica")
+async def get_analitica(request: Request, response: Response, roster: str = ROSTER_DEFECTO):
+    """Winrate/KDA por jugador con su campeón y rol principal, sinergia de duos y cara a cara del roster"""
+    try:
+        vista = await vista_analitica(roster, response)
+        if "error" in vista:
+            return vista
+        return vista["resumen"].responder(request)
+
+    except Exception as e:
+        log("❌ Error en /api/analitica: {error}", logging.ERROR, exc_info=True, error=str(e))
+        return {"error": str(e)}
+
+@app.get("/api/analitica/{nombre}/{tag}")
+async def get_analitica_jugador(nombre: str, tag: str, request: Request, response: Response,
+                                roster: str = ROSTER_DEFECTO):
+    """Campeones, roles, KDA por semana, duos y cara a cara de un jugador del roster"""
+    try:
+        vista = await vista_analitica(roster, response)
+        if "error" in vista:
+            return vista
+        miembro = rosters[roster].miembros.get(clave_riot_id(nombre, tag))
+        serializada = vista["jugadores"].get(miembro["puuid"]) if miembro and miembro.get("puuid") else None
+        if serializada is None:
+            response.status_code = 404
+            return {"error": "Jugador sin partidas en el store"}
+        return serializada.responder(request)
+
+    except Exception as e:
+        log("❌ Error en /api/analitica: {error}", logging.ERROR, exc_info=True, error=str(e))
+        return {"error": str(e)}
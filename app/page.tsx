@@ -6,6 +6,7 @@ import React from 'react';
 interface Jugador {
   nombre: string;
   tag: string;
+  plataforma?: string;
   rank: string;
   lp: number;
   winrate: number;
@@ -14,6 +15,9 @@ interface Jugador {
   losses: number;
   en_partida: boolean;
   puntos_totales?: number;
+  posicion?: number;
+  delta_lp?: number | null;
+  delta_posicion?: number | null;
 }
 
 interface JugadorDetalle {
@@ -30,8 +34,21 @@ interface JugadorDetalle {
   } | null;
   kda_general: number;
   partidas_temporada: number;
+  historial_completo?: boolean;
 }
 
+interface JugadorDetalleBulk extends Partial<JugadorDetalle> {
+  nombre: string;
+  tag: string;
+  error?: string;
+}
+
+// Plataforma de Riot -> región en las URLs de op.gg
+const OPGG_REGION: { [plataforma: string]: string } = {
+  na1: 'na', br1: 'br', la1: 'lan', la2: 'las', euw1: 'euw', eun1: 'eune', tr1: 'tr', ru: 'ru',
+  me1: 'me', kr: 'kr', jp1: 'jp', oc1: 'oce', ph2: 'ph', sg2: 'sg', th2: 'th', tw2: 'tw', vn2: 'vn',
+};
+
 export default function Home() {
   const [jugadores, setJugadores] = useState<Jugador[]>([]);
   const [loading, setLoading] = useState(true);
@@ -64,6 +81,20 @@ export default function Home() {
       .then((data) => {
         if (Array.isArray(data)) {
           setJugadores(data);
+          // Detalles de todos en una sola llamada (las partidas compartidas se piden una vez)
+          fetch('/api/jugadores', { signal: controller.signal })
+            .then((res) => (res.ok ? res.json() : []))
+            .then((lista: JugadorDetalleBulk[]) => {
+              if (!Array.isArray(lista)) return;
+              const mapa: { [key: string]: JugadorDetalle } = {};
+              for (const d of lista) {
+                if (!d.error) mapa[`${d.nombre}#${d.tag}`] = d as JugadorDetalle;
+              }
+              setDetalles(prev => ({ ...mapa, ...prev }));
+            })
+            .catch((err) => {
+              if (err.name !== 'AbortError') console.error("Error cargando detalles:", err);
+            });
         } else {
           console.error("Data no es un array:", data);
           setJugadores([]);
@@ -80,11 +111,57 @@ export default function Home() {
         }
       });
 
-    // Cleanup: cancelar request si el componente se desmonta
-    return () => controller.abort();
+    // Cambios en vivo por SSE (el servidor manda solo las filas que cambiaron). Si el
+    // navegador no lo soporta o el stream se cierra, se vuelve a pedir cada 60 segundos
+    let intervalo: ReturnType<typeof setInterval> | null = null;
+    const sondear = () => {
+      if (intervalo) return;
+      intervalo = setInterval(() => {
+        fetch('/api/ranking', { signal: controller.signal })
+          .then((res) => (res.ok ? res.json() : null))
+          .then((data) => {
+            if (Array.isArray(data)) setJugadores(data);
+          })
+          .catch((err) => {
+            if (err.name !== 'AbortError') console.error("Error actualizando ranking:", err);
+          });
+      }, 60000);
+    };
+
+    let stream: EventSource | null = null;
+    if (typeof EventSource !== 'undefined') {
+      stream = new EventSource('/api/ranking/stream');
+      stream.addEventListener('ranking', (e) => {
+        const data = JSON.parse((e as MessageEvent).data);
+        if (Array.isArray(data) && data.length > 0) setJugadores(data);
+      });
+      stream.addEventListener('cambios', (e) => {
+        const { filas, quitados }: { filas: Jugador[]; quitados: { nombre: string; tag: string }[] } =
+          JSON.parse((e as MessageEvent).data);
+        setJugadores(prev => {
+          const mapa = new Map(prev.map(j => [`${j.nombre}#${j.tag}`, j]));
+          for (const q of quitados) mapa.delete(`${q.nombre}#${q.tag}`);
+          for (const f of filas) mapa.set(`${f.nombre}#${f.tag}`, f);
+          return Array.from(mapa.values());
+        });
+      });
+      stream.onerror = () => {
+        // EventSource reintenta solo; si se cerró del todo pasamos a sondear
+        if (stream?.readyState === EventSource.CLOSED) sondear();
+      };
+    } else {
+      sondear();
+    }
+
+    // Cleanup: cancelar requests y cerrar el stream si el componente se desmonta
+    return () => {
+      controller.abort();
+      stream?.close();
+      if (intervalo) clearInterval(intervalo);
+    };
   }, []);
 
-  const handleExpandir = async (nombre: string, tag: string) => {
+  const handleExpandir = async (nombre: string, tag: string, plataforma = 'la2') => {
     const key = `${nombre}#${tag}`;
     
     // Si ya está expandido, colapsar
@@ -104,7 +181,7 @@ export default function Home() {
     // Cargar detalles
     setLoadingDetalle(key);
     try {
-      const res = await fetch(`/api/jugador/${encodeURIComponent(nombre)}/${encodeURIComponent(tag)}`);
+      const res = await fetch(`/api/jugador/${encodeURIComponent(nombre)}/${encodeURIComponent(tag)}?plataforma=${plataforma}`);
       
       if (!res.ok) {
         console.error(`Error HTTP: ${res.status}`);
@@ -242,12 +319,19 @@ export default function Home() {
                     <React.Fragment key={key}>
                       <tr 
                         className="hover:bg-slate-800 transition-colors duration-200 cursor-pointer"
-                        onClick={() => handleExpandir(j.nombre, j.tag)}
+                        onClick={() => handleExpandir(j.nombre, j.tag, j.plataforma)}
                       >
-                    <td className="p-4 font-bold text-slate-500">{index + 1}</td>
+                    <td className="p-4 font-bold text-slate-500">
+                      {index + 1}
+                      {!!j.delta_posicion && (
+                        <span className={`ml-1 text-xs ${j.delta_posicion > 0 ? 'text-green-400' : 'text-red-400'}`}>
+                          {j.delta_posicion > 0 ? '▲' : '▼'}{Math.abs(j.delta_posicion)}
+                        </span>
+                      )}
+                    </td>
                     <td className="p-4 font-medium text-white">
                       <a 
-                        href={`https://www.op.gg/summoners/las/${encodeURIComponent(j.nombre)}-${encodeURIComponent(j.tag)}`}
+                        href={`https://www.op.gg/summoners/${OPGG_REGION[j.plataforma ?? 'la2'] ?? 'las'}/${encodeURIComponent(j.nombre)}-${encodeURIComponent(j.tag)}`}
                         target="_blank"
                         rel="noopener noreferrer"
                         className="hover:text-blue-400 transition-colors"
@@ -275,7 +359,14 @@ export default function Home() {
                         {j.rank}
                       </span>
                     </td>
-                    <td className="p-4 text-slate-300">{j.lp} LP</td>
+                    <td className="p-4 text-slate-300">
+                      {j.lp} LP
+                      {!!j.delta_lp && (
+                        <span className={`ml-1 text-xs ${j.delta_lp > 0 ? 'text-green-400' : 'text-red-400'}`}>
+                          {j.delta_lp > 0 ? '+' : ''}{j.delta_lp}
+                        </span>
+                      )}
+                    </td>
                     <td className="p-4 text-center text-slate-300 font-medium">{j.partidas}</td>
                     <td className="p-4 text-center">
                       <span className="text-emerald-400 font-bold">{j.wins}</span>
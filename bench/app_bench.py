@@ -0,0 +1,15 @@
+"""
+La API de api/index.py con un roster sintético de BENCH_JUGADORES jugadores
+("Jugador{i}#BENCH", los mismos que genera bench/mock_riot.py). La levanta bench/run.py.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import index  # noqa: E402
+
+JUGADORES = int(os.environ.get("BENCH_JUGADORES", "12"))
+index.AMIGOS[:] = [{"nombre": f"Jugador{i}", "tag": "BENCH"} for i in range(JUGADORES)]
+
+app = index.app
@@ -0,0 +1,281 @@
+"""
+Mock local de la API de Riot para benchmarks (account, league, spectator y match-v5).
+
+Genera datos deterministas para un roster de jugadores "Jugador{i}#BENCH", con latencia
+configurable, 429 inyectados y headers de rate limit con conteos reales, para que el
+rate limiter de la API se comporte como contra Riot.
+
+La región va como primer segmento del path, así que la API se apunta con:
+    RIOT_API_BASE="http://127.0.0.1:9000/{region}"
+
+Uso standalone:
+    python bench/mock_riot.py --port 9000 --jugadores 100 --latencia 40 --prob-429 0.01
+"""
+import argparse
+import asyncio
+import hashlib
+import random
+import time
+from collections import Counter, deque
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+CAMPEONES = ["Ahri", "Zed", "Lux", "Jinx", "Thresh", "LeeSin", "Yasuo", "Ezreal", "Leona", "Viego"]
+TIERS = ["IRON", "BRONZE", "SILVER", "GOLD", "PLATINUM", "EMERALD", "DIAMOND"]
+DIVISIONES = ["IV", "III", "II", "I"]
+POSICIONES = ["TOP", "JUNGLE", "MIDDLE", "BOTTOM", "UTILITY"]
+PARTIDA_BASE = 1_000_000
+TEMPORADA_MS = 1767225600000  # Fecha de la partida más vieja que genera el mock
+
+
+def _hash(*partes):
+    return int(hashlib.md5(":".join(map(str, partes)).encode()).hexdigest()[:8], 16)
+
+
+class ConfigMock:
+    def __init__(self, jugadores=12, partidas_por_jugador=40, latencia_ms=0.0, jitter_ms=0.0,
+                 prob_429=0.0, limite_app="500:1,30000:120", limite_metodo="2000:10", prob_en_partida=0.1,
+                 region="la2", region_status=200):
+        self.jugadores = jugadores
+        self.partidas_por_jugador = partidas_por_jugador
+        self.latencia_ms = latencia_ms
+        self.jitter_ms = jitter_ms
+        self.prob_429 = prob_429
+        self.limite_app = limite_app
+        self.limite_metodo = limite_metodo
+        self.prob_en_partida = prob_en_partida
+        self.region = region                # Plataforma que account-v1 reporta para todos
+        self.region_status = region_status  # Status de account-v1 region (!= 200 para simular fallas)
+
+
+class VentanasRiot:
+    """Cuenta requests por ventana como Riot (ventanas fijas que arrancan con la primera request)"""
+
+    def __init__(self, limites):
+        self.limites = [tuple(map(int, v.split(":"))) for v in limites.split(",")]
+        self.ventanas = {segundos: [0, 0.0] for _, segundos in self.limites}
+
+    def registrar(self, ahora):
+        """Suma una request. Devuelve (excedido, header de conteos)"""
+        excedido = False
+        for limite, segundos in self.limites:
+            v = self.ventanas[segundos]
+            if ahora - v[1] >= segundos:
+                v[0], v[1] = 0, ahora
+            v[0] += 1
+            if v[0] > limite:
+                excedido = True
+        conteos = ",".join(f"{self.ventanas[s][0]}:{s}" for _, s in self.limites)
+        return excedido, conteos
+
+
+def crear_app(config: ConfigMock) -> FastAPI:
+    app = FastAPI()
+    estado = {
+        "llamadas": Counter(),
+        "429": 0,
+        "app": {},      # región -> VentanasRiot
+        "metodo": {},   # (región, familia) -> VentanasRiot
+        "tiempos": deque(maxlen=10000),
+    }
+
+    def puuid_de(i):
+        return f"bench-puuid-{i:06d}"
+
+    def indice_de(puuid):
+        try:
+            return int(puuid.rsplit("-", 1)[1])
+        except (IndexError, ValueError):
+            return None
+
+    def total_partidas():
+        # Cada partida tiene 10 jugadores del roster: así cada uno juega ~partidas_por_jugador
+        return max(1, config.jugadores * config.partidas_por_jugador // 10)
+
+    def participantes_de(n):
+        """Jugadores de la partida n: 10 consecutivos (módulo el roster) a partir de 3n"""
+        r = config.jugadores
+        if r >= 10:
+            return [puuid_de((n * 3 + i) % r) for i in range(10)]
+        return [puuid_de(i) for i in range(r)] + [f"random-{n}-{i}" for i in range(10 - r)]
+
+    partidas_de_jugador = {}
+
+    def ids_de(puuid):
+        if not partidas_de_jugador:
+            # Un solo recorrido para todo el roster (por jugador sería O(partidas) en cada uno)
+            for n in range(total_partidas() - 1, -1, -1):
+                for p in participantes_de(n):
+                    partidas_de_jugador.setdefault(p, []).append(n)
+        return partidas_de_jugador.get(puuid, [])
+
+    @app.middleware("http")
+    async def limites_y_latencia(request: Request, call_next):
+        partes = request.url.path.strip("/").split("/")
+        if partes[0].startswith("_"):
+            return await call_next(request)
+
+        region = partes[0]
+        familia = partes[2] if len(partes) > 2 else "otros"
+        estado["llamadas"][familia] += 1
+        inicio = time.perf_counter()
+
+        if config.latencia_ms or config.jitter_ms:
+            await asyncio.sleep((config.latencia_ms + random.random() * config.jitter_ms) / 1000)
+
+        ahora = time.monotonic()
+        app_v = estado["app"].setdefault(region, VentanasRiot(config.limite_app))
+        metodo_v = estado["metodo"].setdefault((region, familia), VentanasRiot(config.limite_metodo))
+        excedido_app, conteo_app = app_v.registrar(ahora)
+        excedido_metodo, conteo_metodo = metodo_v.registrar(ahora)
+        headers = {
+            "X-App-Rate-Limit": config.limite_app,
+            "X-App-Rate-Limit-Count": conteo_app,
+            "X-Method-Rate-Limit": config.limite_metodo,
+            "X-Method-Rate-Limit-Count": conteo_metodo,
+        }
+
+        if excedido_app or excedido_metodo or random.random() < config.prob_429:
+            estado["429"] += 1
+            tipo = "application" if excedido_app else "method" if excedido_metodo else "service"
+            headers.update({"Retry-After": "1", "X-Rate-Limit-Type": tipo})
+            return JSONResponse({"status": {"status_code": 429, "message": "Rate limit exceeded"}},
+                                status_code=429, headers=headers)
+
+        response = await call_next(request)
+        response.headers.update(headers)
+        estado["tiempos"].append(time.perf_counter() - inicio)
+        return response
+
+    @app.get("/{region}/riot/account/v1/accounts/by-riot-id/{nombre}/{tag}")
+    async def account(region: str, nombre: str, tag: str):
+        if not nombre.startswith("Jugador"):
+            return JSONResponse({"status": {"status_code": 404}}, status_code=404)
+        try:
+            i = int(nombre[len("Jugador"):])
+        except ValueError:
+            return JSONResponse({"status": {"status_code": 404}}, status_code=404)
+        if i >= config.jugadores:
+            return JSONResponse({"status": {"status_code": 404}}, status_code=404)
+        return {"puuid": puuid_de(i), "gameName": nombre, "tagLine": tag}
+
+    @app.get("/{region}/riot/account/v1/region/by-game/lol/by-puuid/{puuid}")
+    async def region_de_cuenta(region: str, puuid: str):
+        if indice_de(puuid) is None:
+            return JSONResponse({"status": {"status_code": 404}}, status_code=404)
+        if config.region_status != 200:
+            return JSONResponse({"status": {"status_code": config.region_status}}, status_code=config.region_status)
+        return {"puuid": puuid, "game": "lol", "region": config.region}
+
+    @app.get("/{region}/lol/league/v4/entries/by-puuid/{puuid}")
+    async def league(region: str, puuid: str):
+        h = _hash(puuid, "liga")
+        if h % 8 == 0:
+            return []  # Unranked
+        wins, losses = 20 + h % 80, 20 + (h >> 8) % 80
+        return [{
+            "queueType": "RANKED_SOLO_5x5", "tier": TIERS[h % len(TIERS)],
+            "rank": DIVISIONES[(h >> 4) % 4], "leaguePoints": (h >> 12) % 100,
+            "wins": wins, "losses": losses, "puuid": puuid,
+        }]
+
+    @app.get("/{region}/lol/spectator/v5/active-games/by-summoner/{puuid}")
+    async def spectator(region: str, puuid: str):
+        minuto = int(time.time() // 60)
+        if random.Random(_hash(puuid, minuto)).random() >= config.prob_en_partida:
+            return JSONResponse({"status": {"status_code": 404}}, status_code=404)
+        return {"gameId": minuto, "gameStartTime": minuto * 60000 - 300000, "gameLength": 300}
+
+    @app.get("/{region}/lol/match/v5/matches/by-puuid/{puuid}/ids")
+    async def match_ids(region: str, puuid: str, start: int = 0, count: int = 20,
+                        startTime: int | None = None, endTime: int | None = None):
+        ids = ids_de(puuid)
+        if startTime is not None or endTime is not None:
+            desde = (startTime or 0) * 1000
+            hasta = (endTime or 1 << 62) * 1000
+            ids = [n for n in ids if desde <= TEMPORADA_MS + n * 3600_000 <= hasta]
+        return [f"LA2_{PARTIDA_BASE + n}" for n in ids[start:start + count]]
+
+    @app.get("/{region}/lol/match/v5/matches/{match_id}")
+    async def match(region: str, match_id: str):
+        try:
+            n = int(match_id.rsplit("_", 1)[1]) - PARTIDA_BASE
+        except (IndexError, ValueError):
+            return JSONResponse({"status": {"status_code": 404}}, status_code=404)
+        if not 0 <= n < total_partidas():
+            return JSONResponse({"status": {"status_code": 404}}, status_code=404)
+
+        gana_azul = _hash(match_id, "win") % 2 == 0
+        participantes = []
+        for i, puuid in enumerate(participantes_de(n)):
+            h = _hash(match_id, puuid)
+            azul = i < 5
+            indice = indice_de(puuid)
+            participantes.append({
+                "puuid": puuid,
+                "teamId": 100 if azul else 200,
+                "championName": CAMPEONES[h % len(CAMPEONES)],
+                "teamPosition": POSICIONES[i % 5],
+                "kills": h % 15, "deaths": (h >> 4) % 12, "assists": (h >> 8) % 20,
+                "win": azul == gana_azul,
+                "riotIdGameName": f"Jugador{indice}" if indice is not None else puuid,
+                "riotIdTagline": "BENCH",
+                # Relleno con la forma de match-v5 para que el tamaño sea realista
+                "perks": {"styles": [{"selections": [{"perk": 8000 + j, "var1": j} for j in range(4)]}]},
+                "challenges": {f"stat{j}": h % (j + 7) for j in range(120)},
+            })
+        return {
+            "metadata": {"matchId": match_id, "participants": [p["puuid"] for p in participantes]},
+            "info": {
+                "queueId": 420,
+                "gameCreation": TEMPORADA_MS + n * 3600_000,
+                "gameDuration": 1800,
+                "participants": participantes,
+            },
+        }
+
+    @app.get("/_stats")
+    async def stats():
+        tiempos = sorted(estado["tiempos"])
+        return {
+            "llamadas": dict(estado["llamadas"]),
+            "total": sum(estado["llamadas"].values()),
+            "429": estado["429"],
+            "p50_ms": round(tiempos[len(tiempos) // 2] * 1000, 2) if tiempos else None,
+        }
+
+    @app.post("/_reset")
+    async def reset():
+        estado["llamadas"].clear()
+        estado["429"] = 0
+        estado["tiempos"].clear()
+        return {"ok": True}
+
+    return app
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Mock local de la API de Riot")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--jugadores", type=int, default=12)
+    parser.add_argument("--partidas", type=int, default=40, help="Partidas por jugador")
+    parser.add_argument("--latencia", type=float, default=0, help="Latencia fija (ms)")
+    parser.add_argument("--jitter", type=float, default=0, help="Latencia aleatoria extra (ms)")
+    parser.add_argument("--prob-429", type=float, default=0, help="Probabilidad de 429 de 'service'")
+    parser.add_argument("--limite-app", default="500:1,30000:120")
+    parser.add_argument("--limite-metodo", default="2000:10")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    args = parse_args()
+    config = ConfigMock(
+        jugadores=args.jugadores, partidas_por_jugador=args.partidas, latencia_ms=args.latencia,
+        jitter_ms=args.jitter, prob_429=args.prob_429, limite_app=args.limite_app,
+        limite_metodo=args.limite_metodo,
+    )
+    uvicorn.run(crear_app(config), host=args.host, port=args.port, log_level="warning")
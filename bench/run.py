@@ -0,0 +1,243 @@
+"""
+Benchmarks de /api/ranking y /api/jugador contra el mock local de Riot.
+
+Cada escenario levanta un mock (bench/mock_riot.py) y la API (bench/app_bench.py) en
+procesos nuevos, con su propio TMPDIR para que el caché en disco y el SQLite empiecen
+vacíos. Reporta latencia p50/p95/p99, llamadas a Riot (y 429) y la memoria (RSS) de la API.
+
+Uso:
+    python bench/run.py
+    python bench/run.py --rosters 12,100,1000 --latencia 30 --json bench_output.json
+    python bench/run.py --escenarios ranking_estampida --clientes 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ESCENARIOS = ("ranking_frio", "ranking_caliente", "ranking_estampida", "jugador_frio", "jugador_caliente")
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    indice = max(0, min(len(ordenados) - 1, int(round(p / 100 * len(ordenados) + 0.5)) - 1))
+    return ordenados[indice]
+
+
+def memoria_kb(pid):
+    """(RSS actual, pico de RSS) en KB leyendo /proc (solo Linux)"""
+    valores = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for linea in f:
+                if linea.startswith(("VmRSS:", "VmHWM:")):
+                    clave, valor = linea.split(":", 1)
+                    valores[clave] = int(valor.split()[0])
+    except OSError:
+        pass
+    return valores.get("VmRSS"), valores.get("VmHWM")
+
+
+class Entorno:
+    """Mock de Riot + API en procesos separados, con caché vacío"""
+
+    def __init__(self, args, jugadores):
+        self.args = args
+        self.jugadores = jugadores
+        self.tmpdir = tempfile.TemporaryDirectory(prefix="soloq_bench_")
+        self.puerto_mock = puerto_libre()
+        self.puerto_api = puerto_libre()
+        self.procesos = []
+
+    def __enter__(self):
+        a = self.args
+        self.procesos.append(subprocess.Popen(
+            [sys.executable, os.path.join(BENCH_DIR, "mock_riot.py"), "--port", str(self.puerto_mock),
+             "--jugadores", str(self.jugadores), "--partidas", str(a.partidas),
+             "--latencia", str(a.latencia), "--jitter", str(a.jitter), "--prob-429", str(a.prob_429),
+             "--limite-app", a.limite_app],
+        ))
+        env = {k: v for k, v in os.environ.items() if k not in ("KV_URL", "REDIS_URL")}
+        env.update({
+            "TMPDIR": self.tmpdir.name,
+            "RIOT_API_KEY": "RGAPI-bench",
+            "RIOT_API_BASE": f"http://127.0.0.1:{self.puerto_mock}/{{region}}",
+            "RIOT_APP_RATE_LIMIT": a.limite_app,
+            "BENCH_JUGADORES": str(self.jugadores),
+            # Una sola tanda cubre el roster (el primer request espera solo su primer grupo)
+            "REFRESCO_TANDA": str(self.jugadores),
+            # Sin el ciclo del lifespan el board no se arma antes de medir el escenario frío
+            "REFRESCO_CICLO": "0",
+        })
+        self.api = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app_bench:app", "--app-dir", BENCH_DIR,
+             "--port", str(self.puerto_api), "--log-level", "warning"],
+            env=env, stdout=subprocess.DEVNULL if not a.verbose else None,
+        )
+        self.procesos.append(self.api)
+        self.url_api = f"http://127.0.0.1:{self.puerto_api}"
+        self.url_mock = f"http://127.0.0.1:{self.puerto_mock}"
+        self._esperar(self.url_mock + "/_stats")
+        self._esperar(self.url_api + "/")
+        return self
+
+    def _esperar(self, url, timeout=20):
+        limite = time.time() + timeout
+        while time.time() < limite:
+            try:
+                if httpx.get(url, timeout=1).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.1)
+        raise RuntimeError(f"No respondió a tiempo: {url}")
+
+    def __exit__(self, *exc):
+        for p in self.procesos:
+            p.terminate()
+        for p in self.procesos:
+            try:
+                p.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                p.kill()
+        self.tmpdir.cleanup()
+
+    async def stats_mock(self, client):
+        return (await client.get(self.url_mock + "/_stats")).json()
+
+
+async def medir(client, url, n, concurrencia):
+    """n GETs con `concurrencia` en vuelo. Devuelve latencias (s) y errores"""
+    latencias = []
+    errores = 0
+    pendientes = iter(range(n))
+
+    async def trabajador():
+        nonlocal errores
+        for _ in pendientes:
+            inicio = time.perf_counter()
+            try:
+                r = await client.get(url)
+                ok = r.status_code == 200 and not (isinstance(r.json(), dict) and "error" in r.json())
+            except httpx.HTTPError:
+                ok = False
+            latencias.append(time.perf_counter() - inicio)
+            errores += not ok
+
+    await asyncio.gather(*[trabajador() for _ in range(concurrencia)])
+    return latencias, errores
+
+
+async def correr_escenario(nombre, entorno, args):
+    jugadores = [f"/api/jugador/Jugador{i}/BENCH" for i in range(min(entorno.jugadores, args.detalles))]
+    async with httpx.AsyncClient(timeout=120) as client:
+        if nombre in ("ranking_caliente", "jugador_caliente"):
+            # Calentar primero (no se mide)
+            urls = ["/api/ranking"] if nombre == "ranking_caliente" else jugadores
+            for url in urls:
+                await client.get(entorno.url_api + url)
+
+        antes = await entorno.stats_mock(client)
+        latencias, errores = [], 0
+        if nombre == "ranking_frio":
+            latencias, errores = await medir(client, entorno.url_api + "/api/ranking", 1, 1)
+        elif nombre == "ranking_caliente":
+            latencias, errores = await medir(client, entorno.url_api + "/api/ranking", args.repeticiones, 1)
+        elif nombre == "ranking_estampida":
+            latencias, errores = await medir(client, entorno.url_api + "/api/ranking", args.clientes, args.clientes)
+        else:
+            for url in jugadores:
+                lat, err = await medir(client, entorno.url_api + url, 1, 1)
+                latencias += lat
+                errores += err
+        despues = await entorno.stats_mock(client)
+
+    rss, pico = memoria_kb(entorno.api.pid)
+    return {
+        "escenario": nombre,
+        "jugadores": entorno.jugadores,
+        "requests": len(latencias),
+        "errores": errores,
+        "p50_ms": round(percentil(latencias, 50) * 1000, 2),
+        "p95_ms": round(percentil(latencias, 95) * 1000, 2),
+        "p99_ms": round(percentil(latencias, 99) * 1000, 2),
+        "max_ms": round(max(latencias) * 1000, 2),
+        "llamadas_riot": despues["total"] - antes["total"],
+        "llamadas_por_familia": {
+            k: v - antes["llamadas"].get(k, 0) for k, v in despues["llamadas"].items()
+            if v - antes["llamadas"].get(k, 0)
+        },
+        "riot_429": despues["429"] - antes["429"],
+        "rss_mb": round(rss / 1024, 1) if rss else None,
+        "rss_pico_mb": round(pico / 1024, 1) if pico else None,
+    }
+
+
+def imprimir(resultados):
+    columnas = ("escenario", "jugadores", "requests", "errores", "p50_ms", "p95_ms", "p99_ms",
+                "max_ms", "llamadas_riot", "riot_429", "rss_mb", "rss_pico_mb")
+    anchos = {c: max(len(c), *(len(str(r[c])) for r in resultados)) for c in columnas}
+    print("  ".join(c.ljust(anchos[c]) for c in columnas))
+    for r in resultados:
+        print("  ".join(str(r[c]).ljust(anchos[c]) for c in columnas))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmarks de la API contra un mock de Riot")
+    parser.add_argument("--escenarios", default=",".join(ESCENARIOS))
+    parser.add_argument("--rosters", default="12,100,1000", help="Tamaños de roster a probar")
+    parser.add_argument("--clientes", type=int, default=50, help="Clientes simultáneos en la estampida")
+    parser.add_argument("--repeticiones", type=int, default=200, help="Requests del escenario caliente")
+    parser.add_argument("--detalles", type=int, default=12, help="Jugadores consultados en /api/jugador")
+    parser.add_argument("--partidas", type=int, default=40, help="Partidas por jugador en el mock")
+    parser.add_argument("--latencia", type=float, default=20, help="Latencia del mock (ms)")
+    parser.add_argument("--jitter", type=float, default=10, help="Latencia aleatoria extra del mock (ms)")
+    parser.add_argument("--prob-429", type=float, default=0.0)
+    parser.add_argument("--limite-app", default="500:1,30000:120")
+    parser.add_argument("--json", help="Guardar los resultados en este archivo")
+    parser.add_argument("--verbose", action="store_true", help="Mostrar los logs de la API")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    escenarios = [e for e in args.escenarios.split(",") if e]
+    for e in escenarios:
+        if e not in ESCENARIOS:
+            raise SystemExit(f"Escenario desconocido: {e} (opciones: {', '.join(ESCENARIOS)})")
+
+    resultados = []
+    for jugadores in (int(r) for r in args.rosters.split(",")):
+        for escenario in escenarios:
+            # Entorno nuevo por escenario: cada uno arranca con el caché vacío
+            with Entorno(args, jugadores) as entorno:
+                resultado = asyncio.run(correr_escenario(escenario, entorno, args))
+            resultados.append(resultado)
+            print(f"· {escenario} ({jugadores} jugadores): p50={resultado['p50_ms']}ms "
+                  f"p99={resultado['p99_ms']}ms llamadas={resultado['llamadas_riot']}", flush=True)
+
+    print()
+    imprimir(resultados)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Backfill del historial de SoloQ de la temporada (fuera de los requests de la API).
+
+Recorre con paginación todos los IDs de partidas de cada jugador y los suma a su
+agregado (agregado:{puuid}). El avance se guarda en el caché después de cada página,
+así que si se corta (cold start, crash, rate limit) la próxima corrida sigue donde quedó.
+
+Uso (con las mismas variables de entorno que la API, ej: RIOT_API_KEY y KV_URL):
+    python scripts/backfill.py
+    python scripts/backfill.py --jugador "Tobio#CHL" --fraccion 0.5
+    python scripts/backfill.py --loop 600
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api"))
+
+import index  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Backfill del historial de la temporada")
+    parser.add_argument("--jugador", action="append", default=[],
+                        help="Nombre#TAG a procesar (se puede repetir). Por defecto todos los de los rosters")
+    parser.add_argument("--plataforma", default=index.PLATAFORMA_DEFECTO,
+                        help="Plataforma de los --jugador (la2, euw1, kr...)")
+    parser.add_argument("--fraccion", type=float, default=0.5,
+                        help="Parte del rate limit que puede usar el backfill (default 0.5)")
+    parser.add_argument("--loop", type=int, default=0,
+                        help="Repetir cada N segundos en vez de correr una sola vez")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    amigos = None
+    if args.jugador:
+        amigos = [{**j, "plataforma": args.plataforma} for j in index.parse_riot_ids(args.jugador)]
+
+    while True:
+        await index.ejecutar_backfill(amigos, fraccion=args.fraccion)
+        if not args.loop:
+            break
+        await asyncio.sleep(args.loop)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,45 @@
+"""
+Entorno aislado para los tests contra el mock de Riot (bench/mock_riot.py): caché propio
+en memoria y en un directorio temporal, sin Redis ni SQLite, y las URLs de Riot
+apuntando al mock.
+"""
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(RAIZ, "api"))
+sys.path.insert(0, os.path.join(RAIZ, "bench"))
+
+import index  # noqa: E402
+from mock_riot import crear_app  # noqa: E402
+
+
+@pytest.fixture
+def entorno(monkeypatch, tmp_path):
+    monkeypatch.setattr(index, "RIOT_API_BASE", "http://riot.test/{region}")
+    monkeypatch.setattr(index, "riot_limiter", index.RiotRateLimiter(index.parse_rate_limit("1000:1")))
+    monkeypatch.setattr(index, "redis_client", None)
+    monkeypatch.setattr(index, "store", None)
+    monkeypatch.setattr(index, "cache_memoria", index.CacheMemoria(index.CACHE_MAX_ITEMS))
+    monkeypatch.setattr(index, "cache_disco", index.CacheDisco(str(tmp_path)))
+    monkeypatch.setattr(index, "en_vuelo", {})
+    monkeypatch.setattr(index, "agregado_locks", {})
+    monkeypatch.setattr(index, "plataformas", index.Plataformas(index.PLATAFORMAS_CONSULTADAS_MAX))
+    monkeypatch.setattr(index, "estados", {})
+    return index
+
+
+def correr_con_mock(config, fn):
+    """Corre `await fn(client)` contra el mock. Devuelve (resultado, stats del mock)"""
+    async def main():
+        transporte = httpx.ASGITransport(app=crear_app(config))
+        async with httpx.AsyncClient(transport=transporte, base_url="http://riot.test") as client:
+            resultado = await fn(client)
+            stats = (await client.get("/_stats")).json()
+        return resultado, stats
+
+    return asyncio.run(main())
@@ -0,0 +1,117 @@
+"""
+Agregados de la temporada contra el mock de Riot: solo se piden los IDs nuevos cuando
+hace falta, y la marca de la última partida sumada no se saltea partidas.
+"""
+from conftest import correr_con_mock
+from mock_riot import ConfigMock
+
+PUUID = "bench-puuid-000001"
+
+
+def actualizar(index):
+    async def main(client):
+        return await index.actualizar_agregado(client, PUUID)
+
+    agg, stats = correr_con_mock(ConfigMock(), main)
+    return agg, stats["total"]
+
+
+def test_sin_partida_nueva_en_el_ranking_no_pide_ids(entorno):
+    index = entorno
+    agg, llamadas = actualizar(index)
+    assert llamadas == 1 + index.PRIMERA_PAGINA
+
+    # Sin fila del ranking hay que preguntarle a Riot si jugó
+    _, llamadas = actualizar(index)
+    assert llamadas == 1
+
+    # El refresco del ranking ya vio que su última partida es la que está sumada
+    index.estados[PUUID] = {"ultima_partida": agg["ultima_partida"]}
+    _, llamadas = actualizar(index)
+    assert llamadas == 0
+
+    # Jugó otra: se piden los IDs
+    index.estados[PUUID] = {"ultima_partida": "LA2_9999999"}
+    _, llamadas = actualizar(index)
+    assert llamadas == 1
+
+
+def test_ids_nuevas_corta_en_la_marca(entorno):
+    index = entorno
+
+    async def main(client):
+        todas = await index.ids_nuevas(client, PUUID, None)
+        return todas, await index.ids_nuevas(client, PUUID, todas[5])
+
+    (todas, nuevas), _ = correr_con_mock(ConfigMock(), main)
+    assert nuevas == todas[:5]
+
+
+def test_sumar_partidas_para_en_la_primera_que_falla(entorno):
+    index = entorno
+    partidas = {"LA2_1": index.PARTIDA_FALTANTE, "LA2_2": None, "LA2_3": index.PARTIDA_FALTANTE}
+    agg = index.agregado_vacio("la2")
+    # La que Riot no tiene (404) cuenta como avanzada; la que falló corta
+    assert index.sumar_partidas(agg, PUUID, ["LA2_1", "LA2_2", "LA2_3"], partidas) == 1
+    assert index.sumar_partidas(agg, PUUID, ["LA2_1", "LA2_3"], partidas) == 2
+
+
+def test_la_marca_no_saltea_una_partida_que_fallo(entorno, monkeypatch):
+    index = entorno
+    get_partida = index.get_partida
+    fallidas = set()
+
+    async def get_partida_con_fallas(client, mid):
+        return None if mid in fallidas else await get_partida(client, mid)
+
+    monkeypatch.setattr(index, "get_partida", get_partida_con_fallas)
+
+    async def preparar(client):
+        ids = await index.ids_nuevas(client, PUUID, None)
+        agg = index.agregado_vacio("la2")
+        agg["ultima_partida"] = ids[5]
+        agg["backfill"]["completo"] = True
+        assert await index.guardar_agregado(PUUID, agg)
+        return ids
+
+    ids, _ = correr_con_mock(ConfigMock(), preparar)
+
+    # De las 5 nuevas (se suman de la más vieja a la más nueva) falla la del medio
+    fallidas.add(ids[2])
+    agg, _ = actualizar(index)
+    assert agg["partidas"] == 2
+    assert agg["ultima_partida"] == ids[3]
+
+    # En el próximo request se retoma desde la que falló
+    fallidas.clear()
+    agg, llamadas = actualizar(index)
+    assert agg["partidas"] == 5
+    assert agg["ultima_partida"] == ids[0]
+    # IDs + la que falló: las posteriores quedaron en caché la primera vez
+    assert llamadas == 1 + 1
+
+
+def partida_con(index, companero, win=True):
+    jugadores = [(PUUID, "Yo"), (companero, companero)]
+    return index.PartidaCompacta(index.COLA_SOLOQ, index.TEMPORADA_INICIO + 1, [
+        index.Participante(p, 100, "Ahri", 1, 1, 1, win, nombre, "T", "MIDDLE") for p, nombre in jugadores
+    ])
+
+
+def test_duo_frecuente_no_pierde_partidas_entre_randoms(entorno, monkeypatch):
+    index = entorno
+    monkeypatch.setattr(index, "DUOS_MAX", 5)
+    agg = index.agregado_vacio("la2")
+    for i in range(60):
+        # Una de cada tres con el duo; el resto con un random distinto cada vez
+        index.acumular_partida(agg, PUUID, partida_con(index, "duo" if i % 3 == 0 else f"random{i}"))
+
+    assert len(agg["duos"]) <= 5
+    assert index.partidas_duo(agg["duos"]["duo"]) == 20
+    assert index.resumen_agregado(agg)["duo"] == {"nombre": "duo#T", "partidas": 20, "winrate": 100.0}
+
+
+def test_locks_de_agregados_no_se_acumulan(entorno):
+    index = entorno
+    actualizar(index)
+    assert index.agregado_locks == {}
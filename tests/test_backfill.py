@@ -0,0 +1,129 @@
+"""
+Backfill de la temporada contra el mock de Riot: se retoma desde el checkpoint guardado
+y no vuelve a pedir a Riot lo que ya sumó, ni cuando otro proceso escribe el agregado
+en el medio ni cuando la capa compartida no deja guardar.
+"""
+import asyncio
+import time
+
+import pytest
+
+from conftest import correr_con_mock
+from mock_riot import ConfigMock
+
+PUUID = "bench-puuid-000001"
+KEY = f"agregado:{PUUID}"
+URL_IDS = f"/la2/lol/match/v5/matches/by-puuid/{PUUID}/ids?count=100"
+
+
+def guardar_checkpoint(index, revisadas=10):
+    """Primera página corta del backfill, guardada. Devuelve las llamadas que hizo al mock"""
+    async def main(client):
+        agg = index.agregado_vacio("la2")
+        assert await index.paso_backfill(client, agg, PUUID, revisadas)
+        assert await index.guardar_agregado(PUUID, agg)
+
+    _, stats = correr_con_mock(ConfigMock(), main)
+    return stats["total"]
+
+
+def contar_pasos(index, monkeypatch, despues=None):
+    """Cuenta las páginas que pide el backfill; `despues(n)` corre al terminar la página n"""
+    pasos = []
+    paso_real = index.paso_backfill
+
+    async def paso(client, agg, puuid, count=index.IDS_POR_PAGINA):
+        ok = await paso_real(client, agg, puuid, count)
+        pasos.append(ok)
+        if despues:
+            despues(len(pasos))
+        return ok
+
+    monkeypatch.setattr(index, "paso_backfill", paso)
+    return pasos
+
+
+def pisar_agregado(index):
+    """Otro proceso escribe el agregado (sube su rev) mientras el backfill suma una página"""
+    actual = index.cache_disco.get(KEY, time.time())
+    agg = actual[1] if actual else index.agregado_vacio("la2")
+    index.cache_disco.set(KEY, {**agg, "rev": agg["rev"] + 1}, time.time() + index.AGREGADO_TTL)
+
+
+def backfill_y_total(index):
+    async def main(client):
+        agg = await index.backfill_jugador(client, PUUID)
+        ids = (await client.get(URL_IDS)).json()
+        return agg, len(ids)
+
+    (agg, total), stats = correr_con_mock(ConfigMock(), main)
+    return agg, total, stats["total"] - 1  # Sin la llamada que cuenta los IDs
+
+
+def test_retoma_desde_el_checkpoint(entorno):
+    index = entorno
+    assert guardar_checkpoint(index) == 1 + 10  # Página de IDs + 10 partidas
+
+    agg, total, llamadas = backfill_y_total(index)
+    assert agg["backfill"]["completo"]
+    assert agg["partidas"] == total
+    # Solo la página que sigue y las partidas que faltaban
+    assert llamadas == 1 + (total - 10)
+    assert index.cache_disco.get(KEY, time.time())[1]["partidas"] == total
+
+
+def test_conflicto_rehace_la_pagina_sin_volver_a_pedir_partidas(entorno, monkeypatch):
+    index = entorno
+    pasos = contar_pasos(index, monkeypatch, despues=lambda n: n == 1 and pisar_agregado(index))
+
+    agg, total, llamadas = backfill_y_total(index)
+    assert len(pasos) == 2
+    assert agg["backfill"]["completo"]
+    assert agg["partidas"] == total
+    # La página de IDs se pide dos veces; las partidas quedaron en caché la primera
+    assert llamadas == 2 + total
+
+
+def test_conflictos_seguidos_tienen_tope(entorno, monkeypatch):
+    index = entorno
+    pasos = contar_pasos(index, monkeypatch, despues=lambda n: pisar_agregado(index))
+
+    agg, total, llamadas = backfill_y_total(index)
+    assert len(pasos) == index.BACKFILL_CONFLICTOS_MAX + 1
+    assert not agg["backfill"]["completo"]
+    assert llamadas == len(pasos) + total
+
+
+def test_error_al_guardar_corta_en_el_checkpoint(entorno, monkeypatch):
+    index = entorno
+    guardar_checkpoint(index)
+    pasos = contar_pasos(index, monkeypatch)
+
+    def disco_lleno(*args):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(index.cache_disco, "set", disco_lleno)
+    agg, total, llamadas = backfill_y_total(index)
+    assert len(pasos) == 1
+    # Devuelve lo último guardado, no la página que no se pudo guardar
+    assert agg["backfill"]["start"] == 10
+    assert not agg["backfill"]["completo"]
+    assert llamadas == 1 + (total - 10)
+
+
+def test_guardar_agregado_distingue_conflicto_de_error(entorno, monkeypatch):
+    index = entorno
+    agg = index.agregado_vacio("la2")
+    pisar_agregado(index)
+
+    async def guardar():
+        return await index.guardar_agregado(PUUID, agg)
+
+    assert asyncio.run(guardar()) is False
+
+    def falla(*args):
+        raise OSError("disco roto")
+
+    monkeypatch.setattr(index.cache_disco, "get", falla)
+    with pytest.raises(index.CacheNoDisponible):
+        asyncio.run(guardar())
@@ -0,0 +1,117 @@
+"""
+Single-flight y caché negativo de cache_o_buscar: los misses concurrentes de una key
+esperan una sola búsqueda y los 404 se sirven del caché mientras dura NEGATIVO_TTL.
+"""
+import asyncio
+import time
+
+import pytest
+
+from conftest import correr_con_mock
+from mock_riot import ConfigMock
+
+
+def test_misses_concurrentes_una_sola_llamada(entorno):
+    index = entorno
+
+    async def main(client):
+        return await asyncio.gather(*[
+            index.get_puuid(client, "Jugador3", "BENCH", verificar=False) for _ in range(20)
+        ])
+
+    puuids, stats = correr_con_mock(ConfigMock(latencia_ms=20), main)
+    assert puuids == ["bench-puuid-000003"] * 20
+    assert stats["total"] == 1
+
+
+def test_404_se_sirve_del_cache(entorno):
+    index = entorno
+
+    async def main(client):
+        primero = await index.get_puuid(client, "Nadie", "X", verificar=False)
+        segundo = await index.get_puuid(client, "Nadie", "X", verificar=False)
+        return primero, segundo
+
+    (primero, segundo), stats = correr_con_mock(ConfigMock(), main)
+    assert primero is None and segundo is None
+    assert stats["total"] == 1
+    expira, valor = index.cache_memoria.get("puuid:Nadie:X", time.time())
+    assert valor == index.NO_ENCONTRADO
+    assert expira - time.time() <= index.NEGATIVO_TTL
+
+
+def test_fallo_no_se_guarda(entorno):
+    index = entorno
+    llamadas = []
+
+    async def buscar():
+        llamadas.append(1)
+        return None  # 429 o timeout
+
+    async def main():
+        await index.cache_o_buscar("test:falla", buscar, ttl=60)
+        await index.cache_o_buscar("test:falla", buscar, ttl=60)
+
+    asyncio.run(main())
+    assert len(llamadas) == 2
+
+
+def test_relee_la_memoria_despues_del_miss_de_redis(entorno, monkeypatch):
+    """La búsqueda en vuelo terminó mientras se leía Redis: se usa su valor sin buscar de nuevo"""
+    index = entorno
+    get_cache = index.get_cache
+
+    async def get_cache_lento(key):
+        valor = await get_cache(key)
+        index.cache_memoria.set(key, "de otro request", time.time() + 60)
+        return valor
+
+    async def buscar():
+        raise AssertionError("no debería buscar")
+
+    monkeypatch.setattr(index, "get_cache", get_cache_lento)
+    assert asyncio.run(index.cache_o_buscar("test:carrera", buscar, ttl=60)) == "de otro request"
+
+
+def test_cancelar_uno_que_espera_no_cancela_la_busqueda(entorno):
+    index = entorno
+
+    async def buscar():
+        await asyncio.sleep(0.05)
+        return "valor"
+
+    async def main():
+        lider = asyncio.create_task(index.cache_o_buscar("test:shield", buscar, ttl=60))
+        await asyncio.sleep(0)
+        espera = asyncio.create_task(index.cache_o_buscar("test:shield", buscar, ttl=60))
+        await asyncio.sleep(0.01)
+        espera.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await espera
+        return await lider
+
+    assert asyncio.run(main()) == "valor"
+    assert index.cache_memoria.get("test:shield", time.time())[1] == "valor"
+
+
+def test_cancelar_al_que_busca_resuelve_a_los_demas_con_none(entorno):
+    index = entorno
+
+    async def buscar():
+        await asyncio.sleep(1)
+        return "valor"
+
+    async def main():
+        lider = asyncio.create_task(index.cache_o_buscar("test:cancelado", buscar, ttl=60))
+        await asyncio.sleep(0)
+        espera = asyncio.create_task(index.cache_o_buscar("test:cancelado", buscar, ttl=60))
+        await asyncio.sleep(0.01)
+        lider.cancel()
+        resultado = await espera
+        with pytest.raises(asyncio.CancelledError):
+            await lider
+        return resultado
+
+    assert asyncio.run(main()) is None
+    assert "test:cancelado" not in index.en_vuelo
+    assert index.cache_memoria.get("test:cancelado", time.time()) is None
@@ -0,0 +1,74 @@
+"""
+Plataforma de cada jugador: la que confirma account-v1 (region/by-game/lol) gana a la
+?plataforma= con que se agregó, y los miembros de un roster no pagan la verificación
+(la eligió un admin). Si Riot falla no se vuelve a preguntar en cada request.
+"""
+from conftest import correr_con_mock
+from mock_riot import ConfigMock
+
+
+def test_plataforma_verificada_corrige_la_del_alta(entorno):
+    index = entorno
+
+    async def main(client):
+        return await index.get_puuid(client, "Jugador1", "BENCH", "la2")
+
+    puuid, stats = correr_con_mock(ConfigMock(region="euw1"), main)
+    assert stats["total"] == 2  # by-riot-id + region
+    assert index.plataforma_de(puuid) == "euw1"
+
+    roster = index.Roster("test")
+    roster.agregar({"nombre": "Jugador1", "tag": "BENCH", "plataforma": "la2", "puuid": puuid})
+    assert roster.miembros["jugador1#bench"]["plataforma"] == "euw1"
+    assert index.plataforma_de(puuid) == "euw1"
+
+
+def test_miembro_de_roster_no_verifica(entorno):
+    index = entorno
+
+    async def main(client):
+        return await index.get_puuid(client, "Jugador2", "BENCH", "euw1", verificar=False)
+
+    puuid, stats = correr_con_mock(ConfigMock(), main)
+    assert stats["total"] == 1  # Solo by-riot-id
+
+    roster = index.Roster("test")
+    roster.agregar({"nombre": "Jugador2", "tag": "BENCH", "plataforma": "euw1", "puuid": puuid})
+    assert roster.miembros["jugador2#bench"]["plataforma"] == "euw1"
+    assert index.plataforma_de(puuid) == "euw1"
+    assert index.plataformas.verificada(puuid)
+
+
+def test_falla_de_riot_no_se_repite_en_cada_request(entorno):
+    index = entorno
+
+    async def main(client):
+        return [await index.get_puuid(client, "Jugador3", "BENCH", "euw1") for _ in range(3)]
+
+    puuids, stats = correr_con_mock(ConfigMock(region_status=503), main)
+    assert stats["total"] == 2  # by-riot-id + una sola consulta de región
+    assert index.plataforma_de(puuids[0]) == "euw1"  # Queda la sugerida, sin verificar
+    assert not index.plataformas.verificada(puuids[0])
+
+
+def test_consultadas_acotadas_y_miembros_fijos(entorno, monkeypatch):
+    index = entorno
+    plataformas = index.Plataformas(max_items=3)
+    monkeypatch.setattr(index, "plataformas", plataformas)
+    monkeypatch.setattr(index, "rosters", {})
+    monkeypatch.setattr(index, "ultimo_intento", {})
+    roster = index.rosters["test"] = index.Roster("test")
+    roster.agregar({"nombre": "Fijo", "tag": "T", "plataforma": "kr", "puuid": "fijo"})
+
+    for i in range(10):
+        plataformas.confirmar(f"consultado{i}", "euw1")
+    assert len(plataformas.consultadas) == 3
+    assert index.plataforma_de("consultado0") == index.PLATAFORMA_DEFECTO
+    assert index.plataforma_de("fijo") == "kr"
+
+    # Al salir del último roster pasa al LRU (y ya no se guarda su último intento de refresco)
+    index.ultimo_intento["fijo#t"] = 1.0
+    roster.quitar("fijo#t")
+    assert "fijo" not in plataformas.fijas
+    assert "fijo#t" not in index.ultimo_intento
+    assert index.plataforma_de("fijo") == "kr"
@@ -0,0 +1,81 @@
+"""
+Rate limiter contra el mock local de Riot (bench/mock_riot.py), sin red ni API key.
+
+El mock cuenta las ventanas como Riot (empiezan con la primera request que llega, no
+con la que se envía) y responde 429 al pasarse, así que estos tests fallan si el
+limiter deja salir más de lo que Riot acepta.
+
+    python -m pytest tests
+"""
+import asyncio
+
+import pytest
+
+from conftest import correr_con_mock
+from mock_riot import ConfigMock
+
+URL_LIGA = "http://riot.test/la2/lol/league/v4/entries/by-puuid/bench-puuid-000001"
+
+
+def correr(index, monkeypatch, config, limites_app, llamadas, url=URL_LIGA):
+    """Hace `llamadas` fetch_riot concurrentes contra el mock. Devuelve (statuses, stats del mock)"""
+    monkeypatch.setattr(index, "riot_limiter", index.RiotRateLimiter(index.parse_rate_limit(limites_app)))
+
+    async def main(client):
+        respuestas = await asyncio.gather(*[index.fetch_riot(client, url) for _ in range(llamadas)])
+        return [r.status_code for r in respuestas]
+
+    return correr_con_mock(config, main)
+
+
+def test_parse_rate_limit(entorno):
+    index = entorno
+    assert index.parse_rate_limit("20:1,100:120") == [(20, 1), (100, 120)]
+    assert index.parse_rate_limit("1:1, x, 3:4") == [(1, 1), (3, 4)]
+    assert index.parse_rate_limit(None) == []
+
+
+def test_clasificar_endpoint_mock(entorno):
+    index = entorno
+    assert index.clasificar_endpoint(URL_LIGA) == ("riot.test/la2", "league")
+    assert index.clasificar_endpoint("https://americas.api.riotgames.com/riot/account/v1/x") == (
+        "americas.api.riotgames.com", "account")
+
+
+def test_bucket_espera_y_rellena(entorno):
+    index = entorno
+    bucket = index.RateLimitBucket([(2, 1)])
+    bucket.consumir(10.0)
+    bucket.consumir(10.1)
+    assert bucket.espera(10.2) == pytest.approx(0.8)
+    # La primera respuesta de la ventana la ancla: Riot empezó a contar cuando llegó la request
+    bucket.anclar(10.3)
+    bucket.anclar(10.4)  # Las siguientes ya no la mueven
+    assert bucket.espera(10.5) == pytest.approx(0.8)
+    assert bucket.espera(11.3) == 0
+
+
+@pytest.mark.parametrize("latencia,jitter", [(50, 20), (60, 10), (5, 60)])
+def test_sin_429_de_aplicacion_con_latencia(entorno, monkeypatch, latencia, jitter):
+    """Ráfaga de 80 llamadas con latencia variable y límite 20:1: ningún 429 de aplicación"""
+    config = ConfigMock(latencia_ms=latencia, jitter_ms=jitter, limite_app="20:1")
+    statuses, stats = correr(entorno, monkeypatch, config, "20:1", 80)
+    assert statuses == [200] * 80
+    assert stats["429"] == 0
+    assert stats["total"] == 80
+
+
+def test_limite_de_metodo_aprendido_de_los_headers(entorno, monkeypatch):
+    """El límite de método no se configura: sale de X-Method-Rate-Limit de la primera respuesta"""
+    config = ConfigMock(latencia_ms=20, jitter_ms=10, limite_app="100:1", limite_metodo="10:1")
+    statuses, stats = correr(entorno, monkeypatch, config, "100:1", 30)
+    assert statuses == [200] * 30
+    # Antes de conocer el límite de método puede salir una primera tanda de más
+    assert stats["429"] <= 20
+
+
+def test_429_de_service_se_reintenta(entorno, monkeypatch):
+    config = ConfigMock(prob_429=1.0)
+    statuses, stats = correr(entorno, monkeypatch, config, "100:1", 1)
+    assert statuses == [429]
+    assert stats["total"] == 4  # 1 + 3 reintentos
@@ -0,0 +1,53 @@
+"""
+Eventos "cambios" del stream del ranking: cuando un jugador pasa a otros, los que quedaron
+entre su posición vieja y la nueva también van en el evento con su posición al día.
+"""
+import json
+
+import pytest
+
+
+@pytest.fixture
+def board(entorno, monkeypatch):
+    index = entorno
+    monkeypatch.setattr(index, "rosters", {})
+    monkeypatch.setattr(index, "snapshots", {})
+    monkeypatch.setattr(index, "difusor", index.Difusor())
+    roster = index.rosters["test"] = index.Roster("test")
+    for i, puntos in enumerate([500, 400, 300, 200, 100]):
+        puuid = f"p{i}"
+        roster.agregar({"nombre": f"J{i}", "tag": "T", "puuid": puuid})
+        index.aplicar_estado(puuid, {"nombre": f"J{i}", "tag": "T", "puntos_totales": puntos})
+    roster.board.tomar_movidos()
+    return index, index.difusor.suscribir("test")
+
+
+def evento(sub):
+    datos = json.loads(sub.cola.get_nowait())
+    return {f["nombre"]: f["posicion"] for f in datos["filas"]}, datos["quitados"]
+
+
+def test_los_que_fueron_pasados_van_en_el_evento(board):
+    index, sub = board
+    # J3 (4°) pasa a J1 y J2: queda 2° y ellos bajan uno
+    index.aplicar_estado("p3", {"nombre": "J3", "tag": "T", "puntos_totales": 450})
+    index.difusor.marcar("p3")
+    index.difusor.publicar()
+    filas, _ = evento(sub)
+    assert filas == {"J3": 2, "J1": 3, "J2": 4}
+
+
+def test_al_quitar_suben_los_de_abajo(board):
+    index, sub = board
+    miembro = index.rosters["test"].quitar("j1#t")
+    index.difusor.marcar_quitado("test", miembro)
+    index.difusor.publicar()
+    filas, quitados = evento(sub)
+    assert quitados == [{"nombre": "J1", "tag": "T"}]
+    assert filas == {"J2": 2, "J3": 3, "J4": 4}
+
+
+def test_sin_cambios_de_posicion_no_hay_evento(board):
+    index, sub = board
+    index.difusor.publicar()
+    assert sub.cola.empty()